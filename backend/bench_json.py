@@ -0,0 +1,81 @@
+"""
+Microbenchmark da serialização das respostas: caminho antigo (jsonable_encoder + JSONResponse
+sobre dicts do DictCursor) contra RespostaJSON sobre as dataclasses do repositório, e
+send_json (json da stdlib) contra codificar_ws nos frames do socket.
+
+Uso: python bench_json.py [repeticoes]
+"""
+import json
+import sys
+import timeit
+from dataclasses import asdict
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from main import (
+    RespostaJSON, codificar_ws, orjson,
+    TerapeutaDiretorio, SessaoListagem, MensagemChat,
+)
+
+AGORA = datetime(2025, 3, 10, 14, 30)
+
+def terapeutas(n: int) -> list:
+    return [
+        TerapeutaDiretorio(i, f"Terapeuta {i}", f"terapeuta{i}@nopanic.com", "Ansiedade, TCC",
+                           f"06/{100000 + i}", "Seg a Sex, 08h às 18h", i % 40)
+        for i in range(1, n + 1)
+    ]
+
+def sessoes(n: int) -> list:
+    return [
+        SessaoListagem(i % 50, f"Paciente {i % 50}", f"paciente{i % 50}@nopanic.com", "agendada",
+                       AGORA + timedelta(hours=i), None, None, 50, i, "online",
+                       f"3f2b8c1e-0000-4000-8000-{i:012d}")
+        for i in range(1, n + 1)
+    ]
+
+def mensagens(n: int) -> list:
+    return [
+        MensagemChat(i, 1 + i % 2, "Oi, tudo bem? Podemos remarcar a sessão de quinta para sexta?",
+                     (AGORA + timedelta(minutes=i)).isoformat())
+        for i in range(1, n + 1)
+    ]
+
+CARGAS = [
+    ("/terapeutas (20)", lambda: {"metadata": {"total_records": 500, "next_cursor": 20}, "terapeutas": terapeutas(20)}),
+    ("/terapeutas (100)", lambda: {"metadata": {"total_records": 500, "next_cursor": 100}, "terapeutas": terapeutas(100)}),
+    ("/sessoes (100)", lambda: sessoes(100)),
+    ("/sessoes (500)", lambda: sessoes(500)),
+    ("/chat/historico (50)", lambda: mensagens(50)),
+    ("/chat/historico (200)", lambda: mensagens(200)),
+]
+
+def como_dicts(carga):
+    """O que as rotas devolviam antes: um dict por linha (DictCursor)."""
+    if isinstance(carga, list):
+        return [asdict(linha) for linha in carga]
+    return {chave: como_dicts(valor) if isinstance(valor, list) else valor for chave, valor in carga.items()}
+
+def medir(funcao, repeticoes: int) -> float:
+    return min(timeit.repeat(funcao, number=repeticoes, repeat=5)) / repeticoes * 1e6
+
+def main(repeticoes: int):
+    print(f"orjson: {'sim' if orjson else 'não (fallback para json)'}; tempos em µs por resposta\n")
+    print(f"{'carga':<24}{'antigo':>12}{'novo':>12}{'ganho':>9}")
+    for nome, gerar in CARGAS:
+        carga = gerar()
+        dicts = como_dicts(carga)
+        antigo = medir(lambda: JSONResponse(jsonable_encoder(dicts)).body, repeticoes)
+        novo = medir(lambda: RespostaJSON(carga).body, repeticoes)
+        print(f"{nome:<24}{antigo:>12.1f}{novo:>12.1f}{antigo / novo:>8.1f}x")
+
+    frame = {"from_id": 42, "message": "Estou tendo uma crise agora, pode falar?", "timestamp": AGORA}
+    frame_antigo = dict(frame, timestamp=str(AGORA))
+    antigo = medir(lambda: json.dumps(frame_antigo, separators=(",", ":"), ensure_ascii=False), repeticoes * 10)
+    novo = medir(lambda: codificar_ws(frame), repeticoes * 10)
+    print(f"{'frame do socket':<24}{antigo:>12.2f}{novo:>12.2f}{antigo / novo:>8.1f}x")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
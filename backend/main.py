@@ -1,20 +1,31 @@
 from fastapi import FastAPI, Request, HTTPException, status, WebSocket, WebSocketDisconnect, Query
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse, Response
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
-from contextlib import asynccontextmanager
+from contextlib import AsyncExitStack, asynccontextmanager, contextmanager
 
 from pydantic import BaseModel, EmailStr
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Set
+from dataclasses import dataclass, asdict, is_dataclass
 import json
-from datetime import datetime
+import logging
+import re
+from datetime import date, datetime, timedelta
+from decimal import Decimal
 
 import aiomysql
 import bcrypt
 from dotenv import load_dotenv
 import os
 import asyncio
-from functools import partial
+import heapq
+import time
+import uuid
+import zlib
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from functools import partial, lru_cache
+from concurrent.futures import ThreadPoolExecutor
 
 # Carrega o .env
 load_dotenv()
@@ -26,63 +37,1280 @@ DB_PASSWORD = os.getenv("DB_PASSWORD", "")
 DB_NAME = os.getenv("DB_NAME", "terapia_db")
 DB_PORT = int(os.getenv("DB_PORT", 3306))
 POOL_SIZE = int(os.getenv("POOL_SIZE", 5))
+POOL_MIN_SIZE = int(os.getenv("POOL_MIN_SIZE", 2))
+# Quanto uma requisição espera por conexão antes de receber 503 + Retry-After
+POOL_ACQUIRE_TIMEOUT = float(os.getenv("POOL_ACQUIRE_TIMEOUT", 5))
+# Pool próprio do chat (sockets e gravação em lote), para não disputar conexões com as rotas HTTP.
+# 0 = usa o pool principal.
+CHAT_POOL_SIZE = int(os.getenv("CHAT_POOL_SIZE", 2))
+# Réplica de leitura opcional, usada pelas listagens GET que toleram alguns ms de atraso
+DB_READ_HOST = os.getenv("DB_READ_HOST")
+DB_READ_PORT = int(os.getenv("DB_READ_PORT", DB_PORT))
+READ_POOL_SIZE = int(os.getenv("READ_POOL_SIZE", POOL_SIZE))
+
+# --- Métricas ---
+# Exposição no formato texto do Prometheus em /metrics, sem dependências externas.
+# No caminho quente cada observação custa um bisect e dois incrementos.
+BUCKETS_LATENCIA = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histograma:
+    def __init__(self, nome: str, ajuda: str, label: str, buckets: tuple = BUCKETS_LATENCIA):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.label = label
+        self.buckets = buckets
+        # valor do label -> [contagens por bucket (+Inf no fim), soma]
+        self.series: Dict[str, list] = {}
+
+    def observe(self, valor_label: str, segundos: float):
+        serie = self.series.get(valor_label)
+        if serie is None:
+            serie = self.series[valor_label] = [[0] * (len(self.buckets) + 1), 0.0]
+        serie[0][bisect_left(self.buckets, segundos)] += 1
+        serie[1] += segundos
+
+    def render(self) -> List[str]:
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} histogram"]
+        for valor, (contagens, soma) in self.series.items():
+            acumulado = 0
+            for limite, n in zip(self.buckets, contagens):
+                acumulado += n
+                linhas.append(f'{self.nome}_bucket{{{self.label}="{valor}",le="{limite}"}} {acumulado}')
+            acumulado += contagens[-1]
+            linhas.append(f'{self.nome}_bucket{{{self.label}="{valor}",le="+Inf"}} {acumulado}')
+            linhas.append(f'{self.nome}_sum{{{self.label}="{valor}"}} {soma}')
+            linhas.append(f'{self.nome}_count{{{self.label}="{valor}"}} {acumulado}')
+        return linhas
+
+class Metricas:
+    def __init__(self):
+        self.histogramas: List[Histograma] = []
+        # nome -> (ajuda, função que devolve o valor atual); lidos só quando /metrics é chamado
+        self.gauges: Dict[str, tuple] = {}
+
+    def histograma(self, nome: str, ajuda: str, label: str) -> Histograma:
+        h = Histograma(nome, ajuda, label)
+        self.histogramas.append(h)
+        return h
+
+    def gauge(self, nome: str, ajuda: str, funcao, label: Optional[str] = None):
+        """Com `label`, a função devolve {valor_do_label: valor}."""
+        self.gauges[nome] = (ajuda, funcao, label)
+
+    def render(self) -> str:
+        linhas = []
+        for h in self.histogramas:
+            linhas.extend(h.render())
+        for nome, (ajuda, funcao, label) in self.gauges.items():
+            try:
+                valor = funcao()
+            except Exception:
+                continue
+            linhas.append(f"# HELP {nome} {ajuda}")
+            linhas.append(f"# TYPE {nome} gauge")
+            if label is None:
+                linhas.append(f"{nome} {valor}")
+            else:
+                linhas.extend(f'{nome}{{{label}="{chave}"}} {v}' for chave, v in valor.items())
+        return "\n".join(linhas) + "\n"
+
+metricas = Metricas()
+http_latencia = metricas.histograma("http_request_duration_seconds", "Latência das requisições HTTP por rota", "rota")
+sql_latencia = metricas.histograma("sql_query_duration_seconds", "Tempo de execução SQL por rótulo", "rotulo")
+pool_espera = metricas.histograma("db_pool_acquire_seconds", "Espera para obter conexão do pool", "pool")
+
+class MetricsMiddleware:
+    """Middleware ASGI puro (mais barato que @app.middleware) que mede a latência por template de rota."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        inicio = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            rota = scope.get("route")
+            http_latencia.observe(
+                f'{scope["method"]} {rota.path if rota else "desconhecida"}', time.perf_counter() - inicio
+            )
+
+_ROTULO_COMENTARIO = re.compile(r"^\s*/\*\s*([\w.-]+)\s*\*/")
+
+@lru_cache(maxsize=1024)
+def rotulo_sql(query: str) -> str:
+    """`/* rotulo */` no início da query, ou verbo_tabela (ex.: select_usuario)."""
+    m = _ROTULO_COMENTARIO.match(query)
+    if m:
+        return m.group(1)
+    verbo = query.split(None, 1)[0].lower() if query.strip() else "vazio"
+    if verbo == "update":
+        m = re.match(r"\s*UPDATE\s+`?(\w+)", query, re.I)
+    else:
+        m = re.search(r"\b(?:FROM|INTO)\s+`?(\w+)", query, re.I)
+    return f"{verbo}_{m.group(1)}" if m else verbo
+
+class _MedeExecucao:
+    async def execute(self, query, args=None):
+        inicio = time.perf_counter()
+        try:
+            return await super().execute(query, args)
+        finally:
+            sql_latencia.observe(rotulo_sql(query), time.perf_counter() - inicio)
+
+class CursorMedido(_MedeExecucao, aiomysql.Cursor):
+    pass
+
+class DictCursorMedido(_MedeExecucao, aiomysql.DictCursor):
+    pass
+
+class SSDictCursorMedido(_MedeExecucao, aiomysql.SSDictCursor):
+    pass
+
+class PoolMedido:
+    """
+    Envolve o pool do aiomysql medindo a espera por conexão e limitando-a a `timeout` segundos:
+    pool esgotado vira 503 com Retry-After em vez de fila sem fim. O resto é repassado ao pool original.
+    """
+
+    def __init__(self, pool, nome: str = "principal", timeout: float = POOL_ACQUIRE_TIMEOUT):
+        self._pool = pool
+        self.nome = nome
+        self.timeout = timeout
+        self.esgotamentos = 0
+
+    def acquire(self):
+        return _AcquireMedido(self)
+
+    def __getattr__(self, nome):
+        return getattr(self._pool, nome)
+
+    @property
+    def em_uso(self) -> int:
+        return self._pool.size - self._pool.freesize
+
+class _AcquireMedido:
+    __slots__ = ("pool", "conn")
+
+    def __init__(self, pool: PoolMedido):
+        self.pool = pool
+        self.conn = None
+
+    async def __aenter__(self):
+        pool = self.pool
+        inicio = time.perf_counter()
+        try:
+            if pool._pool.freesize:
+                # Caminho comum: há conexão livre, sem o custo de wait_for
+                self.conn = await pool._pool.acquire()
+            else:
+                self.conn = await asyncio.wait_for(pool._pool.acquire(), pool.timeout)
+        except asyncio.TimeoutError:
+            pool.esgotamentos += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Banco de dados ocupado, tente novamente em instantes",
+                headers={"Retry-After": "1"}
+            )
+        finally:
+            pool_espera.observe(pool.nome, time.perf_counter() - inicio)
+        return self.conn
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.pool._pool.release(self.conn)
+        self.conn = None
+
+# --- Serialização JSON ---
+# orjson quando instalado (datetime e dataclass nativos, direto para bytes); senão, json da stdlib.
+# Rotas que devolvem linhas do banco respondem com RespostaJSON(...) direto: o FastAPI não passa
+# Response pelo jsonable_encoder, que percorre e copia cada linha antes de serializar.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _json_padrao(valor):
+    """Tipos que nem orjson nem json serializam sozinhos, no mesmo formato do jsonable_encoder."""
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    if isinstance(valor, timedelta):
+        return valor.total_seconds()
+    if isinstance(valor, Decimal):
+        return float(valor)
+    if isinstance(valor, (bytes, bytearray)):
+        return valor.decode("utf-8", "replace")
+    if is_dataclass(valor):
+        return asdict(valor)
+    if isinstance(valor, (set, frozenset)):
+        return list(valor)
+    raise TypeError(f"Tipo não serializável em JSON: {type(valor).__name__}")
+
+if orjson is not None:
+    def dumps_json(valor) -> bytes:
+        return orjson.dumps(valor, default=_json_padrao, option=orjson.OPT_NON_STR_KEYS)
+
+    loads_json = orjson.loads
+else:
+    def dumps_json(valor) -> bytes:
+        return json.dumps(
+            valor, default=_json_padrao, ensure_ascii=False, separators=(",", ":")
+        ).encode("utf-8")
+
+    loads_json = json.loads
+
+class RespostaJSON(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps_json(content)
+
+def codificar_ws(message: dict) -> str:
+    return dumps_json(message).decode("utf-8")
 
 # --- Utilitários Auxiliares ---
-async def run_in_thread(func, *args):
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(None, partial(func, *args))
+_tarefas_em_fundo: Set[asyncio.Task] = set()
+
+def tarefa_em_fundo(coro) -> asyncio.Task:
+    """create_task que guarda a referência até a tarefa terminar (evita coleta prematura)."""
+    tarefa = asyncio.create_task(coro)
+    _tarefas_em_fundo.add(tarefa)
+    tarefa.add_done_callback(_tarefas_em_fundo.discard)
+    return tarefa
+
+# --- Hash de Senhas ---
+# O bcrypt roda num executor próprio e limitado: um pico de logins não pode
+# ocupar o executor padrão nem acumular uma fila sem fim. Fila cheia -> 503 imediato.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", 4))
+HASH_QUEUE_MAX = int(os.getenv("HASH_QUEUE_MAX", 64))
+
+class HashPool:
+    def __init__(self, workers: int, max_fila: int):
+        self.workers = workers
+        self.max_fila = max_fila
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self.pendentes = 0
+        self.concluidas = 0
+        self.rejeitadas = 0
+        self.tempo_total = 0.0
+
+    async def run(self, func, *args):
+        if self.pendentes >= self.workers + self.max_fila:
+            self.rejeitadas += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Servidor ocupado, tente novamente em instantes",
+                headers={"Retry-After": "1"}
+            )
+        self.pendentes += 1
+        inicio = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, partial(func, *args))
+        finally:
+            self.pendentes -= 1
+            self.concluidas += 1
+            self.tempo_total += time.perf_counter() - inicio
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "em_execucao": min(self.pendentes, self.workers),
+            "na_fila": max(self.pendentes - self.workers, 0),
+            "capacidade_fila": self.max_fila,
+            "concluidas": self.concluidas,
+            "rejeitadas": self.rejeitadas,
+            "latencia_media_ms": round(self.tempo_total / self.concluidas * 1000, 2) if self.concluidas else None,
+            "bcrypt_rounds": BCRYPT_ROUNDS,
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+hash_pool = HashPool(HASH_WORKERS, HASH_QUEUE_MAX)
 
 async def hash_password(password: str) -> str:
-    hashed = await run_in_thread(bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt())
+    hashed = await hash_pool.run(bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS))
     return hashed.decode('utf-8')
 
 async def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return await run_in_thread(bcrypt.checkpw, plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+    return await hash_pool.run(bcrypt.checkpw, plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+def custo_do_hash(hashed_password: str) -> Optional[int]:
+    # Formato: $2b$12$<salt+hash>
+    try:
+        return int(hashed_password.split("$")[2])
+    except (IndexError, ValueError):
+        return None
+
+async def rehash_senha(pool, id_usuario: int, senha: str):
+    """Regrava a senha com o custo configurado. Roda em segundo plano após um login válido."""
+    try:
+        novo_hash = await hash_password(senha)
+    except HTTPException:
+        return  # pool de hash saturado: tenta de novo no próximo login
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute("UPDATE usuario SET senha = %s WHERE id_usuario = %s", (novo_hash, id_usuario))
+    await invalidar_perfil(id_usuario)
+
+_MISSING = object()
+
+class TTLCache:
+    """Cache LRU limitado com expiração por item. Feito para uso dentro do event loop (sem locks)."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key, default=None):
+        item = self._data.get(key, _MISSING)
+        if item is _MISSING:
+            return default
+        value, expira_em = item
+        if expira_em < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, _MISSING)
+        return default if item is _MISSING else item[0]
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+class SingleFlight:
+    """Chamadas concorrentes com a mesma chave esperam pela primeira em vez de repetir o trabalho."""
 
-# --- Gerenciador de WebSockets ---
-class ConnectionManager:
     def __init__(self):
-        # Mapeia id_usuario -> WebSocket
-        self.active_connections: Dict[int, WebSocket] = {}
+        self._em_voo: Dict = {}
 
-    async def connect(self, websocket: WebSocket, user_id: int):
-        await websocket.accept()
-        self.active_connections[user_id] = websocket
-        print(f"Usuário {user_id} conectado no chat.")
+    async def do(self, key, fn):
+        fut = self._em_voo.get(key)
+        if fut is not None:
+            return await asyncio.shield(fut)
+
+        fut = asyncio.get_running_loop().create_future()
+        self._em_voo[key] = fut
+        try:
+            result = await fn()
+            fut.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as e:
+            fut.set_exception(e)
+            fut.exception()  # evita o aviso de exceção nunca lida quando não há outros esperando
+            raise
+        finally:
+            del self._em_voo[key]
 
-    def disconnect(self, user_id: int):
-        if user_id in self.active_connections:
+_PARAR = object()
+
+class EscritorParado(RuntimeError):
+    """O escritor já começou a parar (desligamento): o item não seria gravado."""
+
+class EscritorEmLote:
+    """
+    Write-behind genérico: acumula itens numa fila e grava em lote a cada
+    `intervalo_ms` ou assim que junta `max_lote` itens. Subclasses implementam `_gravar(lote)`.
+    """
+
+    def __init__(self, nome: str, intervalo_ms: int, max_lote: int, max_fila: int):
+        self.nome = nome
+        self.intervalo = intervalo_ms / 1000
+        self.max_lote = max_lote
+        self.fila: asyncio.Queue = asyncio.Queue(maxsize=max_fila)
+        self.pool = None
+        self.tarefa: Optional[asyncio.Task] = None
+        self.parando = False
+        self._lote_cheio = asyncio.Event()
+
+    def start(self, pool):
+        self.pool = pool
+        self.parando = False
+        self.tarefa = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        """Recusa itens novos, grava tudo o que ainda está na fila e encerra a tarefa."""
+        if not self.tarefa:
+            return
+        self.parando = True
+        await self.fila.put(_PARAR)
+        self._lote_cheio.set()
+        await self.tarefa
+        self.tarefa = None
+        # Quem esperava vaga na fila cheia pode ter entrado depois do sinal de parada
+        resto = [i for i in (self.fila.get_nowait() for _ in range(self.fila.qsize())) if i is not _PARAR]
+        if resto:
+            self._falhou(resto, EscritorParado(self.nome))
+
+    async def _enfileirar(self, item):
+        if self.parando:
+            raise EscritorParado(self.nome)
+        # Só bloqueia quando a fila está cheia (backpressure em vez de memória sem limite)
+        await self.fila.put(item)
+        if self.fila.qsize() >= self.max_lote:
+            self._lote_cheio.set()
+
+    def _enfileirar_sem_esperar(self, item) -> bool:
+        """Para registros descartáveis (logs): com a fila cheia ou parando, perde o item em vez de esperar."""
+        if self.parando:
+            return False
+        try:
+            self.fila.put_nowait(item)
+        except asyncio.QueueFull:
+            return False
+        if self.fila.qsize() >= self.max_lote:
+            self._lote_cheio.set()
+        return True
+
+    async def _loop(self):
+        while True:
+            item = await self.fila.get()
+            if item is _PARAR:
+                return
+            lote = [item]
+            if self.fila.qsize() < self.max_lote - 1:
+                try:
+                    await asyncio.wait_for(self._lote_cheio.wait(), self.intervalo)
+                except asyncio.TimeoutError:
+                    pass
+            self._lote_cheio.clear()
+
+            parar = False
+            while len(lote) < self.max_lote and not self.fila.empty():
+                item = self.fila.get_nowait()
+                if item is _PARAR:
+                    parar = True
+                    break
+                lote.append(item)
+            await self._gravar_seguro(lote)
+            if parar:
+                # Ainda pode haver itens que entraram antes do sinal de parada
+                while not self.fila.empty():
+                    resto = [self.fila.get_nowait() for _ in range(min(self.max_lote, self.fila.qsize()))]
+                    await self._gravar_seguro([i for i in resto if i is not _PARAR])
+                return
+
+    async def _gravar_seguro(self, lote: list):
+        if not lote:
+            return
+        for tentativa in range(2):
+            try:
+                await self._gravar(lote)
+                return
+            except (aiomysql.IntegrityError, aiomysql.DataError) as e:
+                # Erro de dado (FK, valor grande demais...) é de uma linha, não do lote:
+                # repetir não adianta, então divide o lote até isolar a(s) linha(s) ruim(ns)
+                if len(lote) == 1:
+                    logger.exception("Erro ao gravar item de %s", self.nome)
+                    self._falhou(lote, e)
+                    return
+                meio = len(lote) // 2
+                await self._gravar_seguro(lote[:meio])
+                await self._gravar_seguro(lote[meio:])
+                return
+            except Exception as e:
+                logger.exception("Erro ao gravar lote de %s (%d itens, tentativa %d)", self.nome, len(lote), tentativa + 1)
+                erro = e
+                await asyncio.sleep(0.2)
+        self._falhou(lote, erro)
+
+    async def _gravar(self, lote: list):
+        raise NotImplementedError
+
+    def _falhou(self, lote: list, erro: Exception):
+        pass
+
+# --- Barramento Pub/Sub entre Workers ---
+# Com gunicorn + vários workers uvicorn, cada processo só enxerga os próprios sockets.
+# O barramento leva a mensagem até o worker que tem o destinatário conectado:
+# cada worker assina apenas os canais dos usuários que estão conectados nele.
+BACKPLANE = os.getenv("BACKPLANE", "local")  # local | redis
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+def canal_usuario(user_id: int) -> str:
+    return f"usuario:{user_id}"
+
+class Backplane:
+    """Interface do barramento. `on_message(canal, mensagem)` é chamado para cada entrega."""
+
+    def __init__(self):
+        self.on_message = None
+
+    async def start(self, on_message):
+        self.on_message = on_message
+
+    async def subscribe(self, canal: str):
+        pass
+
+    async def unsubscribe(self, canal: str):
+        pass
+
+    async def publish(self, canal: str, message: dict):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+class InProcessBackplane(Backplane):
+    """Padrão para um único worker: entrega direto, sem serializar."""
+
+    async def publish(self, canal: str, message: dict):
+        if self.on_message:
+            await self.on_message(canal, message)
+
+class LocalBroker:
+    """
+    Broker em memória que imita o Redis/NATS.
+    Vários BrokerBackplane (um por "worker") podem compartilhar a mesma instância nos testes.
+    As mensagens trafegam serializadas, como aconteceria na rede.
+    """
+
+    def __init__(self):
+        self.assinantes: Dict[str, Set["BrokerBackplane"]] = {}
+
+    def subscribe(self, canal: str, backplane: "BrokerBackplane"):
+        self.assinantes.setdefault(canal, set()).add(backplane)
+
+    def unsubscribe(self, canal: str, backplane: "BrokerBackplane"):
+        inscritos = self.assinantes.get(canal)
+        if inscritos:
+            inscritos.discard(backplane)
+            if not inscritos:
+                del self.assinantes[canal]
+
+    async def publish(self, canal: str, dados: bytes):
+        for backplane in list(self.assinantes.get(canal, ())):
+            await backplane._receber(canal, dados)
+
+class BrokerBackplane(Backplane):
+    def __init__(self, broker: LocalBroker):
+        super().__init__()
+        self.broker = broker
+
+    async def subscribe(self, canal: str):
+        self.broker.subscribe(canal, self)
+
+    async def unsubscribe(self, canal: str):
+        self.broker.unsubscribe(canal, self)
+
+    async def publish(self, canal: str, message: dict):
+        await self.broker.publish(canal, dumps_json(message))
+
+    async def _receber(self, canal: str, dados: str):
+        if self.on_message:
+            await self.on_message(canal, loads_json(dados))
+
+    async def close(self):
+        for canal in [c for c, inscritos in self.broker.assinantes.items() if self in inscritos]:
+            self.broker.unsubscribe(canal, self)
+
+class RedisBackplane(Backplane):
+    """Barramento real entre processos/máquinas. Requer o pacote `redis` (redis.asyncio)."""
+
+    def __init__(self, url: str):
+        super().__init__()
+        try:
+            import redis.asyncio as aioredis
+        except ImportError as e:
+            raise RuntimeError("BACKPLANE=redis requer o pacote 'redis' instalado") from e
+        self.redis = aioredis.from_url(url)
+        self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        self.listener: Optional[asyncio.Task] = None
+
+    async def start(self, on_message):
+        await super().start(on_message)
+        self.listener = asyncio.create_task(self._escutar())
+
+    async def subscribe(self, canal: str):
+        await self.pubsub.subscribe(canal)
+
+    async def unsubscribe(self, canal: str):
+        await self.pubsub.unsubscribe(canal)
+
+    async def publish(self, canal: str, message: dict):
+        await self.redis.publish(canal, dumps_json(message))
+
+    async def _escutar(self):
+        while True:
+            # get_message não bloqueia se ainda não há nenhuma assinatura
+            if not self.pubsub.subscribed:
+                await asyncio.sleep(0.1)
+                continue
+            try:
+                msg = await self.pubsub.get_message(timeout=1.0)
+                if msg and self.on_message:
+                    canal = msg["channel"].decode() if isinstance(msg["channel"], bytes) else msg["channel"]
+                    await self.on_message(canal, loads_json(msg["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Erro no barramento redis")
+                await asyncio.sleep(1)
+
+    async def close(self):
+        if self.listener:
+            self.listener.cancel()
+        await self.pubsub.close()
+        await self.redis.close()
+
+def create_backplane() -> Backplane:
+    if BACKPLANE == "redis":
+        return RedisBackplane(REDIS_URL)
+    return InProcessBackplane()
+
+# --- Gerenciador de WebSockets ---
+# Cada socket tem uma fila de saída limitada e uma tarefa escritora própria:
+# um cliente lento só atrasa a si mesmo, nunca o loop de recebimento de quem enviou.
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", 100))
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "drop_oldest")  # drop_oldest | disconnect
+# Heartbeat: sockets calados há WS_PING_INTERVAL recebem {"type": "ping"}; quem não manda
+# nada (nem o pong) por WS_IDLE_TIMEOUT é considerado meio-aberto e fechado pelo ceifador.
+WS_PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL", 25))
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", 60))
+WS_MAX_POR_USUARIO = int(os.getenv("WS_MAX_POR_USUARIO", 5))
+WS_MAX_CONEXOES = int(os.getenv("WS_MAX_CONEXOES", 10000))
+WS_DRAIN_TIMEOUT = float(os.getenv("WS_DRAIN_TIMEOUT", 5))
+
+class ClientConnection:
+    """Um socket de um usuário (aba, celular...) com sua fila de saída."""
+
+    def __init__(self, websocket: WebSocket, user_id: int,
+                 max_queue: int = WS_SEND_QUEUE_SIZE, policy: str = WS_SLOW_CONSUMER_POLICY,
+                 on_sent=None):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.policy = policy
+        self.on_sent = on_sent
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.writer: Optional[asyncio.Task] = None
+        self.dropped = 0
+        self.closed = False
+        self.conectado_em = self.ultima_atividade = time.monotonic()
+        # Marcado pelo cliente ({"type": "presenca", "estado": "ausente"}), ex.: aba em segundo plano
+        self.ausente = False
+
+    def tocar(self):
+        """Registra atividade do cliente (qualquer frame recebido, inclusive pong)."""
+        self.ultima_atividade = time.monotonic()
+
+    def ociosa_ha(self, agora: float) -> float:
+        return agora - self.ultima_atividade
+
+    def start(self):
+        self.writer = asyncio.create_task(self._write_loop())
+
+    def enqueue(self, message: dict) -> bool:
+        """Nunca bloqueia. Retorna False se a mensagem não foi enfileirada."""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            if self.policy == "disconnect":
+                print(f"Usuário {self.user_id}: consumidor lento, desconectando socket.")
+                asyncio.create_task(self.close(code=status.WS_1013_TRY_AGAIN_LATER))
+                return False
+            # drop_oldest: descarta a mensagem mais antiga para abrir espaço
+            self.queue.get_nowait()
+            self.queue.task_done()  # senão o join() de drenar espera o timeout inteiro
+            self.dropped += 1
+            self.queue.put_nowait(message)
+            return True
+
+    async def enqueue_wait(self, message: dict, timeout: float) -> bool:
+        """Para envios em volume (reenvio na reconexão): espera espaço na fila em vez de descartar."""
+        if self.closed:
+            return False
+        try:
+            await asyncio.wait_for(self.queue.put(message), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _write_loop(self):
+        try:
+            while True:
+                message = await self.queue.get()
+                try:
+                    await self.websocket.send_text(codificar_ws(message))
+                finally:
+                    self.queue.task_done()
+                if self.on_sent:
+                    self.on_sent(message)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            # Socket morto; o loop de recebimento vai perceber e limpar a conexão
+            print(f"Erro ao enviar para usuário {self.user_id}: {e}")
+            self.closed = True
+
+    async def close(self, code: int = status.WS_1000_NORMAL_CLOSURE):
+        if self.closed:
+            return
+        self.closed = True
+        if self.writer:
+            self.writer.cancel()
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def drenar(self, timeout: float, code: int = status.WS_1012_SERVICE_RESTART):
+        """Espera a fila de saída esvaziar (até `timeout`) e fecha o socket."""
+        if not self.closed and self.writer and not self.writer.done():
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        await self.close(code=code)
+
+class ConnectionManager:
+    def __init__(self, backplane: Optional[Backplane] = None):
+        # Mapeia id_usuario -> conexões abertas neste worker (vários dispositivos por usuário)
+        self.active_connections: Dict[int, Set[ClientConnection]] = {}
+        self.backplane = backplane or create_backplane()
+        # Canais de broadcast entre workers (ex.: "panico") -> handler(message)
+        self.canais: Dict[str, callable] = {}
+        # Tipo do frame -> função chamada depois que o frame foi de fato enviado
+        self.ganchos_envio: Dict[str, callable] = {}
+        # Funções chamadas com a conexão a cada nova conexão / depois de cada desconexão
+        self.ganchos_conexao: List[callable] = []
+        self.ganchos_desconexao: List[callable] = []
+        # False durante o desligamento: novas conexões e mensagens são recusadas
+        self.aceitando = True
+        self.ceifador: Optional[asyncio.Task] = None
+        self.recusadas = 0
+        self.ceifadas = 0
+
+    async def start(self):
+        self.aceitando = True
+        await self.backplane.start(self._on_backplane_message)
+        for canal in self.canais:
+            await self.backplane.subscribe(canal)
+        self.ceifador = asyncio.create_task(self._ceifar())
+
+    async def _ceifar(self):
+        """Uma tarefa por worker: manda ping para quem está calado e fecha quem sumiu."""
+        intervalo = min(WS_PING_INTERVAL, WS_IDLE_TIMEOUT)
+        while True:
+            await asyncio.sleep(intervalo)
+            agora = time.monotonic()
+            for conexao in [c for cs in self.active_connections.values() for c in cs]:
+                ociosa = conexao.ociosa_ha(agora)
+                if ociosa >= WS_IDLE_TIMEOUT:
+                    print(f"Usuário {conexao.user_id}: socket sem resposta há {ociosa:.0f}s, fechando.")
+                    self.ceifadas += 1
+                    await self.disconnect(conexao, code=status.WS_1001_GOING_AWAY)
+                elif ociosa >= WS_PING_INTERVAL:
+                    conexao.enqueue({"type": "ping"})
+
+    async def drenar(self, timeout: float = WS_DRAIN_TIMEOUT):
+        """
+        Desligamento gracioso: para de aceitar conexões, entrega o que já está nas
+        filas de saída e fecha cada socket com 1012 (o cliente reconecta em outro worker
+        e recupera o resto pelo reenvio com last_seen).
+        """
+        self.aceitando = False
+        if self.ceifador:
+            self.ceifador.cancel()
+            self.ceifador = None
+        conexoes = [c for cs in self.active_connections.values() for c in cs]
+        await asyncio.gather(*(c.drenar(timeout) for c in conexoes))
+        for conexao in conexoes:
+            await self.disconnect(conexao)
+
+    def assinar_canal(self, canal: str, handler):
+        """Registra um canal de broadcast; a assinatura no barramento acontece em start()."""
+        self.canais[canal] = handler
+
+    async def broadcast(self, canal: str, message: dict):
+        await self.backplane.publish(canal, message)
+
+    async def close(self):
+        await self.backplane.close()
+
+    def total_conexoes(self) -> int:
+        return sum(len(cs) for cs in self.active_connections.values())
+
+    async def connect(self, websocket: WebSocket, user_id: int) -> Optional[ClientConnection]:
+        """Aceita o socket; retorna None se o worker está desligando ou no limite de conexões."""
+        await websocket.accept()
+        if not self.aceitando or self.total_conexoes() >= WS_MAX_CONEXOES:
+            # Aceita e fecha com código explícito para o cliente saber que deve tentar de novo
+            self.recusadas += 1
+            code = status.WS_1012_SERVICE_RESTART if not self.aceitando else status.WS_1013_TRY_AGAIN_LATER
+            await websocket.close(code=code)
+            return None
+        conexoes = self.active_connections.setdefault(user_id, set())
+        if len(conexoes) >= WS_MAX_POR_USUARIO:
+            # Novo dispositivo ganha: o socket mais antigo costuma ser uma aba esquecida ou meio-aberto
+            antiga = min(conexoes, key=lambda c: c.conectado_em)
+            print(f"Usuário {user_id}: limite de {WS_MAX_POR_USUARIO} sockets, fechando o mais antigo.")
+            await self.disconnect(antiga, code=status.WS_1008_POLICY_VIOLATION)
+            conexoes = self.active_connections.setdefault(user_id, set())
+        conexao = ClientConnection(websocket, user_id, on_sent=self._ao_enviar if self.ganchos_envio else None)
+        conexao.start()
+        conexoes.add(conexao)
+        if len(conexoes) == 1:
+            await self.backplane.subscribe(canal_usuario(user_id))
+        print(f"Usuário {user_id} conectado no chat ({len(conexoes)} dispositivo(s)).")
+        for gancho in self.ganchos_conexao:
+            gancho(conexao)
+        return conexao
+
+    async def disconnect(self, conexao: ClientConnection, code: Optional[int] = None):
+        """Remove a conexão; com `code`, também fecha o socket (ceifador, limite por usuário)."""
+        user_id = conexao.user_id
+        if code is not None:
+            await conexao.close(code=code)
+        if conexao.writer:
+            conexao.writer.cancel()
+        conexao.closed = True
+        conexoes = self.active_connections.get(user_id)
+        if conexoes is None or conexao not in conexoes:
+            return
+        conexoes.discard(conexao)
+        if not conexoes:
             del self.active_connections[user_id]
-            print(f"Usuário {user_id} desconectado.")
+            await self.backplane.unsubscribe(canal_usuario(user_id))
+        print(f"Usuário {user_id} desconectado.")
+        for gancho in self.ganchos_desconexao:
+            gancho(conexao)
+
+    def stats(self) -> dict:
+        conexoes = [c for cs in self.active_connections.values() for c in cs]
+        return {
+            "usuarios": len(self.active_connections),
+            "conexoes": len(conexoes),
+            "fila_envio": sum(c.queue.qsize() for c in conexoes),
+            "descartadas": sum(c.dropped for c in conexoes),
+            "recusadas": self.recusadas,
+            "ceifadas": self.ceifadas,
+        }
 
     async def send_personal_message(self, message: dict, user_id: int):
-        if user_id in self.active_connections:
-            websocket = self.active_connections[user_id]
-            # Envia como JSON para o frontend processar fácil
-            await websocket.send_json(message)
+        # Publica no canal do usuário; quem entrega é o worker que tem o socket
+        await self.backplane.publish(canal_usuario(user_id), message)
+
+    async def _on_backplane_message(self, canal: str, message: dict):
+        if canal.startswith("usuario:"):
+            self.deliver_local(message, int(canal.split(":", 1)[1]))
+        elif canal in self.canais:
+            await self.canais[canal](message)
+
+    def _ao_enviar(self, message: dict):
+        gancho = self.ganchos_envio.get(message.get("type"))
+        if gancho:
+            gancho(message)
+
+    def deliver_local(self, message: dict, user_id: int):
+        # Só enfileira; quem envia de fato é a tarefa escritora de cada socket
+        for conexao in list(self.active_connections.get(user_id, ())):
+            conexao.enqueue(message)
 
 manager = ConnectionManager()
 
+# --- Camada de Acesso a Dados ---
+# Um só caminho para o banco: conexão do pool, cursor medido (tempo por rótulo em
+# sql_query_duration_seconds) e linhas mapeadas direto em dataclasses com __slots__,
+# na ordem das colunas do SELECT, sem montar um dict por linha.
+# app.state.repo_leitura aponta para a réplica (DB_READ_HOST) quando configurada; quem precisa
+# ler a própria escrita (perfil, agenda, detalhe de sessão, chat) usa app.state.repo.
+logger = logging.getLogger("no_panic")
+
+_IDENTIFICADOR = re.compile(r"^\w+$")
+
+@lru_cache(maxsize=256)
+def sql_update(tabela: str, campos: tuple, chave: str) -> str:
+    """UPDATE gerado uma vez por conjunto de campos. Os nomes vêm dos modelos Pydantic, não do cliente."""
+    for nome in (tabela, chave, *campos):
+        if not _IDENTIFICADOR.match(nome):
+            raise ValueError(f"Identificador inválido: {nome}")
+    return f"UPDATE {tabela} SET {', '.join(f'{campo} = %s' for campo in campos)} WHERE {chave} = %s"
+
+class Repositorio:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def um(self, query: str, params=(), tipo=None):
+        async with self.pool.acquire() as conn:
+            async with conn.cursor(CursorMedido) as cur:
+                await cur.execute(query, params)
+                linha = await cur.fetchone()
+        if linha is None or tipo is None:
+            return linha
+        return tipo(*linha)
+
+    async def todos(self, query: str, params=(), tipo=None) -> list:
+        async with self.pool.acquire() as conn:
+            async with conn.cursor(CursorMedido) as cur:
+                await cur.execute(query, params)
+                linhas = await cur.fetchall()
+        if tipo is None:
+            return list(linhas)
+        return [tipo(*linha) for linha in linhas]
+
+    async def executar(self, query: str, params=()) -> int:
+        """Executa e devolve o número de linhas afetadas."""
+        async with self.pool.acquire() as conn:
+            async with conn.cursor(CursorMedido) as cur:
+                await cur.execute(query, params)
+                return cur.rowcount
+
+    async def inserir(self, query: str, params=()) -> int:
+        """Executa um INSERT e devolve o id gerado."""
+        async with self.pool.acquire() as conn:
+            async with conn.cursor(CursorMedido) as cur:
+                await cur.execute(query, params)
+                return cur.lastrowid
+
+    async def atualizar(self, tabela: str, chave: str, id_registro, campos: dict) -> int:
+        query = sql_update(tabela, tuple(campos), chave)
+        return await self.executar(query, (*campos.values(), id_registro))
+
+@contextmanager
+def erro_interno(acao: str):
+    """
+    Converte erros inesperados do banco em HTTP sem vazar a mensagem do driver: duplicidade vira 409,
+    referência inválida vira 400 e o resto vira 500 genérico, com o detalhe no log.
+    HTTPException levantada dentro do bloco passa intacta.
+    """
+    try:
+        yield
+    except HTTPException:
+        raise
+    except aiomysql.IntegrityError as e:
+        if e.args and e.args[0] == 1062:
+            raise HTTPException(status_code=409, detail="Registro já existe")
+        raise HTTPException(status_code=400, detail="Referência inválida")
+    except Exception:
+        logger.exception("Erro ao %s", acao)
+        raise HTTPException(status_code=500, detail=f"Erro ao {acao}")
+
+# --- Consultas e Linhas ---
+# As consultas dos caminhos quentes ficam aqui, com a dataclass que recebe suas colunas.
+# Mudar um SELECT exige mudar a dataclass logo abaixo dele.
+# Último termo aceito de cada tipo; quais estão pendentes é decidido na resposta,
+# comparando com os termos vigentes (ver com_consentimento), então o perfil em cache
+# continua válido quando um termo novo é publicado.
+PERFIL_QUERY = """
+    /* perfil */
+    SELECT u.id_usuario, u.nome, u.email, u.cpf, u.primeiro_login, u.senha, u.contato_emergencia, u.terapeuta_fav,
+           t.especialidade, t.CRP, t.disponibilidade,
+           (SELECT MAX(cs.termo_id) FROM consentimentos cs JOIN termos tm ON tm.id = cs.termo_id
+            WHERE cs.usuario_id = u.id_usuario AND tm.tipo = 'uso') AS termo_uso,
+           (SELECT MAX(cs.termo_id) FROM consentimentos cs JOIN termos tm ON tm.id = cs.termo_id
+            WHERE cs.usuario_id = u.id_usuario AND tm.tipo = 'privacidade') AS termo_privacidade
+    FROM usuario u
+    LEFT JOIN terapeuta t ON u.id_usuario = t.id_usuario
+"""
+
+@dataclass(slots=True)
+class LinhaPerfil:
+    id_usuario: int
+    nome: str
+    email: str
+    cpf: Optional[str]
+    primeiro_login: int
+    senha: str
+    contato_emergencia: Optional[str]
+    terapeuta_fav: Optional[int]
+    especialidade: Optional[str]
+    CRP: Optional[str]
+    disponibilidade: Optional[str]
+    termo_uso: Optional[int]
+    termo_privacidade: Optional[int]
+
+USUARIO_CADASTRADO = "SELECT id_usuario, nome, email, cpf, primeiro_login FROM usuario WHERE id_usuario = %s"
+
+@dataclass(slots=True)
+class UsuarioCadastrado:
+    id: int
+    nome: str
+    email: str
+    cpf: Optional[str]
+    primeiro_login: int
+
+# total_sessoes_concluidas é mantido por atualizar_sessao (ver recalcular_estatisticas_terapeutas)
+TERAPEUTAS_LISTAGEM = """
+    SELECT u.id_usuario, u.nome, u.email, t.especialidade, t.CRP, t.disponibilidade, t.total_sessoes_concluidas
+    FROM terapeuta t
+    JOIN usuario u ON u.id_usuario = t.id_usuario
+    WHERE 1 = 1
+"""
+
+@dataclass(slots=True)
+class TerapeutaDiretorio:
+    id_usuario: int
+    nome: str
+    email: str
+    especialidade: Optional[str]
+    CRP: Optional[str]
+    disponibilidade: Optional[str]
+    total_sessoes_concluidas: int
+
+FAVORITOS_DO_USUARIO = """
+    SELECT u.id_usuario, u.nome, u.email, t.especialidade, t.disponibilidade, t.CRP
+    FROM usuario_salva_terapeuta ust
+    JOIN terapeuta t ON ust.id_terapeuta = t.id_usuario
+    JOIN usuario u ON t.id_usuario = u.id_usuario
+    WHERE ust.id_usuario = %s
+"""
+
+@dataclass(slots=True)
+class TerapeutaFavorito:
+    id_usuario: int
+    nome: str
+    email: str
+    especialidade: Optional[str]
+    disponibilidade: Optional[str]
+    CRP: Optional[str]
+
+# Busca reversa: atendida pelo KEY id_terapeuta de usuario_salva_terapeuta
+USUARIOS_DO_TERAPEUTA = """
+    SELECT u.id_usuario AS id, u.nome, u.email
+    FROM usuario_salva_terapeuta ust
+    JOIN usuario u ON ust.id_usuario = u.id_usuario
+    WHERE ust.id_terapeuta = %s
+"""
+
+@dataclass(slots=True)
+class UsuarioResumo:
+    id: int
+    nome: str
+    email: str
+
+SESSOES_LISTAGEM = """
+    SELECT 
+        u.id_usuario, u.nome, u.email,
+        s.status, s.data_hora_agendamento, s.data_hora_inicio,
+        s.data_hora_fim, s.duracao, s.id_sessao, s.tipo, BIN_TO_UUID(s.uuid) as uuid
+    FROM sessao s
+"""
+
+@dataclass(slots=True)
+class SessaoListagem:
+    id_usuario: int
+    nome: str
+    email: str
+    status: str
+    data_hora_agendamento: Optional[datetime]
+    data_hora_inicio: Optional[datetime]
+    data_hora_fim: Optional[datetime]
+    duracao: Optional[int]
+    id_sessao: int
+    tipo: Optional[str]
+    uuid: str
+
+SESSAO_DETALHE = """
+    SELECT 
+        s.id_sessao, s.tipo, s.status, s.data_hora_agendamento,
+        s.data_hora_inicio, s.data_hora_fim, s.duracao, s.criadoEm, s.atualizadoEm,
+        u.id_usuario AS id_usuario, u.nome AS nome_usuario, u.email AS email_usuario,
+        t.id_usuario AS id_terapeuta, t.nome AS nome_terapeuta, t.email AS email_terapeuta,
+        BIN_TO_UUID(s.uuid) AS uuid
+    FROM sessao s
+    JOIN usuario u ON s.id_usuario = u.id_usuario
+    JOIN usuario t ON s.id_terapeuta = t.id_usuario
+"""
+SESSAO_POR_UUID = SESSAO_DETALHE + " WHERE s.uuid = UUID_TO_BIN(%s) LIMIT 1"
+# Busca em massa pelo UNIQUE KEY uuid; {marcadores} = UUID_TO_BIN(%s) por item
+SESSOES_POR_UUIDS = SESSAO_DETALHE + " WHERE s.uuid IN ({marcadores})"
+
+@dataclass(slots=True)
+class SessaoDetalhe:
+    id_sessao: int
+    tipo: Optional[str]
+    status: str
+    data_hora_agendamento: Optional[datetime]
+    data_hora_inicio: Optional[datetime]
+    data_hora_fim: Optional[datetime]
+    duracao: Optional[int]
+    criadoEm: datetime
+    atualizadoEm: datetime
+    id_usuario: int
+    nome_usuario: str
+    email_usuario: str
+    id_terapeuta: int
+    nome_terapeuta: str
+    email_terapeuta: str
+    uuid: str
+
+# Os índices (id_usuario, id_terapeuta) e (id_terapeuta, id_usuario) da migração 0008
+# cobrem os dois lados do OR
+# Par normalizado (menor, maior): índice único uq_conversa_par, migração 0012
+CONVERSA_POR_PAR = """
+    SELECT id_conversa FROM conversa
+    WHERE par_menor = %s AND par_maior = %s
+"""
+
+# Prévia e não lidas vêm de colunas mantidas na gravação (migração 0009), sem subconsulta por linha
+CONVERSAS_DO_USUARIO = """
+    SELECT
+        c.id_conversa,
+        CASE
+            WHEN c.id_usuario = %s THEN c.id_terapeuta
+            ELSE c.id_usuario
+        END as outro_usuario_id,
+        u.nome as outro_usuario_nome,
+        c.atualizadoEm,
+        c.ultima_mensagem,
+        c.id_ultima_mensagem,
+        c.id_ultimo_remetente,
+        CASE WHEN c.id_usuario = %s THEN c.nao_lidas_usuario ELSE c.nao_lidas_terapeuta END AS nao_lidas
+    FROM conversa c
+    JOIN usuario u ON u.id_usuario = (CASE WHEN c.id_usuario = %s THEN c.id_terapeuta ELSE c.id_usuario END)
+    WHERE c.id_usuario = %s OR c.id_terapeuta = %s
+    ORDER BY c.atualizadoEm DESC
+"""
+
+@dataclass(slots=True)
+class ConversaResumo:
+    id_conversa: int
+    outro_usuario_id: int
+    outro_usuario_nome: str
+    atualizadoEm: datetime
+    ultima_mensagem: Optional[str]
+    id_ultima_mensagem: Optional[int]
+    id_ultimo_remetente: Optional[int]
+    nao_lidas: int
+
+HISTORICO_CAMPOS = """
+    SELECT id_mensagem, id_remetente, conteudo,
+           DATE_FORMAT(CONVERT_TZ(enviadoEm, 'UTC', 'America/Sao_Paulo'), '%%Y-%%m-%%dT%%H:%%i:%%s') AS enviadoEm
+    FROM mensagem
+    WHERE id_conversa = %s
+"""
+
+# Reenvio na reconexão: conversas do usuário pelos dois índices da migração 0008 e,
+# em cada uma, as mensagens depois do cursor pelo índice (id_conversa, id_mensagem)
+CONVERSAS_IDS_DO_USUARIO = """
+    SELECT id_conversa FROM conversa WHERE id_usuario = %s
+    UNION
+    SELECT id_conversa FROM conversa WHERE id_terapeuta = %s
+"""
+
+# A outra parte de cada conversa do usuário (quem acompanha a presença dele, e vice-versa)
+PARCEIROS_DE_CONVERSA = """
+    /* presenca_parceiros */
+    SELECT id_terapeuta FROM conversa WHERE id_usuario = %s
+    UNION
+    SELECT id_usuario FROM conversa WHERE id_terapeuta = %s
+"""
+
+MENSAGENS_PERDIDAS = """
+    SELECT id_mensagem, id_conversa, id_remetente, conteudo,
+           DATE_FORMAT(CONVERT_TZ(enviadoEm, 'UTC', 'America/Sao_Paulo'), '%%Y-%%m-%%dT%%H:%%i:%%s') AS enviadoEm
+    FROM mensagem
+    WHERE id_conversa IN ({marcadores}) AND id_mensagem > %s
+    ORDER BY id_mensagem
+    LIMIT %s
+"""
+
+@dataclass(slots=True)
+class MensagemPerdida:
+    id_mensagem: int
+    id_conversa: int
+    id_remetente: int
+    conteudo: str
+    enviadoEm: str
+
+@dataclass(slots=True)
+class MensagemChat:
+    id_mensagem: int
+    id_remetente: int
+    conteudo: str
+    enviadoEm: str
+
 # --- Ciclo de Vida da Aplicação ---
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    app.state.pool = await aiomysql.create_pool(
-        host=DB_HOST,
-        port=DB_PORT,
+async def criar_pool(host: str = DB_HOST, port: int = DB_PORT, minsize: int = POOL_MIN_SIZE, maxsize: int = POOL_SIZE):
+    return await aiomysql.create_pool(
+        host=host,
+        port=port,
         user=DB_USER,
         password=DB_PASSWORD,
         db=DB_NAME,
-        minsize=1,
-        maxsize=POOL_SIZE,
-        autocommit=True
+        minsize=min(minsize, maxsize),
+        maxsize=maxsize,
+        autocommit=True,
+        cursorclass=CursorMedido
     )
-    print(f"✅ Pool de conexões criado: {DB_HOST}:{DB_PORT}")
-    yield
-    app.state.pool.close()
-    await app.state.pool.wait_closed()
-    print("🛑 Pool de conexões encerrado.")
 
-app = FastAPI(lifespan=lifespan)
+async def aquecer_pool(pool: PoolMedido):
+    """Valida as `minsize` conexões abertas pelo create_pool antes de o worker receber tráfego."""
+    conexoes = [await pool._pool.acquire() for _ in range(pool._pool.minsize)]
+    try:
+        await asyncio.gather(*(conn.ping() for conn in conexoes))
+    finally:
+        for conn in conexoes:
+            pool._pool.release(conn)
+
+def pools_distintos(app: FastAPI) -> List[PoolMedido]:
+    pools = []
+    for pool in (app.state.pool, app.state.pool_chat, app.state.pool_leitura):
+        if all(pool is not p for p in pools):
+            pools.append(pool)
+    return pools
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.pool = PoolMedido(await criar_pool())
+    app.state.pool_chat = app.state.pool
+    app.state.pool_leitura = app.state.pool
+    if CHAT_POOL_SIZE > 0:
+        app.state.pool_chat = PoolMedido(await criar_pool(minsize=1, maxsize=CHAT_POOL_SIZE), "chat")
+    if DB_READ_HOST:
+        app.state.pool_leitura = PoolMedido(
+            await criar_pool(host=DB_READ_HOST, port=DB_READ_PORT, maxsize=READ_POOL_SIZE), "leitura"
+        )
+    await asyncio.gather(*(aquecer_pool(p) for p in pools_distintos(app)))
+    app.state.repo = Repositorio(app.state.pool)
+    app.state.repo_leitura = Repositorio(app.state.pool_leitura)
+    print(f"✅ Pools de conexões criados: {', '.join(p.nome for p in pools_distintos(app))} ({DB_HOST}:{DB_PORT})")
+    await manager.start()
+    await presenca.start()
+    if MIGRAR_NO_STARTUP:
+        await aplicar_migracoes(app.state.pool)
+    message_writer.start(app.state.pool_chat)
+    read_writer.start(app.state.pool_chat)
+    interacao_writer.start(app.state.pool)
+    await despacho_panico.carregar(app.state.pool)
+    yield
+    # Sockets primeiro: recusa mensagens novas, grava tudo o que já foi aceito,
+    # entrega os acks pendentes e só então fecha as conexões com 1012
+    manager.aceitando = False
+    await presenca.stop()
+    await message_writer.stop()
+    await read_writer.stop()
+    await interacao_writer.stop()
+    await modelo_ia.fechar()
+    if _tarefas_em_fundo:
+        await asyncio.wait(list(_tarefas_em_fundo), timeout=WS_DRAIN_TIMEOUT)
+    await manager.drenar()
+    await manager.close()
+    hash_pool.shutdown()
+    for pool in pools_distintos(app):
+        pool.close()
+        await pool.wait_closed()
+    print("🛑 Pools de conexões encerrados.")
+
+app = FastAPI(lifespan=lifespan, default_response_class=RespostaJSON)
 
 app.add_middleware(
     CORSMiddleware,
@@ -90,7 +1318,9 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Has-More", "X-Next-Cursor", "X-Total-Count", "ETag"],
 )
+app.add_middleware(MetricsMiddleware)
 
 templates = Jinja2Templates(directory="templates")
 
@@ -128,6 +1358,10 @@ class FavoritarBody(BaseModel):
     id_usuario: int
     id_terapeuta: int
 
+class FavoritosLoteBody(BaseModel):
+    adicionar: List[int] = []
+    remover: List[int] = []
+
 class AtualizarUsuarioBody(BaseModel):
     nome: Optional[str] = None
     email: Optional[EmailStr] = None
@@ -140,6 +1374,18 @@ class CriarSessaoBody(BaseModel):
     id_usuario: int
     id_terapeuta: int
     data_hora_agendamento: str
+    encaixe: bool = False
+
+class JanelaDisponibilidade(BaseModel):
+    dia_semana: int  # 0 = segunda ... 6 = domingo
+    hora_inicio: str  # "HH:MM"
+    hora_fim: str
+
+class DisponibilidadeBody(BaseModel):
+    janelas: List[JanelaDisponibilidade]
+
+class SessoesPorUuidBody(BaseModel):
+    uuids: List[str]
 
 class AtualizarSessaoBody(BaseModel):
     status: str
@@ -155,10 +1401,27 @@ class CriarTermoBody(BaseModel):
     titulo: str
     conteudo: str
 
+class ConsentimentoItem(BaseModel):
+    usuario_id: int
+    termo_id: int
+
+class RegistrarConsentimentosBody(BaseModel):
+    consentimentos: List[ConsentimentoItem]
+
+class AbrirChamadoBody(BaseModel):
+    id_usuario: int
+    prioridade: int = 1  # menor = mais urgente
+
+class AtenderChamadoBody(BaseModel):
+    id_terapeuta: int
+
 class MensagemEnviada(BaseModel):
     destinatario_id: int
     conteudo: str
 
+class PerguntaIABody(BaseModel):
+    pergunta: str
+
 # =====================================================
 # ROTAS
 # =====================================================
@@ -167,271 +1430,414 @@ class MensagemEnviada(BaseModel):
 async def home(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
+def _registrar_gauges():
+    por_pool = lambda campo: (lambda: {p.nome: campo(p) for p in pools_distintos(app)})
+    metricas.gauge("db_pool_size", "Conexões abertas no pool", por_pool(lambda p: p.size), "pool")
+    metricas.gauge("db_pool_in_use", "Conexões do pool em uso", por_pool(lambda p: p.em_uso), "pool")
+    metricas.gauge("db_pool_max", "Tamanho máximo do pool", por_pool(lambda p: p.maxsize), "pool")
+    metricas.gauge(
+        "db_pool_acquire_timeouts", "Requisições recusadas com 503 por falta de conexão",
+        por_pool(lambda p: p.esgotamentos), "pool"
+    )
+    metricas.gauge("ws_usuarios_conectados", "Usuários com socket aberto neste worker", lambda: manager.stats()["usuarios"])
+    metricas.gauge("ws_conexoes_ativas", "Sockets abertos neste worker", lambda: manager.stats()["conexoes"])
+    metricas.gauge("ws_fila_envio", "Frames aguardando envio nas filas dos sockets", lambda: manager.stats()["fila_envio"])
+    metricas.gauge("presenca_usuarios", "Usuários por estado de presença (todos os workers)", lambda: presenca.contagem(), "estado")
+    metricas.gauge("ws_conexoes_recusadas", "Sockets recusados por limite ou desligamento", lambda: manager.recusadas)
+    metricas.gauge("ws_conexoes_ceifadas", "Sockets fechados por inatividade (sem pong)", lambda: manager.ceifadas)
+    metricas.gauge("hash_na_fila", "Chamadas de bcrypt aguardando thread", lambda: hash_pool.stats()["na_fila"])
+    metricas.gauge("hash_em_execucao", "Chamadas de bcrypt executando", lambda: hash_pool.stats()["em_execucao"])
+    metricas.gauge("hash_rejeitadas", "Chamadas de bcrypt recusadas com 503", lambda: hash_pool.rejeitadas)
+    metricas.gauge("mensagens_fila_gravacao", "Mensagens aguardando gravação em lote", lambda: message_writer.fila.qsize())
+    metricas.gauge("ia_fila_gravacao", "Interações do assistente aguardando gravação", lambda: interacao_writer.fila.qsize())
+    metricas.gauge("ia_registros_descartados", "Interações não gravadas por fila cheia", lambda: interacao_writer.descartadas)
+
+_registrar_gauges()
+
+@app.get('/metrics', response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(metricas.render(), media_type="text/plain; version=0.0.4")
+
+@app.get('/metrics/hash')
+async def metricas_hash():
+    """Fila e latência do pool de bcrypt, para calibrar BCRYPT_ROUNDS e HASH_WORKERS."""
+    return hash_pool.stats()
+
+# --- Perfil do Usuário ---
+# /login e /load-user (chamado a cada carregamento de página no frontend) leem o mesmo perfil.
+# Cache por id, com um índice email -> id. Rotas que alteram usuário/terapeuta chamam invalidar_perfil,
+# que avisa os outros workers pelo barramento: a entrada guarda o hash usado no login.
+PERFIL_CACHE_TTL = float(os.getenv("PERFIL_CACHE_TTL", 60))
+PERFIL_CACHE_SIZE = int(os.getenv("PERFIL_CACHE_SIZE", 10000))
+
+perfil_cache = TTLCache(maxsize=PERFIL_CACHE_SIZE, ttl=PERFIL_CACHE_TTL)
+perfil_email_cache = TTLCache(maxsize=PERFIL_CACHE_SIZE, ttl=PERFIL_CACHE_TTL)
+CANAL_PERFIL = "perfil"
+
+def montar_perfil(usuario: LinhaPerfil) -> dict:
+    perfil = {
+        "id": usuario.id_usuario,
+        "nome": usuario.nome,
+        "email": usuario.email,
+        "cpf": usuario.cpf,
+        "primeiro_login": usuario.primeiro_login,
+        "contato_emergencia": usuario.contato_emergencia,
+        "terapeuta_fav": usuario.terapeuta_fav,
+        "termos_aceitos": {"uso": usuario.termo_uso, "privacidade": usuario.termo_privacidade},
+        "terapeuta": None
+    }
+
+    if usuario.CRP:
+        perfil["terapeuta"] = {
+            "CRP": usuario.CRP,
+            "especialidade": usuario.especialidade,
+            "disponibilidade": usuario.disponibilidade
+        }
+    return perfil
+
+async def carregar_perfil(pool, email: Optional[str] = None, id_usuario: Optional[int] = None) -> Optional[tuple]:
+    """
+    Retorna (perfil, hash_da_senha) ou None. O perfil é compartilhado com o cache:
+    quem chamar não deve alterá-lo.
+    """
+    if email is not None:
+        email = email.lower()
+        id_usuario = perfil_email_cache.get(email)
+
+    if id_usuario is not None:
+        entrada = perfil_cache.get(id_usuario)
+        # O índice por email pode estar desatualizado se o email mudou
+        if entrada is not None and (email is None or entrada[0]["email"].lower() == email):
+            return entrada
+
+    repo = Repositorio(pool)
+    if email is not None:
+        usuario = await repo.um(PERFIL_QUERY + " WHERE u.email = %s", (email,), LinhaPerfil)
+    else:
+        usuario = await repo.um(PERFIL_QUERY + " WHERE u.id_usuario = %s", (id_usuario,), LinhaPerfil)
+
+    if not usuario:
+        return None
+
+    entrada = (montar_perfil(usuario), usuario.senha)
+    perfil_cache.set(usuario.id_usuario, entrada)
+    perfil_email_cache.set(usuario.email.lower(), usuario.id_usuario)
+    return entrada
+
+async def invalidar_perfil(*ids: int):
+    """Descarta o perfil (e o hash de senha) aqui e nos outros workers, pelo barramento."""
+    for id_usuario in ids:
+        perfil_cache.pop(id_usuario)
+    await manager.broadcast(CANAL_PERFIL, {"ids": list(ids)})
+
+async def _on_canal_perfil(message: dict):
+    for id_usuario in message["ids"]:
+        perfil_cache.pop(id_usuario)
+
+manager.assinar_canal(CANAL_PERFIL, _on_canal_perfil)
+
 # ======== ROTA: CADASTRO ==========
 @app.post('/cadastro', status_code=status.HTTP_201_CREATED)
 async def cadastro(request: Request, data: CadastroBody):
     senha_hash = await hash_password(data.senha)
-    pool = request.app.state.pool
+    repo = request.app.state.repo
 
-    async with pool.acquire() as conn:
-        async with conn.cursor(aiomysql.DictCursor) as cursor:
-            try:
-                await cursor.execute(
-                    "INSERT INTO usuario (nome, cpf, email, senha) VALUES (%s, %s, %s, %s)",
-                    (data.nome, data.cpf, data.email, senha_hash)
-                )
-                # O autocommit está ligado no pool, mas se precisar garantir:
-                # await conn.commit()
-
-                # Busca o usuário recém-criado
-                await cursor.execute("SELECT * FROM usuario WHERE email = %s", (data.email,))
-                u = await cursor.fetchone()
-
-                usuario = {
-                    "id": u["id_usuario"],
-                    "nome": u["nome"],
-                    "email": u["email"],
-                    "cpf": u["cpf"],
-                    "primeiro_login": u["primeiro_login"]
-                }
-                return usuario
-
-            except Exception as e:
-                # Em caso de erro, o aiomysql/context manager geralmente faz rollback se autocommit=False
-                # Como usamos autocommit=True, inserts parciais são raros em query única
-                raise HTTPException(status_code=500, detail=str(e))
+    # Email ou CPF repetido vira 409 (erro_interno)
+    with erro_interno("cadastrar usuário"):
+        novo_id = await repo.inserir(
+            "INSERT INTO usuario (nome, cpf, email, senha) VALUES (%s, %s, %s, %s)",
+            (data.nome, data.cpf, data.email, senha_hash)
+        )
+        # Busca o usuário recém-criado
+        return await repo.um(USUARIO_CADASTRADO, (novo_id,), UsuarioCadastrado)
 
 
 # ======== ROTA: LOGIN ==========
 @app.post('/login')
 async def login(request: Request, data: LoginBody):
     pool = request.app.state.pool
-    async with pool.acquire() as conn:
-        async with conn.cursor(aiomysql.DictCursor) as cursor:
-            query = """
-                SELECT u.id_usuario, u.nome, u.email, u.cpf, u.primeiro_login, u.senha, u.contato_emergencia, u.terapeuta_fav,
-                t.especialidade, t.CRP, t.disponibilidade
-                FROM usuario u
-                LEFT JOIN terapeuta t ON u.id_usuario = t.id_usuario
-                WHERE u.email = %s
-            """
-            await cursor.execute(query, (data.email,))
-            usuario = await cursor.fetchone()
-            
-            if not usuario:
-                raise HTTPException(status_code=404, detail="Usuário não encontrado")
-
-            # Valida senha de forma assíncrona
-            if await verify_password(data.senha, usuario["senha"]):
-                newUsuario = {
-                    "id": usuario["id_usuario"],
-                    "nome": usuario["nome"],
-                    "email": usuario["email"],
-                    "cpf": usuario["cpf"],
-                    "primeiro_login": usuario["primeiro_login"],
-                    "contato_emergencia": usuario["contato_emergencia"],
-                    "terapeuta_fav": usuario["terapeuta_fav"],
-                    "terapeuta": None
-                }
-
-                if usuario["CRP"]:
-                    newUsuario["terapeuta"] = {
-                        "CRP": usuario["CRP"],
-                        "especialidade": usuario["especialidade"],
-                        "disponibilidade": usuario["disponibilidade"]
-                    }
-
-                return newUsuario
-            else:
-                raise HTTPException(status_code=401, detail="Senha incorreta")
+    perfil = await carregar_perfil(pool, email=data.email)
+    
+    if not perfil:
+        raise HTTPException(status_code=404, detail="Usuário não encontrado")
+
+    usuario, senha_hash = perfil
+
+    # Valida senha de forma assíncrona
+    if await verify_password(data.senha, senha_hash):
+        # Migração transparente do custo do bcrypt (não atrasa a resposta)
+        if custo_do_hash(senha_hash) != BCRYPT_ROUNDS:
+            tarefa_em_fundo(rehash_senha(pool, usuario["id"], data.senha))
+
+        return com_consentimento(usuario, await termos_vigentes(request.app.state.repo))
+    else:
+        raise HTTPException(status_code=401, detail="Senha incorreta")
 
 @app.post('/has-terapeuta')
 async def has_terapeuta(request: Request, data: IdBody):
-    pool = request.app.state.pool
-    async with pool.acquire() as conn:
-        async with conn.cursor(aiomysql.DictCursor) as cursor:
-            query = """
-                SELECT t.CRP
-                FROM usuario u
-                LEFT JOIN terapeuta t ON u.id_usuario = t.id_usuario
-                WHERE u.id_usuario = %s
-            """
-            await cursor.execute(query, (data.id,))
-            usuario = await cursor.fetchone()
-            
-            if not usuario:
-                raise HTTPException(status_code=404, detail="Usuário não encontrado")
+    perfil = await carregar_perfil(request.app.state.pool, id_usuario=data.id)
+    if not perfil:
+        raise HTTPException(status_code=404, detail="Usuário não encontrado")
 
-            if usuario["CRP"]:
-                return {"CRP": usuario["CRP"]}
-            return {"message": "Terapeuta não cadastrado"}
+    if perfil[0]["terapeuta"]:
+        return {"CRP": perfil[0]["terapeuta"]["CRP"]}
+    return {"message": "Terapeuta não cadastrado"}
 
 @app.post('/load-user')
 async def load_user(request: Request, data: EmailBody):
-    pool = request.app.state.pool
-    async with pool.acquire() as conn:
-        async with conn.cursor(aiomysql.DictCursor) as cursor:
-            query = """
-                SELECT u.id_usuario, u.nome, u.email, u.cpf, u.primeiro_login, u.contato_emergencia, u.terapeuta_fav,
-                       t.especialidade, t.CRP, t.disponibilidade
-                FROM usuario u
-                LEFT JOIN terapeuta t ON u.id_usuario = t.id_usuario
-                WHERE u.email = %s
-            """
-            await cursor.execute(query, (data.email,))
-            usuario = await cursor.fetchone()
-            
-            if not usuario:
-                raise HTTPException(status_code=404, detail="Usuário não encontrado")
-
-            newUsuario = {
-                "id": usuario["id_usuario"],
-                "nome": usuario["nome"],
-                "email": usuario["email"],
-                "cpf": usuario["cpf"],
-                "primeiro_login": usuario["primeiro_login"],
-                "contato_emergencia": usuario["contato_emergencia"],
-                "terapeuta_fav": usuario["terapeuta_fav"],
-                "terapeuta": None
-            }
-
-            if usuario["CRP"]:
-                newUsuario["terapeuta"] = {
-                    "CRP": usuario["CRP"],
-                    "especialidade": usuario["especialidade"],
-                    "disponibilidade": usuario["disponibilidade"]
-                }
-            print(usuario)
-            return newUsuario
+    perfil = await carregar_perfil(request.app.state.pool, email=data.email)
+    if not perfil:
+        raise HTTPException(status_code=404, detail="Usuário não encontrado")
+    return com_consentimento(perfil[0], await termos_vigentes(request.app.state.repo))
 
 @app.put('/primeiro-login')
 async def primeiro_login(request: Request, data: IdBody):
-    pool = request.app.state.pool
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cursor:
-            # Verifica se existe primeiro
-            await cursor.execute("SELECT id_usuario FROM usuario WHERE id_usuario = %s", (data.id,))
-            if not await cursor.fetchone():
-                raise HTTPException(status_code=404, detail="Usuário não encontrado")
-            
-            await cursor.execute("UPDATE usuario SET primeiro_login = 0 WHERE id_usuario = %s", (data.id,))
-            # await conn.commit() # Se autocommit=True no pool, não precisa
-            return {"success": True}
+    repo = request.app.state.repo
+    # Verifica se existe primeiro
+    if not await repo.um("SELECT id_usuario FROM usuario WHERE id_usuario = %s", (data.id,)):
+        raise HTTPException(status_code=404, detail="Usuário não encontrado")
+
+    await repo.executar("UPDATE usuario SET primeiro_login = 0 WHERE id_usuario = %s", (data.id,))
+    await invalidar_perfil(data.id)
+    return {"success": True}
 
 @app.post('/cadastro-terapeuta', status_code=status.HTTP_201_CREATED)
 async def cadastro_terapeuta(request: Request, data: CadastroTerapeutaBody):
-    pool = request.app.state.pool
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cursor:
-            try:
-                await cursor.execute(
-                    "INSERT INTO terapeuta (id_usuario, especialidade, CRP, disponibilidade) VALUES (%s, %s, %s, %s)",
-                    (data.id, data.especialidade, data.crp, data.disponibilidade)
-                )
-                return {"mensagem": "Terapeuta cadastrado com sucesso!"}
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=str(e))
+    with erro_interno("cadastrar terapeuta"):
+        await request.app.state.repo.executar(
+            "INSERT INTO terapeuta (id_usuario, especialidade, CRP, disponibilidade) VALUES (%s, %s, %s, %s)",
+            (data.id, data.especialidade, data.crp, data.disponibilidade)
+        )
+    await invalidar_cache_terapeutas()
+    await invalidar_perfil(data.id)
+    return {"mensagem": "Terapeuta cadastrado com sucesso!"}
 
 @app.put('/cadastro-usuario', status_code=status.HTTP_201_CREATED)
 async def cadastro_usuario(request: Request, data: CadastroUsuarioBody):
-    pool = request.app.state.pool
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cursor:
-            try:
-                await cursor.execute(
-                    "UPDATE usuario SET data_nascimento = %s, endereco = %s, contato_emergencia = %s WHERE id_usuario = %s",
-                    (data.data_nascimento, data.endereco, data.contato_emergencia, data.id)
-                )
-                return {"mensagem": "Usuário alterado com sucesso!"}
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=str(e))
+    with erro_interno("alterar usuário"):
+        await request.app.state.repo.executar(
+            "UPDATE usuario SET data_nascimento = %s, endereco = %s, contato_emergencia = %s WHERE id_usuario = %s",
+            (data.data_nascimento, data.endereco, data.contato_emergencia, data.id)
+        )
+    await invalidar_perfil(data.id)
+    return {"mensagem": "Usuário alterado com sucesso!"}
+
+# --- Diretório de Terapeutas ---
+# Rota pública mais acessada: respostas ficam em cache por alguns segundos e o total
+# de registros (COUNT) por mais tempo. Cadastro/atualização de terapeuta invalidam os dois,
+# em todos os workers, pelo canal "terapeutas".
+TERAPEUTAS_CACHE_TTL = float(os.getenv("TERAPEUTAS_CACHE_TTL", 30))
+TERAPEUTAS_TOTAL_TTL = float(os.getenv("TERAPEUTAS_TOTAL_TTL", 300))
+TERAPEUTAS_LIMIT_MAX = 100
+FT_MIN_TOKEN = 3  # innodb_ft_min_token_size padrão
+
+terapeutas_cache = TTLCache(maxsize=2048, ttl=TERAPEUTAS_CACHE_TTL)
+terapeutas_total_cache = TTLCache(maxsize=512, ttl=TERAPEUTAS_TOTAL_TTL)
+CANAL_TERAPEUTAS = "terapeutas"
+
+def _limpar_cache_terapeutas():
+    terapeutas_cache.clear()
+    terapeutas_total_cache.clear()
+    despacho_panico.terapeutas_cache.clear()  # terapeuta novo já pode atender chamados
+
+async def invalidar_cache_terapeutas():
+    _limpar_cache_terapeutas()
+    await manager.broadcast(CANAL_TERAPEUTAS, {})
+
+async def _on_canal_terapeutas(message: dict):
+    _limpar_cache_terapeutas()
+
+manager.assinar_canal(CANAL_TERAPEUTAS, _on_canal_terapeutas)
+
+def termo_fulltext(texto: str) -> Optional[str]:
+    """Converte a busca em termos do modo booleano: todas as palavras, por prefixo."""
+    palavras = [p for p in re.findall(r"\w+", texto) if len(p) >= FT_MIN_TOKEN]
+    if not palavras:
+        return None
+    return " ".join(f"+{p}*" for p in palavras)
+
+def filtro_especialidade(especialidade: str) -> tuple:
+    """Trecho de WHERE (sobre o alias `t` de terapeuta) e seu parâmetro."""
+    termo = termo_fulltext(especialidade)
+    if termo:
+        # Índice FULLTEXT em terapeuta.especialidade (migração 0004)
+        return " AND MATCH(t.especialidade) AGAINST (%s IN BOOLEAN MODE)", termo
+    # Termos curtos demais para o índice: cai no LIKE
+    return " AND t.especialidade LIKE %s", f"%{especialidade}%"
 
 @app.get('/terapeutas')
 async def listar_terapeutas(
     request: Request,
-    page: int = 1,
-    limit: int = 20,
-    especialidade: Optional[str] = None
+    page: int = Query(1, ge=1),
+    limit: int = Query(20, ge=1, le=TERAPEUTAS_LIMIT_MAX),
+    especialidade: Optional[str] = None,
+    cursor: Optional[int] = None,
+    id_usuario: Optional[int] = None
 ):
-    pool = request.app.state.pool
-    offset = (page - 1) * limit
+    """
+    Lista terapeutas ordenados por id. Com `cursor` (id do último terapeuta recebido,
+    devolvido em metadata.next_cursor) a paginação é por chave; sem ele, por página.
+    Com `id_usuario`, cada terapeuta vem com `favorito`.
+    """
+    especialidade = (especialidade or "").strip().lower() or None
+    chave = (especialidade, cursor, None if cursor is not None else page, limit)
+    resposta = terapeutas_cache.get(chave)
+    if resposta is None:
+        resposta = await _buscar_terapeutas(request.app.state.repo_leitura, especialidade, page, limit, cursor)
+        terapeutas_cache.set(chave, resposta)
+
+    if id_usuario is not None:
+        with erro_interno("carregar favoritos"):
+            favoritos = await favoritos_do_usuario(request.app.state.repo, id_usuario)
+        # A resposta em cache é compartilhada entre usuários: marca numa cópia
+        resposta = {
+            "metadata": resposta["metadata"],
+            "terapeutas": [{**asdict(t), "favorito": t.id_usuario in favoritos} for t in resposta["terapeutas"]],
+        }
+    return RespostaJSON(resposta)
+
+async def _buscar_terapeutas(repo: Repositorio, especialidade: Optional[str], page: int, limit: int,
+                             cursor: Optional[int]) -> dict:
+
+    count_query = "SELECT COUNT(*) FROM terapeuta t WHERE 1 = 1"
+    data_query_base = TERAPEUTAS_LISTAGEM
+    params = []
 
-    async with pool.acquire() as conn:
-        async with conn.cursor(aiomysql.DictCursor) as cursor:
-            
-            count_query = "SELECT COUNT(*) AS total FROM usuario u LEFT JOIN terapeuta t ON u.id_usuario = t.id_usuario WHERE t.id_usuario IS NOT NULL"
-            
-            data_query_base = """
-            SELECT 
-            u.id_usuario,
-            u.nome,
-            u.email,
-            t.especialidade,
-            t.CRP,
-            t.disponibilidade,
-            (
-                SELECT COUNT(*)
-                FROM sessao s
-                WHERE s.id_terapeuta = u.id_usuario
-                AND s.status = 'concluida'
-            ) AS total_sessoes_concluidas
-            FROM usuario u 
-            LEFT JOIN terapeuta t ON u.id_usuario = t.id_usuario
-            WHERE t.id_usuario IS NOT NULL
-            """ 
-            
-            params = []
-            
-            if especialidade:
-                count_query += " AND t.especialidade LIKE %s"
-                data_query_base += " AND t.especialidade LIKE %s"
-                params.append(f"%{especialidade}%")
-            
-            data_query = data_query_base + " LIMIT %s OFFSET %s"
+    if especialidade:
+        filtro, valor = filtro_especialidade(especialidade)
+        params.append(valor)
+        count_query += filtro
+        data_query_base += filtro
 
-            try:
-                await cursor.execute(count_query, params)
-                result_total = await cursor.fetchone()
-                total_records = result_total['total']
-                
-                data_params = params + [limit, offset]
-                await cursor.execute(data_query, data_params)
-                terapeutas = await cursor.fetchall()
-                
-                total_pages = (total_records + limit - 1) // limit
-                                
-                return {
-                    "metadata": {
-                        "total_records": total_records,
-                        "total_pages": total_pages,
-                        "current_page": page,
-                        "limit": limit
-                    },
-                    "terapeutas": terapeutas
-                }
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"Erro ao listar terapeutas: {str(e)}")
+    if cursor is not None:
+        data_query = data_query_base + " AND t.id_usuario > %s ORDER BY t.id_usuario LIMIT %s"
+        data_params = params + [cursor, limit]
+    else:
+        data_query = data_query_base + " ORDER BY t.id_usuario LIMIT %s OFFSET %s"
+        data_params = params + [limit, (page - 1) * limit]
+
+    with erro_interno("listar terapeutas"):
+        total_records = terapeutas_total_cache.get(especialidade)
+        if total_records is None:
+            (total_records,) = await repo.um(count_query, params)
+            terapeutas_total_cache.set(especialidade, total_records)
+
+        terapeutas = await repo.todos(data_query, data_params, TerapeutaDiretorio)
+
+    total_pages = (total_records + limit - 1) // limit
+    next_cursor = terapeutas[-1].id_usuario if len(terapeutas) == limit else None
+
+    return {
+        "metadata": {
+            "total_records": total_records,
+            "total_pages": total_pages,
+            "current_page": page,
+            "limit": limit,
+            "next_cursor": next_cursor
+        },
+        "terapeutas": terapeutas
+    }
+
+# --- Favoritos ---
+# Conjunto de ids favoritados por usuário em cache: /terapeutas marca `favorito` sem JOIN.
+# Escritas são idempotentes (INSERT IGNORE na PK / DELETE) e invalidam o conjunto do usuário
+# e a lista reversa dos terapeutas afetados em todos os workers, pelo barramento.
+# Depois de uma escrita a recarga vem do primário: uma réplica atrasada ficaria em cache até o TTL.
+FAVORITOS_CACHE_TTL = float(os.getenv("FAVORITOS_CACHE_TTL", 300))
+FAVORITOS_CACHE_SIZE = int(os.getenv("FAVORITOS_CACHE_SIZE", 10000))
+FAVORITOS_LOTE_MAX = 100
+CANAL_FAVORITOS = "favoritos"
+
+IDS_FAVORITOS = "/* favoritos_ids */ SELECT id_terapeuta FROM usuario_salva_terapeuta WHERE id_usuario = %s"
+
+favoritos_cache = TTLCache(maxsize=FAVORITOS_CACHE_SIZE, ttl=FAVORITOS_CACHE_TTL)
+favoritos_em_voo = SingleFlight()
+# id_terapeuta -> usuários que o salvaram (a contagem vai no X-Total-Count)
+favoritados_por_cache = TTLCache(maxsize=FAVORITOS_CACHE_SIZE, ttl=FAVORITOS_CACHE_TTL)
+
+async def favoritos_do_usuario(repo: Repositorio, id_usuario: int) -> frozenset:
+    favoritos = favoritos_cache.get(id_usuario)
+    if favoritos is None:
+        favoritos = await favoritos_em_voo.do(id_usuario, partial(_carregar_favoritos, repo, id_usuario))
+    return favoritos
+
+async def _carregar_favoritos(repo: Repositorio, id_usuario: int) -> frozenset:
+    favoritos = frozenset(id_terapeuta for (id_terapeuta,) in await repo.todos(IDS_FAVORITOS, (id_usuario,)))
+    favoritos_cache.set(id_usuario, favoritos)
+    return favoritos
+
+def _invalidar_favoritos(id_usuario: int, terapeutas):
+    favoritos_cache.pop(id_usuario)
+    for id_terapeuta in terapeutas:
+        favoritados_por_cache.pop(id_terapeuta)
+
+async def _on_canal_favoritos(message: dict):
+    _invalidar_favoritos(message["id_usuario"], message["terapeutas"])
+    presenca.recarregar_observados(message["id_usuario"])
+
+manager.assinar_canal(CANAL_FAVORITOS, _on_canal_favoritos)
+
+async def alterar_favoritos(pool, id_usuario: int, adicionar: List[int], remover: List[int]) -> tuple:
+    """Aplica o lote numa conexão só; retorna (adicionados, removidos). Ids inexistentes são ignorados."""
+    adicionados = removidos = 0
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            if adicionar:
+                valores = ", ".join(["(%s, %s)"] * len(adicionar))
+                await cur.execute(
+                    f"/* favoritos_adicionar */ INSERT IGNORE INTO usuario_salva_terapeuta (id_usuario, id_terapeuta) VALUES {valores}",
+                    [v for id_terapeuta in adicionar for v in (id_usuario, id_terapeuta)],
+                )
+                adicionados = cur.rowcount
+            if remover:
+                marcadores = ", ".join(["%s"] * len(remover))
+                await cur.execute(
+                    f"/* favoritos_remover */ DELETE FROM usuario_salva_terapeuta WHERE id_usuario = %s AND id_terapeuta IN ({marcadores})",
+                    [id_usuario, *remover],
+                )
+                removidos = cur.rowcount
+    terapeutas = [*adicionar, *remover]
+    _invalidar_favoritos(id_usuario, terapeutas)
+    await manager.broadcast(CANAL_FAVORITOS, {"id_usuario": id_usuario, "terapeutas": terapeutas})
+    return adicionados, removidos
 
 @app.post('/favoritar', status_code=status.HTTP_201_CREATED)
 async def favoritar_terapeuta(request: Request, data: FavoritarBody):
-    pool = request.app.state.pool
-    query = "INSERT INTO usuario_salva_terapeuta (id_usuario, id_terapeuta) VALUES (%s, %s)"
-    
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cursor:
-            try:
-                await cursor.execute(query, (data.id_usuario, data.id_terapeuta))
-                return {"mensagem": "Terapeuta favoritado com sucesso!"}
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"Erro ao favoritar terapeuta: {str(e)}")
+    # Idempotente: favoritar de novo não é erro
+    with erro_interno("favoritar terapeuta"):
+        await alterar_favoritos(request.app.state.pool, data.id_usuario, [data.id_terapeuta], [])
+    return {"mensagem": "Terapeuta favoritado com sucesso!"}
+
+@app.patch('/usuarios/{id_usuario}/terapeutas')
+async def alterar_favoritos_em_lote(request: Request, id_usuario: int, data: FavoritosLoteBody):
+    adicionar = list(dict.fromkeys(data.adicionar))
+    remover = list(dict.fromkeys(data.remover))
+    if not adicionar and not remover:
+        raise HTTPException(status_code=400, detail="Nenhum terapeuta informado")
+    if len(adicionar) + len(remover) > FAVORITOS_LOTE_MAX:
+        raise HTTPException(status_code=400, detail=f"Máximo de {FAVORITOS_LOTE_MAX} terapeutas por chamada")
+    if set(adicionar) & set(remover):
+        raise HTTPException(status_code=400, detail="Terapeuta em adicionar e remover ao mesmo tempo")
+
+    with erro_interno("atualizar favoritos"):
+        adicionados, removidos = await alterar_favoritos(request.app.state.pool, id_usuario, adicionar, remover)
+        favoritos = await favoritos_do_usuario(request.app.state.repo, id_usuario)
+    return {"adicionados": adicionados, "removidos": removidos, "favoritos": sorted(favoritos)}
+
+@app.delete('/usuarios/{id_usuario}/terapeutas/{id_terapeuta}')
+async def desfavoritar_terapeuta(request: Request, id_usuario: int, id_terapeuta: int):
+    # Idempotente: remover um favorito que não existe também responde sucesso
+    with erro_interno("desfavoritar terapeuta"):
+        await alterar_favoritos(request.app.state.pool, id_usuario, [], [id_terapeuta])
+    return {"mensagem": "Terapeuta removido dos favoritos."}
 
 
 @app.get('/terapeuta/{id_usuario}')
-async def listar_terapeutas_por_usuario(request: Request, id_usuario: int):
+async def obter_usuario_resumo(request: Request, id_usuario: int):
     pool = request.app.state.pool
     async with pool.acquire() as conn:
         # Usando DictCursor para obter resultados como dicionário
-        async with conn.cursor(aiomysql.DictCursor) as cursor: 
+        async with conn.cursor(DictCursorMedido) as cursor: 
             query = """
             SELECT u.id_usuario, u.nome, u.email, t.especialidade, t.disponibilidade, t.CRP
             FROM
@@ -458,32 +1864,17 @@ async def listar_terapeutas_por_usuario(request: Request, id_usuario: int):
 
 @app.get('/usuarios/{id_usuario}/terapeutas')
 async def listar_terapeutas_por_usuario(request: Request, id_usuario: int):
-    pool = request.app.state.pool
-    async with pool.acquire() as conn:
-        async with conn.cursor(aiomysql.DictCursor) as cursor:
-            query = """
-            SELECT u.id_usuario, u.nome, u.email, t.especialidade, t.disponibilidade, t.CRP
-            FROM usuario_salva_terapeuta ust
-            JOIN terapeuta t ON ust.id_terapeuta = t.id_usuario
-            JOIN usuario u ON t.id_usuario = u.id_usuario
-            WHERE ust.id_usuario = %s
-            """
-            await cursor.execute(query, (id_usuario,))
-            return await cursor.fetchall()
+    return RespostaJSON(
+        await request.app.state.repo_leitura.todos(FAVORITOS_DO_USUARIO, (id_usuario,), TerapeutaFavorito)
+    )
 
 @app.get('/terapeuta/{id_terapeuta}/usuarios')
 async def listar_usuarios_por_terapeuta(request: Request, id_terapeuta: int):
-    pool = request.app.state.pool
-    async with pool.acquire() as conn:
-        async with conn.cursor(aiomysql.DictCursor) as cursor:
-            query = """
-            SELECT u.id_usuario AS id, u.nome, u.email
-            FROM usuario_salva_terapeuta ust
-            JOIN usuario u ON ust.id_usuario = u.id_usuario
-            WHERE ust.id_terapeuta = %s
-            """
-            await cursor.execute(query, (id_terapeuta,))
-            return await cursor.fetchall()
+    usuarios = favoritados_por_cache.get(id_terapeuta)
+    if usuarios is None:
+        usuarios = await request.app.state.repo.todos(USUARIOS_DO_TERAPEUTA, (id_terapeuta,), UsuarioResumo)
+        favoritados_por_cache.set(id_terapeuta, usuarios)
+    return RespostaJSON(usuarios, headers={"X-Total-Count": str(len(usuarios))})
 
 @app.put('/atualizar-usuario/{id_usuario}')
 async def atualizar_usuario(request: Request, id_usuario: int, data: AtualizarUsuarioBody):
@@ -491,163 +1882,603 @@ async def atualizar_usuario(request: Request, id_usuario: int, data: AtualizarUs
     if not dados_atualizar:
         raise HTTPException(status_code=400, detail="Nenhum dado fornecido.")
 
-    set_clauses = []
-    params = [] 
-
     if "senha" in dados_atualizar:
-        senha = dados_atualizar.pop("senha")
-        try:
-            # Hashing assíncrono
-            senha_hash_str = await hash_password(senha)
-            set_clauses.append("senha = %s") 
-            params.append(senha_hash_str)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Erro ao processar senha: {str(e)}")
+        # Hashing assíncrono
+        with erro_interno("processar senha"):
+            dados_atualizar["senha"] = await hash_password(dados_atualizar["senha"])
+
+    with erro_interno("atualizar usuário"):
+        alteradas = await request.app.state.repo.atualizar("usuario", "id_usuario", id_usuario, dados_atualizar)
+    if alteradas == 0:
+        raise HTTPException(status_code=404, detail="Usuário não encontrado ou sem alterações")
+    await invalidar_perfil(id_usuario)
+    return {"mensagem": "Usuário atualizado com sucesso!"}
+
+# --- Agenda dos Terapeutas ---
+# Disponibilidade semanal estruturada (disponibilidade_terapeuta) + sessões marcadas, indexadas
+# em memória por terapeuta numa lista ordenada de inícios. Toda sessão ocupa SESSAO_DURACAO_MIN,
+# então a lista de fins também fica ordenada e um bisect basta para achar conflito.
+# O índice acelera as consultas e recusa conflitos óbvios; a palavra final na reserva é do banco,
+# com a linha do terapeuta travada (FOR UPDATE) para serializar reservas entre workers.
+# Mudanças na agenda invalidam o índice dos outros workers pelo canal "agendas".
+SESSAO_DURACAO_MIN = int(os.getenv("SESSAO_DURACAO_MIN", 50))
+AGENDA_HORIZONTE_DIAS = int(os.getenv("AGENDA_HORIZONTE_DIAS", 60))
+AGENDA_CACHE_TTL = float(os.getenv("AGENDA_CACHE_TTL", 300))
+CANAL_AGENDAS = "agendas"
+
+DURACAO_SESSAO = timedelta(minutes=SESSAO_DURACAO_MIN)
+
+def parse_data_hora(valor: str) -> datetime:
+    """Data/hora ingênua no fuso do servidor, como as colunas DATETIME e o índice de agendas."""
+    try:
+        data_hora = datetime.fromisoformat(valor.strip())
+    except (ValueError, AttributeError):
+        raise HTTPException(status_code=400, detail=f"Data/hora inválida: {valor}")
+    if data_hora.tzinfo is not None:
+        # "Z" ou "-03:00": converte para a hora local em vez de comparar aware com naive
+        data_hora = data_hora.astimezone().replace(tzinfo=None)
+    return data_hora
+
+def parse_hora_minutos(valor: str) -> int:
+    try:
+        hora, minuto = valor.split(":")[:2]
+        return int(hora) * 60 + int(minuto)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Horário inválido: {valor}")
+
+class AgendaTerapeuta:
+    __slots__ = ("janelas", "inicios", "fins")
+
+    def __init__(self, janelas: Dict[int, List[tuple]], sessoes: List[datetime]):
+        # dia_semana (0 = segunda) -> [(minuto_inicio, minuto_fim)]
+        self.janelas = janelas
+        self.inicios: List[datetime] = sorted(sessoes)
+        self.fins: List[datetime] = [i + DURACAO_SESSAO for i in self.inicios]
+
+    def conflita(self, inicio: datetime) -> bool:
+        return self.fim_do_conflito(inicio) is not None
+
+    def fim_do_conflito(self, inicio: datetime) -> Optional[datetime]:
+        """Fim da última sessão que se sobrepõe a uma sessão começando em `inicio` (None se livre)."""
+        i = bisect_left(self.inicios, inicio + DURACAO_SESSAO)
+        if i > 0 and self.fins[i - 1] > inicio:
+            return self.fins[i - 1]
+        return None
+
+    def dentro_da_disponibilidade(self, inicio: datetime) -> bool:
+        if not self.janelas:
+            return True  # terapeuta ainda sem disponibilidade estruturada
+        minuto = inicio.hour * 60 + inicio.minute
+        return any(a <= minuto and minuto + SESSAO_DURACAO_MIN <= b for a, b in self.janelas.get(inicio.weekday(), ()))
+
+    def livres(self, de: datetime, ate: datetime, n: int) -> List[datetime]:
+        horarios = []
+        dia = de.date()
+        while dia <= ate.date():
+            meia_noite = datetime.combine(dia, datetime.min.time())
+            for a, b in sorted(self.janelas.get(dia.weekday(), ())):
+                minuto = a
+                while minuto + SESSAO_DURACAO_MIN <= b:
+                    inicio = meia_noite + timedelta(minutes=minuto)
+                    fim_conflito = self.fim_do_conflito(inicio)
+                    if fim_conflito is not None:
+                        # Sessões fora da grade: o próximo candidato é o fim da que conflitou, e não o
+                        # próximo passo da grade (senão 09:00-12:00 com uma sessão às 10:00 nunca oferece 10:50)
+                        minuto = -(-(fim_conflito - meia_noite) // timedelta(minutes=1))
+                        continue
+                    if inicio >= de and inicio + DURACAO_SESSAO <= ate:
+                        horarios.append(inicio)
+                        if len(horarios) >= n:
+                            return horarios
+                    minuto += SESSAO_DURACAO_MIN
+            dia += timedelta(days=1)
+        return horarios
+
+class IndiceAgendas:
+    def __init__(self):
+        self.cache = TTLCache(maxsize=5000, ttl=AGENDA_CACHE_TTL)
+        self.travas: Dict[int, asyncio.Lock] = {}
+
+    def trava(self, id_terapeuta: int) -> asyncio.Lock:
+        trava = self.travas.get(id_terapeuta)
+        if trava is None:
+            trava = self.travas[id_terapeuta] = asyncio.Lock()
+        return trava
+
+    def invalidar(self, id_terapeuta: int):
+        self.cache.pop(id_terapeuta)
+
+    async def obter(self, pool, id_terapeuta: int) -> AgendaTerapeuta:
+        return (await self.obter_varias(pool, [id_terapeuta]))[id_terapeuta]
+
+    async def obter_varias(self, pool, ids: List[int]) -> Dict[int, AgendaTerapeuta]:
+        """Agendas de vários terapeutas; as que não estão em cache vêm em duas consultas no total."""
+        agendas = {}
+        faltando = []
+        for id_terapeuta in ids:
+            agenda = self.cache.get(id_terapeuta)
+            if agenda is None:
+                faltando.append(id_terapeuta)
+            else:
+                agendas[id_terapeuta] = agenda
+        if not faltando:
+            return agendas
+
+        marcadores = ", ".join(["%s"] * len(faltando))
+        agora = datetime.now()
+        janelas = {i: {} for i in faltando}
+        sessoes = {i: [] for i in faltando}
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(f"""
+                    SELECT id_terapeuta, dia_semana, TIME_TO_SEC(hora_inicio) DIV 60, TIME_TO_SEC(hora_fim) DIV 60
+                    FROM disponibilidade_terapeuta
+                    WHERE id_terapeuta IN ({marcadores})
+                """, faltando)
+                for id_terapeuta, dia, inicio, fim in await cur.fetchall():
+                    janelas[id_terapeuta].setdefault(dia, []).append((int(inicio), int(fim)))
+
+                # Só o horizonte útil, pelo índice (id_terapeuta, data_hora_agendamento)
+                await cur.execute(f"""
+                    SELECT id_terapeuta, data_hora_agendamento
+                    FROM sessao
+                    WHERE id_terapeuta IN ({marcadores})
+                      AND data_hora_agendamento >= %s AND data_hora_agendamento < %s
+                      AND status <> 'cancelada'
+                """, faltando + [agora - DURACAO_SESSAO, agora + timedelta(days=AGENDA_HORIZONTE_DIAS)])
+                for id_terapeuta, inicio in await cur.fetchall():
+                    sessoes[id_terapeuta].append(inicio)
+
+        for id_terapeuta in faltando:
+            agenda = AgendaTerapeuta(janelas[id_terapeuta], sessoes[id_terapeuta])
+            self.cache.set(id_terapeuta, agenda)
+            agendas[id_terapeuta] = agenda
+        return agendas
+
+agendas = IndiceAgendas()
+
+async def invalidar_agenda(id_terapeuta: int):
+    agendas.invalidar(id_terapeuta)
+    await manager.broadcast(CANAL_AGENDAS, {"id_terapeuta": id_terapeuta})
+
+async def _on_canal_agendas(message: dict):
+    agendas.invalidar(message["id_terapeuta"])
+
+manager.assinar_canal(CANAL_AGENDAS, _on_canal_agendas)
+
+def _limites_busca(de: Optional[str], ate: Optional[str]) -> tuple:
+    agora = datetime.now()
+    inicio = max(parse_data_hora(de), agora) if de else agora
+    limite = agora + timedelta(days=AGENDA_HORIZONTE_DIAS)
+    fim = min(parse_data_hora(ate), limite) if ate else limite
+    return inicio, fim
+
+@app.put('/terapeuta/{id_terapeuta}/disponibilidade')
+async def definir_disponibilidade(request: Request, id_terapeuta: int, data: DisponibilidadeBody):
+    linhas = []
+    for janela in data.janelas:
+        inicio, fim = parse_hora_minutos(janela.hora_inicio), parse_hora_minutos(janela.hora_fim)
+        if not 0 <= janela.dia_semana <= 6 or inicio >= fim:
+            raise HTTPException(status_code=400, detail="Janela de disponibilidade inválida")
+        linhas.append((id_terapeuta, janela.dia_semana, janela.hora_inicio, janela.hora_fim))
 
-    for key, value in dados_atualizar.items():
-        set_clauses.append(f"{key} = %s")
-        params.append(value)
-    
-    if not set_clauses:
-        raise HTTPException(status_code=400, detail="Nenhum dado válido.")
+    pool = request.app.state.pool
+    async with pool.acquire() as conn:
+        await conn.begin()
+        try:
+            async with conn.cursor() as cursor:
+                await cursor.execute("DELETE FROM disponibilidade_terapeuta WHERE id_terapeuta = %s", (id_terapeuta,))
+                if linhas:
+                    valores = ", ".join(["(%s, %s, %s, %s)"] * len(linhas))
+                    await cursor.execute(
+                        f"INSERT INTO disponibilidade_terapeuta (id_terapeuta, dia_semana, hora_inicio, hora_fim) VALUES {valores}",
+                        [v for linha in linhas for v in linha]
+                    )
+            await conn.commit()
+        except Exception:
+            await conn.rollback()
+            with erro_interno("salvar disponibilidade"):
+                raise
+    await invalidar_agenda(id_terapeuta)
+    return {"mensagem": "Disponibilidade atualizada com sucesso!"}
+
+@app.get('/terapeuta/{id_terapeuta}/disponibilidade')
+async def obter_disponibilidade(request: Request, id_terapeuta: int):
+    agenda = await agendas.obter(request.app.state.pool, id_terapeuta)
+    return [
+        {"dia_semana": dia, "hora_inicio": f"{a // 60:02d}:{a % 60:02d}", "hora_fim": f"{b // 60:02d}:{b % 60:02d}"}
+        for dia, janelas in sorted(agenda.janelas.items()) for a, b in sorted(janelas)
+    ]
+
+@app.get('/terapeuta/{id_terapeuta}/horarios-livres')
+async def horarios_livres_terapeuta(
+    request: Request,
+    id_terapeuta: int,
+    de: Optional[str] = None,
+    ate: Optional[str] = None,
+    n: int = Query(10, ge=1, le=100)
+):
+    inicio, fim = _limites_busca(de, ate)
+    agenda = await agendas.obter(request.app.state.pool, id_terapeuta)
+    return [h.isoformat() for h in agenda.livres(inicio, fim, n)]
 
-    atualizacao = ", ".join(set_clauses)
-    query = f"UPDATE usuario SET {atualizacao} WHERE id_usuario = %s"
-    params.append(id_usuario)
-    
+@app.get('/horarios-livres')
+async def horarios_livres(
+    request: Request,
+    especialidade: Optional[str] = None,
+    de: Optional[str] = None,
+    ate: Optional[str] = None,
+    por_terapeuta: int = Query(3, ge=1, le=20)
+):
+    """Próximos horários livres de todos os terapeutas (opcionalmente de uma especialidade) num intervalo."""
+    inicio, fim = _limites_busca(de, ate)
     pool = request.app.state.pool
+
+    query = "SELECT t.id_usuario, u.nome, t.especialidade FROM terapeuta t JOIN usuario u ON u.id_usuario = t.id_usuario WHERE 1 = 1"
+    params = []
+    if especialidade:
+        filtro, valor = filtro_especialidade(especialidade.strip())
+        query += filtro
+        params.append(valor)
+
     async with pool.acquire() as conn:
-        async with conn.cursor() as cursor:
-            try:
-               await cursor.execute(query, params)
-               if cursor.rowcount == 0:
-                   raise HTTPException(status_code=404, detail="Usuário não encontrado ou sem alterações")
-               return {"mensagem": "Usuário atualizado com sucesso!"}
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"Erro ao atualizar: {str(e)}")
+        async with conn.cursor(DictCursorMedido) as cursor:
+            await cursor.execute(query, params)
+            terapeutas = await cursor.fetchall()
+
+    mapa = await agendas.obter_varias(pool, [t["id_usuario"] for t in terapeutas])
+    resultado = []
+    for t in terapeutas:
+        horarios = mapa[t["id_usuario"]].livres(inicio, fim, por_terapeuta)
+        if horarios:
+            resultado.append({**t, "horarios": [h.isoformat() for h in horarios]})
+    return resultado
 
 @app.post('/sessao', status_code=status.HTTP_201_CREATED)
 async def criar_sessao(request: Request, data: CriarSessaoBody):
     pool = request.app.state.pool
+    inicio = parse_data_hora(data.data_hora_agendamento)
+
+    # Checagem rápida em memória (sem ir ao banco para recusar um conflito óbvio). O índice pode estar
+    # atrasado: as duas checagens se repetem no banco, com o terapeuta travado.
+    # `encaixe` é para atendimentos de emergência: ignora disponibilidade e conflitos.
+    if not data.encaixe:
+        agenda = await agendas.obter(pool, data.id_terapeuta)
+        if not agenda.dentro_da_disponibilidade(inicio):
+            raise HTTPException(status_code=409, detail="Horário fora da disponibilidade do terapeuta")
+        if agenda.conflita(inicio):
+            raise HTTPException(status_code=409, detail="Horário já reservado")
+
     query = "INSERT INTO sessao (id_usuario, id_terapeuta, data_hora_agendamento) VALUES (%s, %s, %s)"
     
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cursor:
-            try:
-               await cursor.execute(query, (data.id_usuario, data.id_terapeuta, data.data_hora_agendamento))
-                
-               if hasattr(cursor, 'lastrowid'):
-                    novo_id = cursor.lastrowid
-               else:
-                    raise NotImplementedError("O driver não suporta lastrowid.")
-                
-                # 🚨 NOVA QUERY PARA BUSCAR O UUID
-               busca_uuid_query = "SELECT BIN_TO_UUID(uuid) as uuid FROM sessao WHERE id_sessao = %s"
-               await cursor.execute(busca_uuid_query, (novo_id,))
-                
-               resultado_uuid = await cursor.fetchone()
-                
-               if resultado_uuid:
-                    novo_uuid_retornado = resultado_uuid[0] # Assumindo fetchone retorna uma tupla
-               else:
-                    novo_uuid_retornado = None
-
-                # 3. Retorna o ID
-               return {
-                    "mensagem": "Sessão criada com sucesso!", 
-                    "id_sessao": novo_id,
-                    "uuid": novo_uuid_retornado # Retorna o UUID
-                }
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"Erro ao criar sessão: {str(e)}")
+    async with agendas.trava(data.id_terapeuta):
+        async with pool.acquire() as conn:
+            await conn.begin()
+            async with conn.cursor() as cursor:
+                try:
+                   # Serializa reservas do mesmo terapeuta entre workers
+                   await cursor.execute("SELECT id_usuario FROM terapeuta WHERE id_usuario = %s FOR UPDATE", (data.id_terapeuta,))
+                   if not await cursor.fetchone():
+                        raise HTTPException(status_code=404, detail="Terapeuta não encontrado")
+
+                   if not data.encaixe:
+                        # Sem janelas cadastradas vale qualquer horário (como em dentro_da_disponibilidade)
+                        fim = inicio + DURACAO_SESSAO
+                        await cursor.execute("""
+                            SELECT COUNT(*), COALESCE(SUM(dia_semana = %s AND hora_inicio <= %s AND hora_fim >= %s), 0)
+                            FROM disponibilidade_terapeuta
+                            WHERE id_terapeuta = %s
+                        """, (inicio.weekday(), inicio.time(), fim.time(), data.id_terapeuta))
+                        janelas, cabe = await cursor.fetchone()
+                        if janelas and (not cabe or fim.date() != inicio.date()):
+                            raise HTTPException(status_code=409, detail="Horário fora da disponibilidade do terapeuta")
+
+                        # Leitura com trava: enxerga a última reserva confirmada, não o snapshot da transação
+                        await cursor.execute("""
+                            SELECT 1 FROM sessao
+                            WHERE id_terapeuta = %s AND status <> 'cancelada'
+                              AND data_hora_agendamento > %s AND data_hora_agendamento < %s
+                            LIMIT 1 FOR SHARE
+                        """, (data.id_terapeuta, inicio - DURACAO_SESSAO, fim))
+                        if await cursor.fetchone():
+                            raise HTTPException(status_code=409, detail="Horário já reservado")
+
+                   await cursor.execute(query, (data.id_usuario, data.id_terapeuta, inicio))
+                    
+                   if hasattr(cursor, 'lastrowid'):
+                        novo_id = cursor.lastrowid
+                   else:
+                        raise NotImplementedError("O driver não suporta lastrowid.")
+                    
+                    # 🚨 NOVA QUERY PARA BUSCAR O UUID
+                   busca_uuid_query = "SELECT BIN_TO_UUID(uuid) as uuid FROM sessao WHERE id_sessao = %s"
+                   await cursor.execute(busca_uuid_query, (novo_id,))
+                    
+                   resultado_uuid = await cursor.fetchone()
+                    
+                   if resultado_uuid:
+                        novo_uuid_retornado = resultado_uuid[0] # Assumindo fetchone retorna uma tupla
+                   else:
+                        novo_uuid_retornado = None
+                   await conn.commit()
+                except HTTPException:
+                    await conn.rollback()
+                    raise
+                except Exception:
+                    await conn.rollback()
+                    with erro_interno("criar sessão"):
+                        raise
+
+    # Todos os workers (inclusive este) recarregam a agenda na próxima consulta
+    await invalidar_agenda(data.id_terapeuta)
+
+    # 3. Retorna o ID
+    return {
+        "mensagem": "Sessão criada com sucesso!", 
+        "id_sessao": novo_id,
+        "uuid": novo_uuid_retornado # Retorna o UUID
+    }
+
+SESSOES_LIMIT_PADRAO = 100
+SESSOES_LIMIT_MAX = 500
+STATUS_SESSAO = ('agendada', 'concluida', 'cancelada', 'pendente')
+
+def _cursor_sessao(linha: SessaoListagem) -> str:
+    return f"{linha.data_hora_agendamento.isoformat()}_{linha.id_sessao}"
 
 @app.get('/sessoes/{tipo}/{id}')
-async def listar_sessoes(request: Request, tipo: str, id: int):
+async def listar_sessoes(
+    request: Request,
+    tipo: str,
+    id: int,
+    de: Optional[str] = Query(None, alias="from"),
+    ate: Optional[str] = Query(None, alias="to"),
+    status_sessao: Optional[str] = Query(None, alias="status"),
+    cursor: Optional[str] = None,
+    limit: int = Query(SESSOES_LIMIT_PADRAO, ge=1, le=SESSOES_LIMIT_MAX),
+    formato: str = "json"
+):
+    """
+    Sessões ordenadas por data_hora_agendamento. Paginação por chave: o cabeçalho X-Next-Cursor
+    traz o valor a repassar em `cursor`. Com formato=ndjson a resposta é um stream de todas as
+    sessões filtradas (uma por linha), lido do MySQL sem bufferizar o resultado inteiro.
+    """
     if tipo not in ('terapeuta', 'usuario'):
         raise HTTPException(status_code=400, detail="Tipo deve ser 'terapeuta' ou 'usuario'")
+    if status_sessao is not None and status_sessao not in STATUS_SESSAO:
+        raise HTTPException(status_code=400, detail=f"Status deve ser um de {', '.join(STATUS_SESSAO)}")
+    if formato not in ('json', 'ndjson'):
+        raise HTTPException(status_code=400, detail="Formato deve ser 'json' ou 'ndjson'")
 
-    pool = request.app.state.pool
-    
-    base_query = """
-    SELECT 
-        u.id_usuario, u.nome, u.email,
-        s.status, s.data_hora_agendamento, s.data_hora_inicio,
-        s.data_hora_fim, s.duracao, s.id_sessao, s.tipo, BIN_TO_UUID(s.uuid) as uuid
-    FROM sessao s
-    """
+    pool = request.app.state.pool_leitura
+    base_query = SESSOES_LISTAGEM
 
+    # Índices (id_terapeuta|id_usuario, [status,] data_hora_agendamento) — migração 0007
     if tipo == 'terapeuta':
         query = base_query + " JOIN usuario u ON s.id_usuario = u.id_usuario WHERE s.id_terapeuta = %s"
     else:
         query = base_query + " JOIN usuario u ON s.id_terapeuta = u.id_usuario WHERE s.id_usuario = %s"
-
-    async with pool.acquire() as conn:
-        async with conn.cursor(aiomysql.DictCursor) as cursor:
-            try:
-                await cursor.execute(query, (id,))
-                sessoes = await cursor.fetchall()
-                return sessoes
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"Erro ao listar sessoes: {str(e)}")
+    params: list = [id]
+
+    if status_sessao:
+        query += " AND s.status = %s"
+        params.append(status_sessao)
+    if de:
+        query += " AND s.data_hora_agendamento >= %s"
+        params.append(parse_data_hora(de))
+    if ate:
+        query += " AND s.data_hora_agendamento < %s"
+        params.append(parse_data_hora(ate))
+    if cursor:
+        try:
+            data_cursor, id_cursor = cursor.rsplit("_", 1)
+            data_cursor, id_cursor = datetime.fromisoformat(data_cursor), int(id_cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+        query += " AND (s.data_hora_agendamento > %s OR (s.data_hora_agendamento = %s AND s.id_sessao > %s))"
+        params.extend([data_cursor, data_cursor, id_cursor])
+    query += " ORDER BY s.data_hora_agendamento, s.id_sessao"
+
+    if formato == 'ndjson':
+        # Conexão e execute antes do StreamingResponse: pool esgotado ou erro de SQL ainda viram
+        # 503/500, em vez de um corpo truncado depois do 200
+        recursos = AsyncExitStack()
+        try:
+            with erro_interno("listar sessoes"):
+                conn = await recursos.enter_async_context(pool.acquire())
+                # SSDictCursor: as linhas vêm do servidor aos poucos, sem fetchall()
+                cur = await recursos.enter_async_context(conn.cursor(SSDictCursorMedido))
+                await cur.execute(query, params)
+        except BaseException:
+            await recursos.aclose()
+            raise
+        return StreamingResponse(_stream_sessoes(cur, recursos), media_type="application/x-ndjson")
+
+    query += " LIMIT %s"
+    params.append(limit)
+
+    with erro_interno("listar sessoes"):
+        sessoes = await request.app.state.repo_leitura.todos(query, params, SessaoListagem)
+
+    headers = {"X-Next-Cursor": _cursor_sessao(sessoes[-1])} if len(sessoes) == limit else None
+    return RespostaJSON(sessoes, headers=headers)
+
+async def _stream_sessoes(cur, recursos: AsyncExitStack):
+    # Fecha o cursor e devolve a conexão ao pool ao terminar (ou se o cliente desconectar)
+    try:
+        while True:
+            linhas = await cur.fetchmany(500)
+            if not linhas:
+                break
+            yield b"".join(dumps_json(linha) + b"\n" for linha in linhas)
+    finally:
+        await recursos.aclose()
+
+# --- Detalhe da Sessão ---
+# A sala da sessão consulta /sessao/{id} em polling e a linha quase nunca muda: o documento
+# montado fica em cache por UUID (já serializado, com o ETag) por poucos segundos.
+# atualizar_sessao invalida a entrada em todos os workers pelo barramento.
+SESSAO_CACHE_TTL = float(os.getenv("SESSAO_CACHE_TTL", 15))
+SESSAO_CACHE_SIZE = int(os.getenv("SESSAO_CACHE_SIZE", 10000))
+SESSOES_LOTE_MAX = 100
+CANAL_SESSOES = "sessoes"
+
+sessao_cache = TTLCache(maxsize=SESSAO_CACHE_SIZE, ttl=SESSAO_CACHE_TTL)
+
+def normalizar_uuid(valor: str) -> Optional[str]:
+    """Forma canônica (minúsculas, com hífens) usada como chave; None se não for UUID."""
+    try:
+        return str(uuid.UUID(valor))
+    except (ValueError, AttributeError):
+        return None
+
+def montar_sessao(s: SessaoDetalhe) -> dict:
+    return {
+        "id_sessao": s.id_sessao,
+        "uuid": s.uuid,
+        "tipo": s.tipo,
+        "status": s.status,
+        "data_hora_agendamento": s.data_hora_agendamento,
+        "data_hora_inicio": s.data_hora_inicio,
+        "data_hora_fim": s.data_hora_fim,
+        "duracao": s.duracao,
+        "criadoEm": s.criadoEm,
+        "atualizadoEm": s.atualizadoEm,
+        "usuario": {
+            "id": s.id_usuario,
+            "nome": s.nome_usuario,
+            "email": s.email_usuario,
+        },
+        "terapeuta": {
+            "id": s.id_terapeuta,
+            "nome": s.nome_terapeuta,
+            "email": s.email_terapeuta,
+        }
+    }
+
+def guardar_sessao(s: SessaoDetalhe) -> tuple:
+    """Monta e guarda (documento, corpo, etag). atualizadoEm tem resolução de segundos e o nome
+    dos participantes muda sem tocar a sessão, então o ETag leva também o CRC do corpo."""
+    documento = montar_sessao(s)
+    corpo = dumps_json(documento)
+    etag = f'W/"{s.id_sessao}-{int(s.atualizadoEm.timestamp())}-{zlib.crc32(corpo):08x}"'
+    entrada = (documento, corpo, etag)
+    sessao_cache.set(s.uuid, entrada)
+    return entrada
+
+def etag_confere(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Comparação fraca: ignora o prefixo W/
+    alvo = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == alvo for tag in if_none_match.split(","))
+
+async def _on_canal_sessoes(message: dict):
+    sessao_cache.pop(message["uuid"])
+
+manager.assinar_canal(CANAL_SESSOES, _on_canal_sessoes)
 
 @app.get('/sessao/{id}')
 async def get_sessao(request: Request, id: str):
-    pool = request.app.state.pool
-    query = """
-    SELECT 
-        s.id_sessao, s.tipo, s.status, s.data_hora_agendamento,
-        s.data_hora_inicio, s.data_hora_fim, s.duracao, s.criadoEm, s.atualizadoEm,
-        u.id_usuario AS id_usuario, u.nome AS nome_usuario, u.email AS email_usuario,
-        t.id_usuario AS id_terapeuta, t.nome AS nome_terapeuta, t.email AS email_terapeuta
-    FROM sessao s
-    JOIN usuario u ON s.id_usuario = u.id_usuario
-    JOIN usuario t ON s.id_terapeuta = t.id_usuario
-    WHERE s.uuid = UUID_TO_BIN(%s)
-    LIMIT 1
-    """
-    
-    async with pool.acquire() as conn:
-        async with conn.cursor(aiomysql.DictCursor) as cursor:
-            await cursor.execute(query, (id,))
-            s = await cursor.fetchone()
-            
-            if not s:
-                raise HTTPException(status_code=404, detail="Sessão não encontrada")
-
-            return {
-                "id_sessao":s["id_sessao"],
-                "tipo": s["tipo"],
-                "status": s["status"],
-                "data_hora_agendamento": s["data_hora_agendamento"],
-                "data_hora_inicio": s["data_hora_inicio"],
-                "data_hora_fim": s["data_hora_fim"],
-                "duracao": s["duracao"],
-                "criadoEm": s["criadoEm"],
-                "atualizadoEm": s["atualizadoEm"],
-                "usuario": {
-                    "id": s["id_usuario"],
-                    "nome": s["nome_usuario"],
-                    "email": s["email_usuario"],
-                },
-                "terapeuta": {
-                    "id": s["id_terapeuta"],
-                    "nome": s["nome_terapeuta"],
-                    "email": s["email_terapeuta"],
-                }
-            }
+    chave = normalizar_uuid(id)
+    if chave is None:
+        raise HTTPException(status_code=404, detail="Sessão não encontrada")
+
+    entrada = sessao_cache.get(chave)
+    if entrada is None:
+        with erro_interno("buscar sessão"):
+            s = await request.app.state.repo.um(SESSAO_POR_UUID, (chave,), SessaoDetalhe)
+        if not s:
+            raise HTTPException(status_code=404, detail="Sessão não encontrada")
+        entrada = guardar_sessao(s)
+
+    _, corpo, etag = entrada
+    # no-cache: o navegador guarda, mas revalida com If-None-Match a cada polling
+    cabecalhos = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_confere(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cabecalhos)
+    return Response(content=corpo, media_type="application/json", headers=cabecalhos)
+
+@app.post('/sessoes/por-uuid')
+async def get_sessoes_por_uuid(request: Request, data: SessoesPorUuidBody):
+    """Resolve vários UUIDs de uma vez (painéis com listas de sessões): o que não está em cache sai numa consulta só."""
+    chaves = list(dict.fromkeys(data.uuids))
+    if len(chaves) > SESSOES_LOTE_MAX:
+        raise HTTPException(status_code=400, detail=f"Máximo de {SESSOES_LOTE_MAX} sessões por chamada")
+
+    sessoes: Dict[str, dict] = {}
+    faltando = []
+    for original in chaves:
+        chave = normalizar_uuid(original)
+        entrada = sessao_cache.get(chave) if chave else None
+        if entrada is not None:
+            sessoes[chave] = entrada[0]
+        elif chave:
+            faltando.append(chave)
+
+    if faltando:
+        query = SESSOES_POR_UUIDS.format(marcadores=", ".join(["UUID_TO_BIN(%s)"] * len(faltando)))
+        with erro_interno("buscar sessões"):
+            linhas = await request.app.state.repo.todos(query, faltando, SessaoDetalhe)
+        for s in linhas:
+            sessoes[s.uuid] = guardar_sessao(s)[0]
+
+    nao_encontradas = [u for u in chaves if normalizar_uuid(u) not in sessoes]
+    return RespostaJSON({"sessoes": sessoes, "nao_encontradas": nao_encontradas})
 
 @app.put('/atualizar-sessao/{id_sessao}')
 async def atualizar_sessao(request: Request, id_sessao: int, data: AtualizarSessaoBody):
     pool = request.app.state.pool
+    async with pool.acquire() as conn:
+        await conn.begin()
+        try:
+            async with conn.cursor(DictCursorMedido) as cursor:
+                # Trava a linha para que o contador do terapeuta acompanhe a transição de status
+                await cursor.execute(
+                    "SELECT status, id_terapeuta, BIN_TO_UUID(uuid) AS uuid FROM sessao WHERE id_sessao = %s FOR UPDATE",
+                    (id_sessao,)
+                )
+                sessao = await cursor.fetchone()
+                if not sessao:
+                    raise HTTPException(status_code=404, detail="Sessao nao encontrada")
+
+                await cursor.execute("UPDATE sessao SET status = %s WHERE id_sessao = %s", (data.status, id_sessao))
+
+                delta = (data.status == 'concluida') - (sessao["status"] == 'concluida')
+                if delta and sessao["id_terapeuta"]:
+                    await cursor.execute(
+                        "UPDATE terapeuta SET total_sessoes_concluidas = GREATEST(total_sessoes_concluidas + %s, 0) WHERE id_usuario = %s",
+                        (delta, sessao["id_terapeuta"])
+                    )
+            await conn.commit()
+            if sessao["id_terapeuta"] and (data.status == 'cancelada') != (sessao["status"] == 'cancelada'):
+                await invalidar_agenda(sessao["id_terapeuta"])
+            if sessao["uuid"]:
+                sessao_cache.pop(sessao["uuid"])
+                await manager.broadcast(CANAL_SESSOES, {"uuid": sessao["uuid"]})
+            return {"mensagem": "Sessao atualizada com sucesso!"}
+        except Exception:
+            await conn.rollback()
+            with erro_interno("atualizar sessao"):
+                raise
+
+async def recalcular_estatisticas_terapeutas(pool) -> int:
+    """Reconstrói terapeuta.total_sessoes_concluidas a partir da tabela sessao."""
     async with pool.acquire() as conn:
         async with conn.cursor() as cursor:
-            try:
-               await cursor.execute("UPDATE sessao SET status = %s WHERE id_sessao = %s", (data.status, id_sessao))
-               if cursor.rowcount == 0:
-                   raise HTTPException(status_code=404, detail="Sessao nao encontrada")
-               return {"mensagem": "Sessao atualizada com sucesso!"}
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"Erro ao atualizar sessao: {str(e)}")
+            await cursor.execute("""
+                UPDATE terapeuta t
+                LEFT JOIN (
+                    SELECT id_terapeuta, COUNT(*) AS total
+                    FROM sessao
+                    WHERE status = 'concluida'
+                    GROUP BY id_terapeuta
+                ) s ON s.id_terapeuta = t.id_usuario
+                SET t.total_sessoes_concluidas = COALESCE(s.total, 0)
+            """)
+            return cursor.rowcount
 
 @app.put('/atualizar-terapeuta/{id_usuario}')
 async def atualizar_terapeuta(request: Request, id_usuario: int, data: AtualizarTerapeutaBody):
@@ -655,56 +2486,156 @@ async def atualizar_terapeuta(request: Request, id_usuario: int, data: Atualizar
     if not dados_atualizar:
         raise HTTPException(status_code=400, detail="Nenhum dado fornecido.")
 
-    set_clauses = []
-    params = []
-    for key, value in dados_atualizar.items():
-        set_clauses.append(f"{key} = %s")
-        params.append(value)
+    with erro_interno("atualizar terapeuta"):
+        alteradas = await request.app.state.repo.atualizar("terapeuta", "id_usuario", id_usuario, dados_atualizar)
+    if alteradas == 0:
+        raise HTTPException(status_code=404, detail="Terapeuta não encontrado")
+    await invalidar_cache_terapeutas()
+    await invalidar_perfil(id_usuario)
+    return {"mensagem": "Terapeuta atualizado com sucesso!"}
+
+# --- Termos e Consentimentos ---
+# Registro em memória da versão vigente (último id ativo) de cada tipo de termo.
+# Publicar um termo limpa o registro em todos os workers pelo barramento; o TTL cobre
+# alterações feitas direto no banco.
+TERMOS_CACHE_TTL = float(os.getenv("TERMOS_CACHE_TTL", 300))
+CONSENTIMENTOS_MAX = int(os.getenv("CONSENTIMENTOS_MAX", 10000))
+CONSENTIMENTOS_LOTE = 1000  # linhas por INSERT
+CANAL_TERMOS = "termos"
+
+TERMOS_VIGENTES = """
+    /* termos_vigentes */
+    SELECT t.id, t.tipo, t.versao, t.titulo, t.publicado_em
+    FROM termos t
+    JOIN (SELECT tipo, MAX(id) AS id FROM termos WHERE ativo = 1 GROUP BY tipo) v ON v.id = t.id
+"""
+
+@dataclass(slots=True)
+class TermoVigente:
+    id: int
+    tipo: str
+    versao: str
+    titulo: str
+    publicado_em: Optional[datetime]
 
-    atualizacao = ", ".join(set_clauses)
-    query = f"UPDATE terapeuta SET {atualizacao} WHERE id_usuario = %s"
-    params.append(id_usuario)
-    
-    pool = request.app.state.pool
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cursor:
-            try:
-                await cursor.execute(query, params)
-                if cursor.rowcount == 0:
-                    raise HTTPException(status_code=404, detail="Terapeuta não encontrado")
-                return {"mensagem": "Terapeuta atualizado com sucesso!"}
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"Erro ao atualizar terapeuta: {str(e)}")
+termos_cache = TTLCache(maxsize=1, ttl=TERMOS_CACHE_TTL)
+termos_em_voo = SingleFlight()
+
+async def termos_vigentes(repo: Repositorio) -> Dict[str, TermoVigente]:
+    vigentes = termos_cache.get(CANAL_TERMOS)
+    if vigentes is None:
+        vigentes = await termos_em_voo.do(CANAL_TERMOS, partial(_carregar_termos, repo))
+    return vigentes
+
+async def _carregar_termos(repo: Repositorio) -> Dict[str, TermoVigente]:
+    vigentes = {t.tipo: t for t in await repo.todos(TERMOS_VIGENTES, (), TermoVigente)}
+    termos_cache.set(CANAL_TERMOS, vigentes)
+    return vigentes
+
+async def _on_canal_termos(message: dict):
+    termos_cache.clear()
+
+manager.assinar_canal(CANAL_TERMOS, _on_canal_termos)
+
+def com_consentimento(perfil: dict, vigentes: Dict[str, TermoVigente]) -> dict:
+    """Cópia do perfil (o original é do cache) com os termos vigentes que o usuário ainda não aceitou."""
+    aceitos = perfil["termos_aceitos"]
+    pendentes = [t.id for tipo, t in vigentes.items() if (aceitos.get(tipo) or 0) < t.id]
+    return {**perfil, "termos_pendentes": pendentes, "consentimento_ok": not pendentes}
 
 @app.post('/termos',status_code=status.HTTP_201_CREATED)
 async def criar_termo(request: Request, data: CriarTermoBody):
-    pool = request.app.state.pool
-
     if data.tipo not in ['privacidade', 'uso']:
         raise HTTPException(
             status_code=400, 
             detail="Tipo deve ser 'privacidade' ou 'uso'"
             )
     
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cursor:
-            try:
-                query = """ 
-                INSERT INTO termos 
-                (tipo, versao, titulo, conteudo)
-                VALUES (%s,%s,%s,%s)
-                """
-                await cursor.execute(query, (data.tipo, data.versao, data.titulo, data.conteudo))
-                await conn.commit()
-                return {
-                    "mensagem": "Termo criado com sucesso!", 
-                    "id": cursor.lastrowid
-                }
-            except Exception as e:
-                await conn.rollback()
-                raise HTTPException(status_code=500, detail=f"Erro ao criar termo: {str(e)}")
-            
+    query = """ 
+    INSERT INTO termos 
+    (tipo, versao, titulo, conteudo)
+    VALUES (%s,%s,%s,%s)
+    """
+    with erro_interno("criar termo"):
+        id_termo = await request.app.state.repo.inserir(query, (data.tipo, data.versao, data.titulo, data.conteudo))
+    termos_cache.clear()
+    await manager.broadcast(CANAL_TERMOS, {"id": id_termo, "tipo": data.tipo})
+    return {
+        "mensagem": "Termo criado com sucesso!", 
+        "id": id_termo
+    }
+
+@app.get('/termos/vigentes')
+async def listar_termos_vigentes(request: Request):
+    with erro_interno("listar termos"):
+        vigentes = await termos_vigentes(request.app.state.repo)
+    return RespostaJSON(list(vigentes.values()))
+
+@app.post('/consentimentos', status_code=status.HTTP_201_CREATED)
+async def registrar_consentimentos(request: Request, data: RegistrarConsentimentosBody):
+    """
+    Registra aceites em massa (ex.: todos os usuários num termo novo). Idempotente:
+    pares repetidos ou já gravados são ignorados pelo índice único (migração 0010).
+    """
+    pares = list(dict.fromkeys((c.usuario_id, c.termo_id) for c in data.consentimentos))
+    if not pares:
+        raise HTTPException(status_code=400, detail="Nenhum consentimento informado")
+    if len(pares) > CONSENTIMENTOS_MAX:
+        raise HTTPException(status_code=400, detail=f"Máximo de {CONSENTIMENTOS_MAX} consentimentos por chamada")
+
+    gravados = 0
+    with erro_interno("registrar consentimentos"):
+        async with request.app.state.pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                for i in range(0, len(pares), CONSENTIMENTOS_LOTE):
+                    lote = pares[i:i + CONSENTIMENTOS_LOTE]
+                    valores = ", ".join(["(%s, %s)"] * len(lote))
+                    await cur.execute(
+                        f"/* consentimentos_lote */ INSERT IGNORE INTO consentimentos (usuario_id, termo_id) VALUES {valores}",
+                        [v for par in lote for v in par],
+                    )
+                    gravados += cur.rowcount
+
+    await invalidar_perfil(*{usuario_id for usuario_id, _ in pares})
+    return {"recebidos": len(pares), "gravados": gravados}
+
+# --- Cache de Conversas ---
+# O par de usuários (sem ordem) identifica a conversa; o id nunca muda depois de criado.
+CONVERSA_CACHE_SIZE = int(os.getenv("CONVERSA_CACHE_SIZE", 10000))
+CONVERSA_CACHE_TTL = float(os.getenv("CONVERSA_CACHE_TTL", 3600))
+
+conversa_cache = TTLCache(maxsize=CONVERSA_CACHE_SIZE, ttl=CONVERSA_CACHE_TTL)
+conversa_em_voo = SingleFlight()
+
+def par_conversa(user_a: int, user_b: int) -> tuple:
+    return (user_a, user_b) if user_a < user_b else (user_b, user_a)
+
 async def get_or_create_conversation(pool, user_a: int, user_b: int):
+    chave = par_conversa(user_a, user_b)
+    id_conversa = conversa_cache.get(chave)
+    if id_conversa is not None:
+        return id_conversa
+
+    # Primeiras mensagens simultâneas do mesmo par, neste worker, compartilham a mesma ida ao banco;
+    # entre workers, quem impede a conversa duplicada é o índice único do par (migração 0012).
+    id_conversa = await conversa_em_voo.do(chave, partial(_get_or_create_conversation_db, pool, user_a, user_b))
+    conversa_cache.set(chave, id_conversa)
+    return id_conversa
+
+async def find_conversation(pool, user_a: int, user_b: int) -> Optional[int]:
+    """Como get_or_create_conversation, mas sem criar. Usado nas rotas de leitura."""
+    chave = par_conversa(user_a, user_b)
+    id_conversa = conversa_cache.get(chave)
+    if id_conversa is not None:
+        return id_conversa
+
+    result = await Repositorio(pool).um(CONVERSA_POR_PAR, chave)
+    if not result:
+        return None
+    conversa_cache.set(chave, result[0])
+    return result[0]
+
+async def _get_or_create_conversation_db(pool, user_a: int, user_b: int):
     """
     Verifica se já existe conversa entre A e B.
     Como não sabemos quem é terapeuta/paciente só pelos IDs aqui,
@@ -712,13 +2643,9 @@ async def get_or_create_conversation(pool, user_a: int, user_b: int):
     Para simplificar, vamos verificar se existe registro.
     """
     async with pool.acquire() as conn:
-        async with conn.cursor(aiomysql.DictCursor) as cur:
+        async with conn.cursor(DictCursorMedido) as cur:
             # Tenta encontrar a conversa independentemente da ordem
-            await cur.execute("""
-                SELECT id_conversa FROM conversa 
-                WHERE (id_usuario = %s AND id_terapeuta = %s) 
-                   OR (id_usuario = %s AND id_terapeuta = %s)
-            """, (user_a, user_b, user_b, user_a))
+            await cur.execute(CONVERSA_POR_PAR, par_conversa(user_a, user_b))
             result = await cur.fetchone()
             
             if result:
@@ -742,20 +2669,208 @@ async def get_or_create_conversation(pool, user_a: int, user_b: int):
                 id_t = terapeuta_res['id_usuario']
                 id_u = user_a if user_a != id_t else user_b
             
+            # Outro worker pode ter criado a conversa do par desde o SELECT: o índice único recusa a
+            # segunda linha e o LAST_INSERT_ID devolve o id da que já existe
             await cur.execute("""
                 INSERT INTO conversa (id_usuario, id_terapeuta) VALUES (%s, %s)
+                ON DUPLICATE KEY UPDATE id_conversa = LAST_INSERT_ID(id_conversa)
             """, (id_u, id_t))
             return cur.lastrowid
 
-async def salvar_mensagem(pool, id_conversa: int, id_remetente: int, conteudo: str):
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("""
-                INSERT INTO mensagem (id_conversa, id_remetente, conteudo) 
-                VALUES (%s, %s, %s)
-            """, (id_conversa, id_remetente, conteudo))
-            # Atualiza o timestamp da conversa para ela subir na lista
-            await cur.execute("UPDATE conversa SET atualizadoEm = NOW() WHERE id_conversa = %s", (id_conversa,))
+# --- Persistência de Mensagens (write-behind) ---
+# O socket só enfileira a gravação (sem esperar o banco) e entrega ao destinatário em seguida.
+# A cada MSG_FLUSH_MS ou MSG_FLUSH_MAX mensagens, um único INSERT multi-linha grava o lote
+# e atualizadoEm, prévia e não lidas de cada conversa são atualizados uma vez só por lote.
+MSG_FLUSH_MS = int(os.getenv("MSG_FLUSH_MS", 50))
+MSG_FLUSH_MAX = int(os.getenv("MSG_FLUSH_MAX", 200))
+MSG_QUEUE_MAX = int(os.getenv("MSG_QUEUE_MAX", 10000))
+PREVIA_TAMANHO = 160  # tamanho de conversa.ultima_mensagem (migração 0009)
+# mensagem.conteudo é TEXT (65535 bytes); o limite é checado antes de entregar e enfileirar
+MSG_CONTEUDO_MAX = min(int(os.getenv("MSG_CONTEUDO_MAX", 4000)), 65535 // 4)
+
+# Os ids do lote vêm de _gravar (lista explícita); o GROUP BY materializa a tabela derivada,
+# o que permite ler conversa dentro do UPDATE de conversa.
+# Mensagem de quem está no lado id_usuario fica não lida para o lado terapeuta, e vice-versa.
+CONVERSA_APOS_LOTE = f"""
+    /* conversa_apos_lote */
+    UPDATE conversa c
+    JOIN (
+        SELECT m.id_conversa, MAX(m.id_mensagem) AS id_ultima,
+               SUM(m.id_remetente = cv.id_usuario) AS do_usuario,
+               SUM(m.id_remetente <> cv.id_usuario) AS do_terapeuta
+        FROM mensagem m
+        JOIN conversa cv ON cv.id_conversa = m.id_conversa
+        WHERE m.id_mensagem IN ({{ids}})
+        GROUP BY m.id_conversa
+    ) lote ON lote.id_conversa = c.id_conversa
+    JOIN mensagem ultima ON ultima.id_mensagem = lote.id_ultima
+    SET c.atualizadoEm = NOW(),
+        c.ultima_mensagem = LEFT(ultima.conteudo, {PREVIA_TAMANHO}),
+        c.id_ultima_mensagem = ultima.id_mensagem,
+        c.id_ultimo_remetente = ultima.id_remetente,
+        c.nao_lidas_terapeuta = c.nao_lidas_terapeuta + lote.do_usuario,
+        c.nao_lidas_usuario = c.nao_lidas_usuario + lote.do_terapeuta
+"""
+
+class EscritorMensagens(EscritorEmLote):
+    def __init__(self):
+        super().__init__("mensagens", MSG_FLUSH_MS, MSG_FLUSH_MAX, MSG_QUEUE_MAX)
+        self._incremento = None  # @@auto_increment_increment, lido no primeiro lote
+
+    async def salvar(self, id_conversa: int, id_remetente: int, conteudo: str) -> asyncio.Future:
+        """Enfileira a mensagem. O future resolve com o id_mensagem quando o lote for gravado."""
+        fut = asyncio.get_running_loop().create_future()
+        await self._enfileirar((id_conversa, id_remetente, conteudo, fut))
+        return fut
+
+    async def _gravar(self, lote: list):
+        valores = ", ".join(["(%s, %s, %s)"] * len(lote))
+        params = [v for (id_conversa, id_remetente, conteudo, _) in lote for v in (id_conversa, id_remetente, conteudo)]
+
+        async with self.pool.acquire() as conn:
+            await conn.begin()
+            try:
+                async with conn.cursor() as cur:
+                    await cur.execute(
+                        f"INSERT INTO mensagem (id_conversa, id_remetente, conteudo) VALUES {valores}", params
+                    )
+                    primeiro_id = cur.lastrowid
+                    # O InnoDB reserva os ids de um INSERT com número de linhas conhecido de uma vez,
+                    # mas espaçados por auto_increment_increment (1 por padrão, >1 em replicação multi-primário)
+                    if self._incremento is None:
+                        await cur.execute("SELECT @@auto_increment_increment")
+                        self._incremento = int((await cur.fetchone())[0])
+                    ids = [primeiro_id + i * self._incremento for i in range(len(lote))]
+                    # Sobe as conversas na lista e atualiza prévia e não lidas a partir das linhas recém-gravadas
+                    await cur.execute(
+                        CONVERSA_APOS_LOTE.format(ids=", ".join(["%s"] * len(ids))), ids
+                    )
+                await conn.commit()
+            except Exception:
+                await conn.rollback()
+                raise
+
+        for id_mensagem, (_, _, _, fut) in zip(ids, lote):
+            if not fut.done():
+                fut.set_result(id_mensagem)
+
+    def _falhou(self, lote: list, erro: Exception):
+        for (_, _, _, fut) in lote:
+            if not fut.done():
+                fut.set_exception(erro)
+                fut.exception()
+
+message_writer = EscritorMensagens()
+
+async def salvar_mensagem(id_conversa: int, id_remetente: int, conteudo: str) -> asyncio.Future:
+    return await message_writer.salvar(id_conversa, id_remetente, conteudo)
+
+# --- Confirmações de Leitura ---
+# Evento {"type": "read", "target_id": ..., "id_mensagem": ...} do socket (sem id_mensagem: até a última).
+# Também em lote: vários "read" da mesma conversa no intervalo viram um UPDATE só.
+# As não lidas do leitor são recontadas pelo índice (id_conversa, id_mensagem), só no evento de leitura.
+# No SET do MySQL cada atribuição já enxerga as anteriores: a recontagem usa a posição nova.
+LEITURA_QUERY = """
+    /* conversa_leitura */
+    UPDATE conversa c SET
+        -- atualizadoEm é ON UPDATE CURRENT_TIMESTAMP: ler não pode reordenar /chat/conversas
+        c.atualizadoEm = c.atualizadoEm,
+        c.lida_usuario_ate = IF(c.id_usuario = %(leitor)s,
+            GREATEST(c.lida_usuario_ate, COALESCE(%(ate)s, c.id_ultima_mensagem, 0)), c.lida_usuario_ate),
+        c.lida_terapeuta_ate = IF(c.id_usuario <> %(leitor)s,
+            GREATEST(c.lida_terapeuta_ate, COALESCE(%(ate)s, c.id_ultima_mensagem, 0)), c.lida_terapeuta_ate),
+        c.nao_lidas_usuario = IF(c.id_usuario = %(leitor)s, (
+            SELECT COUNT(*) FROM mensagem m
+            WHERE m.id_conversa = c.id_conversa AND m.id_mensagem > c.lida_usuario_ate AND m.id_remetente <> %(leitor)s
+        ), c.nao_lidas_usuario),
+        c.nao_lidas_terapeuta = IF(c.id_usuario <> %(leitor)s, (
+            SELECT COUNT(*) FROM mensagem m
+            WHERE m.id_conversa = c.id_conversa AND m.id_mensagem > c.lida_terapeuta_ate AND m.id_remetente <> %(leitor)s
+        ), c.nao_lidas_terapeuta)
+    WHERE c.id_conversa = %(conversa)s
+"""
+
+class EscritorLeituras(EscritorEmLote):
+    def __init__(self):
+        super().__init__("leituras", MSG_FLUSH_MS, MSG_FLUSH_MAX, MSG_QUEUE_MAX)
+
+    async def marcar(self, id_conversa: int, id_leitor: int, ate: Optional[int] = None):
+        await self._enfileirar((id_conversa, id_leitor, ate))
+
+    async def _gravar(self, lote: list):
+        # (conversa, leitor) -> maior posição lida; None (até a última) vence qualquer id
+        posicoes: Dict[tuple, Optional[int]] = {}
+        for id_conversa, id_leitor, ate in lote:
+            chave = (id_conversa, id_leitor)
+            if chave in posicoes and (posicoes[chave] is None or (ate is not None and ate <= posicoes[chave])):
+                continue
+            posicoes[chave] = ate
+
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                for (id_conversa, id_leitor), ate in posicoes.items():
+                    await cur.execute(LEITURA_QUERY, {"conversa": id_conversa, "leitor": id_leitor, "ate": ate})
+
+read_writer = EscritorLeituras()
+
+# --- Reenvio na Reconexão e Confirmações ---
+# O socket conecta com ?last_seen=<maior id_mensagem que o cliente já tem> e recebe só o que perdeu,
+# buscado em lotes de WS_REPLAY_LOTE, no mesmo formato das mensagens ao vivo, seguido de um frame
+# {"type": "sync"} com o último id e quantas foram reenviadas (o cliente confere se perdeu alguma).
+# Passando de WS_REPLAY_MAX, "completo" vem falso e o cliente recorre ao histórico.
+# Cada mensagem gravada gera um {"type": "ack", "ref", "id_mensagem"} para remetente e destinatário,
+# que assim avançam o last_seen sem baixar nada de novo.
+WS_REPLAY_LOTE = int(os.getenv("WS_REPLAY_LOTE", 200))
+WS_REPLAY_MAX = int(os.getenv("WS_REPLAY_MAX", 2000))
+WS_REPLAY_TIMEOUT = float(os.getenv("WS_REPLAY_TIMEOUT", 10))
+
+async def reenviar_perdidas(conexao: ClientConnection, id_usuario: int, last_seen: int):
+    try:
+        await _reenviar_perdidas(conexao, id_usuario, last_seen)
+    except Exception as e:
+        print(f"Erro ao reenviar mensagens para usuário {id_usuario}: {e}")
+
+async def _reenviar_perdidas(conexao: ClientConnection, id_usuario: int, last_seen: int):
+    repo = Repositorio(app.state.pool_chat)
+    ids = [id_conversa for (id_conversa,) in await repo.todos(CONVERSAS_IDS_DO_USUARIO, (id_usuario, id_usuario))]
+    ultimo, enviadas, completo = last_seen, 0, True
+    if ids:
+        query = MENSAGENS_PERDIDAS.format(marcadores=", ".join(["%s"] * len(ids)))
+        while True:
+            lote = await repo.todos(query, (*ids, ultimo, WS_REPLAY_LOTE), MensagemPerdida)
+            for m in lote:
+                entregue = await conexao.enqueue_wait({
+                    "type": "message",
+                    "from_id": m.id_remetente,
+                    "message": m.conteudo,
+                    "timestamp": m.enviadoEm,
+                    "id_mensagem": m.id_mensagem,
+                    "id_conversa": m.id_conversa,
+                }, WS_REPLAY_TIMEOUT)
+                if not entregue:
+                    return
+                ultimo = m.id_mensagem
+                enviadas += 1
+            if len(lote) < WS_REPLAY_LOTE:
+                break
+            if enviadas >= WS_REPLAY_MAX:
+                completo = False
+                break
+    await conexao.enqueue_wait(
+        {"type": "sync", "ultimo_id": ultimo, "enviadas": enviadas, "completo": completo}, WS_REPLAY_TIMEOUT
+    )
+
+async def confirmar_gravacao(gravacao: asyncio.Future, ref: str, id_conversa: int, id_remetente: int, id_destinatario: int):
+    try:
+        id_mensagem = await gravacao
+    except Exception:
+        # O destinatário já recebeu a mensagem ao vivo; só o remetente precisa saber da falha
+        await manager.send_personal_message({"type": "falha", "ref": ref}, id_remetente)
+        return
+    ack = {"type": "ack", "ref": ref, "id_mensagem": id_mensagem, "id_conversa": id_conversa}
+    await manager.send_personal_message(ack, id_remetente)
+    if id_destinatario != id_remetente:
+        await manager.send_personal_message(ack, id_destinatario)
 
 # =====================================================
 # ROTAS DE CHAT E WEBSOCKET
@@ -763,97 +2878,979 @@ async def salvar_mensagem(pool, id_conversa: int, id_remetente: int, conteudo: s
 
 @app.post("/chat/criar/{user_a}/{user_b}")
 async def criar_conversa(user_a: int, user_b: int):
-    pool = app.state.pool
+    pool = app.state.pool_chat
     id_conversa = await get_or_create_conversation(pool, user_a, user_b)
     return {"id_conversa": id_conversa}
 
 @app.websocket("/ws/{id_usuario}")
-async def websocket_endpoint(websocket: WebSocket, id_usuario: int):
-    await manager.connect(websocket, id_usuario)
+async def websocket_endpoint(websocket: WebSocket, id_usuario: int, last_seen: Optional[int] = None):
+    conexao = await manager.connect(websocket, id_usuario)
+    if conexao is None:
+        return
+    # id_conversa por interlocutor, resolvido uma vez por socket
+    conversas: Dict[int, int] = {}
+    # O reenvio roda em paralelo: o usuário já pode enviar enquanto recebe o que perdeu
+    reenvio = asyncio.create_task(reenviar_perdidas(conexao, id_usuario, last_seen)) if last_seen is not None else None
     try:
         while True:
-            # Espera receber um JSON do frontend: {"target_id": 123, "message": "Olá"}
-            data = await websocket.receive_json()
-            target_id = int(data.get("target_id"))
+            # Espera receber um JSON do frontend: {"target_id": 123, "message": "Olá", "ref": "..."}
+            data = loads_json(await websocket.receive_text())
+            conexao.tocar()
+            tipo = data.get("type")
+            if tipo == "pong":
+                continue
+            if tipo == "ping":
+                conexao.enqueue({"type": "pong"})
+                continue
+            if tipo == "presenca":
+                presenca.marcar_ausente(conexao, data.get("estado") == "ausente")
+                continue
+            try:
+                target_id = int(data.get("target_id"))
+            except (TypeError, ValueError):
+                continue
+
+            if tipo == "read":
+                # Confirmação de leitura: não cria conversa. id_mensagem vai para o UPDATE em lote de
+                # todos os leitores: só None ou inteiro positivo, senão um valor ruim derruba o lote inteiro
+                ate = data.get("id_mensagem")
+                if ate is not None and (type(ate) is not int or ate <= 0):
+                    continue
+                id_conversa = conversas.get(target_id) or await find_conversation(app.state.pool_chat, id_usuario, target_id)
+                if id_conversa:
+                    try:
+                        await read_writer.marcar(id_conversa, id_usuario, ate)
+                    except EscritorParado:
+                        pass  # desligando: o cliente marca de novo ao reabrir a conversa
+                continue
             conteudo = data.get("message")
             
             if not target_id or not conteudo:
                 continue
+            if not isinstance(conteudo, str) or len(conteudo) > MSG_CONTEUDO_MAX:
+                # Não entrega nem grava: avisa só quem enviou
+                conexao.enqueue({"type": "falha", "ref": data.get("ref"), "detail": "Mensagem inválida ou longa demais"})
+                continue
+            if not manager.aceitando:
+                # Desligando: o escritor pode já ter parado; o cliente reenvia após reconectar
+                conexao.enqueue({"type": "falha", "ref": data.get("ref")})
+                continue
 
-            # 1. Obter ou criar a conversa no banco
-            pool = app.state.pool
-            id_conversa = await get_or_create_conversation(pool, id_usuario, target_id)
-            
-            # 2. Salvar no banco
-            await salvar_mensagem(pool, id_conversa, id_usuario, conteudo)
+            # 1. Obter ou criar a conversa (cache local do socket -> cache do processo -> banco)
+            pool = app.state.pool_chat
+            id_conversa = conversas.get(target_id)
+            if id_conversa is None:
+                id_conversa = await get_or_create_conversation(pool, id_usuario, target_id)
+                conversas[target_id] = id_conversa
+                # Conversa possivelmente nova: cada lado passa a acompanhar a presença do outro
+                presenca.observar(id_usuario, target_id)
+                presenca.observar(target_id, id_usuario)
             
-            # 3. Preparar payload de envio
+            # 2. Preparar payload de envio; `ref` liga a mensagem ao vivo ao ack com o id gravado
+            ref = str(data.get("ref") or uuid.uuid4().hex)
             payload = {
+                "type": "message",
                 "from_id": id_usuario,
                 "message": conteudo,
-                "timestamp": str(datetime.now())
+                "timestamp": datetime.now(),
+                "ref": ref,
             }
             
-            # 4. Enviar para o destinatário (se online)
+            # 3. Enfileirar a gravação (write-behind, em lote) antes de entregar: com o escritor
+            # parando, a mensagem é recusada sem ter chegado ao destinatário
+            try:
+                gravacao = await salvar_mensagem(id_conversa, id_usuario, conteudo)
+            except EscritorParado:
+                conexao.enqueue({"type": "falha", "ref": ref})
+                continue
+
+            # 4. Enviar para o destinatário (se online) sem esperar o banco
             await manager.send_personal_message(payload, target_id)
-            
-            # 5. (Opcional) Confirmar envio para o remetente (ack)
-            # await manager.send_personal_message({"status": "sent", "to": target_id}, id_usuario)
+
+            # 5. Confirmar (ack) para os dois lados quando o lote for gravado
+            tarefa_em_fundo(confirmar_gravacao(gravacao, ref, id_conversa, id_usuario, target_id))
 
     except WebSocketDisconnect:
-        manager.disconnect(id_usuario)
+        pass
     except Exception as e:
         print(f"Erro no socket: {e}")
-        manager.disconnect(id_usuario)
+    finally:
+        if reenvio:
+            reenvio.cancel()
+        await manager.disconnect(conexao)
 
 @app.get("/chat/conversas/{id_usuario}")
 async def listar_conversas(id_usuario: int):
     """Lista todas as conversas que o usuário possui."""
-    pool = app.state.pool
-    async with pool.acquire() as conn:
-        async with conn.cursor(aiomysql.DictCursor) as cur:
-            # Busca conversas onde o usuário é paciente ou terapeuta
-            # Faz join com usuario para pegar o nome da outra parte
-            await cur.execute("""
-                SELECT 
-                    c.id_conversa,
-                    CASE 
-                        WHEN c.id_usuario = %s THEN c.id_terapeuta
-                        ELSE c.id_usuario 
-                    END as outro_usuario_id,
-                    u.nome as outro_usuario_nome,
-                    c.atualizadoEm
-                FROM conversa c
-                JOIN usuario u ON u.id_usuario = (CASE WHEN c.id_usuario = %s THEN c.id_terapeuta ELSE c.id_usuario END)
-                WHERE c.id_usuario = %s OR c.id_terapeuta = %s
-                ORDER BY c.atualizadoEm DESC
-            """, (id_usuario, id_usuario, id_usuario, id_usuario))
-            conversas = await cur.fetchall()
-            return conversas
+    # Busca conversas onde o usuário é paciente ou terapeuta
+    # Faz join com usuario para pegar o nome da outra parte
+    return RespostaJSON(await app.state.repo.todos(
+        CONVERSAS_DO_USUARIO, (id_usuario,) * 5, ConversaResumo
+    ))
+
+HISTORICO_LIMIT_PADRAO = 50
+HISTORICO_LIMIT_MAX = 200
 
 @app.get("/chat/historico/{id_usuario}/{id_outro_usuario}")
-async def pegar_historico(id_usuario: int, id_outro_usuario: int):
-    """Pega o histórico de mensagens entre duas pessoas."""
+async def pegar_historico(
+    id_usuario: int,
+    id_outro_usuario: int,
+    before: Optional[int] = None,
+    after: Optional[int] = None,
+    limit: int = Query(HISTORICO_LIMIT_PADRAO, ge=1, le=HISTORICO_LIMIT_MAX)
+):
+    """
+    Pega uma página do histórico de mensagens entre duas pessoas, em ordem cronológica.
+    Sem cursor: as `limit` mensagens mais recentes. `before`/`after`: id_mensagem de referência.
+    O cabeçalho X-Has-More indica se existem mais mensagens na direção paginada.
+    """
+    if before is not None and after is not None:
+        raise HTTPException(status_code=400, detail="Use apenas 'before' ou 'after'")
+
     pool = app.state.pool
     
-    # 1. Achar ID da conversa
-    id_conversa = await get_or_create_conversation(pool, id_usuario, id_outro_usuario)
-    
-    # 2. Buscar mensagens
+    # 1. Achar ID da conversa (leitura não cria conversa)
+    id_conversa = await find_conversation(pool, id_usuario, id_outro_usuario)
+    if id_conversa is None:
+        return RespostaJSON([], headers={"X-Has-More": "0"})
+
+    # 2. Buscar uma página pelo índice (id_conversa, id_mensagem); busca limit + 1 para saber se há mais
+    campos = HISTORICO_CAMPOS
+    if after is not None:
+        query = campos + " AND id_mensagem > %s ORDER BY id_mensagem ASC LIMIT %s"
+        params = (id_conversa, after, limit + 1)
+    elif before is not None:
+        query = campos + " AND id_mensagem < %s ORDER BY id_mensagem DESC LIMIT %s"
+        params = (id_conversa, before, limit + 1)
+    else:
+        query = campos + " ORDER BY id_mensagem DESC LIMIT %s"
+        params = (id_conversa, limit + 1)
+
+    mensagens = await app.state.repo.todos(query, params, MensagemChat)
+
+    mais = len(mensagens) > limit
+    mensagens = mensagens[:limit]
+    if after is None:
+        mensagens.reverse()
+    return RespostaJSON(mensagens, headers={"X-Has-More": "1" if mais else "0"})
+
+# --- Presença ---
+# Estado de cada usuário derivado dos sockets do ConnectionManager: "online" (algum socket
+# ativo), "ausente" (todos marcados ausentes pelo cliente) ou "offline" (nenhum socket).
+# Cada worker publica o estado dos seus usuários no canal "presenca"; todos guardam o mapa
+# worker -> {usuário: estado} e o estado global é o melhor entre os workers.
+# Subir de estado é publicado na hora; descer espera PRESENCA_DEBOUNCE (celular que cai e
+# reconecta não pisca offline). Snapshots periódicos recuperam workers novos e expiram os que morreram.
+# Deltas só vão aos sockets locais de quem observa a pessoa (parceiros de conversa e favoritos),
+# a partir de uma lista carregada uma vez por conexão: nenhum acesso ao banco por evento.
+PRESENCA_DEBOUNCE = float(os.getenv("PRESENCA_DEBOUNCE", 5))
+PRESENCA_SNAPSHOT_S = float(os.getenv("PRESENCA_SNAPSHOT_S", 30))
+PRESENCA_IDS_MAX = 200
+CANAL_PRESENCA = "presenca"
+NIVEL_PRESENCA = {"offline": 0, "ausente": 1, "online": 2}
+
+class Presenca:
+    def __init__(self):
+        self.worker = ""
+        self.por_worker: Dict[str, Dict[int, str]] = {}
+        self.visto_em: Dict[str, float] = {}
+        self.publicado: Dict[int, str] = {}  # estado já anunciado para cada usuário deste worker
+        self.rebaixar: Dict[int, asyncio.TimerHandle] = {}
+        self.observadores: Dict[int, Set[int]] = {}  # observado -> observadores locais
+        self.observando: Dict[int, Set[int]] = {}  # observador local -> observados
+        self.tarefa: Optional[asyncio.Task] = None
+        self.ativo = False
+
+    async def start(self):
+        # O id nasce aqui, e não no import: com --preload os workers herdariam o mesmo
+        self.worker = f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.ativo = True
+        self.tarefa = asyncio.create_task(self._snapshots())
+        await manager.broadcast(CANAL_PRESENCA, {"worker": self.worker, "evento": "pedir_snapshot"})
+
+    async def stop(self):
+        """Para de publicar; os outros workers removem este após o debounce (os clientes reconectam)."""
+        self.ativo = False
+        if self.tarefa:
+            self.tarefa.cancel()
+            self.tarefa = None
+        for timer in self.rebaixar.values():
+            timer.cancel()
+        self.rebaixar.clear()
+        await manager.broadcast(CANAL_PRESENCA, {"worker": self.worker, "evento": "saindo"})
+
+    # Estado
+
+    def estado(self, id_usuario: int) -> str:
+        melhor = "offline"
+        for estados in self.por_worker.values():
+            e = estados.get(id_usuario, "offline")
+            if NIVEL_PRESENCA[e] > NIVEL_PRESENCA[melhor]:
+                melhor = e
+        return melhor
+
+    def estados(self, ids) -> Dict[int, str]:
+        return {i: self.estado(i) for i in ids}
+
+    def conectados(self) -> Set[int]:
+        """Usuários com socket aberto (online ou ausente) em algum worker."""
+        return {u for estados in self.por_worker.values() for u in estados}
+
+    def contagem(self) -> Dict[str, int]:
+        usuarios = self.conectados()
+        contagem = {"online": 0, "ausente": 0}
+        for u in usuarios:
+            contagem[self.estado(u)] += 1
+        return contagem
+
+    def _estado_local(self, id_usuario: int) -> str:
+        conexoes = manager.active_connections.get(id_usuario)
+        if not conexoes:
+            return "offline"
+        return "ausente" if all(c.ausente for c in conexoes) else "online"
+
+    def _reavaliar(self, id_usuario: int):
+        if not self.ativo:
+            return
+        novo = self._estado_local(id_usuario)
+        anterior = self.publicado.get(id_usuario, "offline")
+        if novo == anterior:
+            timer = self.rebaixar.pop(id_usuario, None)
+            if timer:
+                timer.cancel()
+            return
+        if NIVEL_PRESENCA[novo] > NIVEL_PRESENCA[anterior]:
+            timer = self.rebaixar.pop(id_usuario, None)
+            if timer:
+                timer.cancel()
+            self._publicar(id_usuario, novo)
+        elif id_usuario not in self.rebaixar:
+            self.rebaixar[id_usuario] = asyncio.get_running_loop().call_later(
+                PRESENCA_DEBOUNCE, self._rebaixar_agora, id_usuario
+            )
+
+    def _rebaixar_agora(self, id_usuario: int):
+        self.rebaixar.pop(id_usuario, None)
+        novo = self._estado_local(id_usuario)
+        if self.ativo and novo != self.publicado.get(id_usuario, "offline"):
+            self._publicar(id_usuario, novo)
+
+    def _publicar(self, id_usuario: int, estado: str):
+        if estado == "offline":
+            self.publicado.pop(id_usuario, None)
+        else:
+            self.publicado[id_usuario] = estado
+        tarefa_em_fundo(manager.broadcast(
+            CANAL_PRESENCA, {"worker": self.worker, "id_usuario": id_usuario, "estado": estado}
+        ))
+
+    # Barramento
+
+    async def _on_canal(self, message: dict):
+        worker = message["worker"]
+        evento = message.get("evento")
+        if evento == "pedir_snapshot":
+            if worker != self.worker and self.ativo:
+                await self._enviar_snapshot()
+            return
+        if evento == "saindo":
+            if worker != self.worker:
+                asyncio.get_running_loop().call_later(PRESENCA_DEBOUNCE, self._remover_worker, worker)
+            return
+
+        self.visto_em[worker] = time.monotonic()
+        if "snapshot" in message:
+            novos = {int(u): e for u, e in message["snapshot"].items()}
+            antigos = self.por_worker.get(worker, {})
+            afetados = set(novos) | set(antigos)
+            antes = self.estados(afetados)
+            self.por_worker[worker] = novos
+        else:
+            id_usuario = message["id_usuario"]
+            afetados = {id_usuario}
+            antes = self.estados(afetados)
+            estados = self.por_worker.setdefault(worker, {})
+            if message["estado"] == "offline":
+                estados.pop(id_usuario, None)
+            else:
+                estados[id_usuario] = message["estado"]
+        self._notificar_mudancas(antes)
+
+    def _remover_worker(self, worker: str):
+        antigos = self.por_worker.get(worker)
+        if antigos is None:
+            return
+        antes = self.estados(antigos)
+        del self.por_worker[worker]
+        self.visto_em.pop(worker, None)
+        self._notificar_mudancas(antes)
+
+    def _notificar_mudancas(self, antes: Dict[int, str]):
+        for id_usuario, estado_antes in antes.items():
+            depois = self.estado(id_usuario)
+            if depois == estado_antes:
+                continue
+            frame = {"type": "presenca", "id_usuario": id_usuario, "estado": depois}
+            for observador in self.observadores.get(id_usuario, ()):
+                manager.deliver_local(frame, observador)
+
+    async def _enviar_snapshot(self):
+        await manager.broadcast(CANAL_PRESENCA, {"worker": self.worker, "snapshot": dict(self.publicado)})
+
+    async def _snapshots(self):
+        while True:
+            await asyncio.sleep(PRESENCA_SNAPSHOT_S)
+            try:
+                await self._enviar_snapshot()
+            except Exception as e:
+                print(f"Erro ao publicar snapshot de presença: {e}")
+            # Worker que parou de mandar snapshot (caiu sem avisar) sai do mapa
+            limite = time.monotonic() - 3 * PRESENCA_SNAPSHOT_S
+            for worker, visto in list(self.visto_em.items()):
+                if worker != self.worker and visto < limite:
+                    self._remover_worker(worker)
+
+    # Observadores
+
+    def _ao_conectar(self, conexao: ClientConnection):
+        self._reavaliar(conexao.user_id)
+        if conexao.user_id in self.observando:
+            # Mais um dispositivo do mesmo usuário: a lista já está carregada
+            conexao.enqueue(self._frame_inicial(conexao.user_id))
+        else:
+            tarefa_em_fundo(self._carregar_observados(conexao.user_id))
+
+    def _ao_desconectar(self, conexao: ClientConnection):
+        self._reavaliar(conexao.user_id)
+        if conexao.user_id not in manager.active_connections:
+            for observado in self.observando.pop(conexao.user_id, ()):
+                observadores = self.observadores.get(observado)
+                if observadores is not None:
+                    observadores.discard(conexao.user_id)
+                    if not observadores:
+                        del self.observadores[observado]
+
+    def marcar_ausente(self, conexao: ClientConnection, ausente: bool):
+        conexao.ausente = ausente
+        self._reavaliar(conexao.user_id)
+
+    def observar(self, observador: int, observado: int):
+        """Inclui `observado` na lista de quem tem socket neste worker (ex.: conversa nova)."""
+        observados = self.observando.get(observador)
+        if observados is None or observado in observados:
+            return
+        observados.add(observado)
+        self.observadores.setdefault(observado, set()).add(observador)
+        manager.deliver_local({"type": "presenca", "id_usuario": observado, "estado": self.estado(observado)}, observador)
+
+    def recarregar_observados(self, id_usuario: int):
+        if id_usuario in self.observando:
+            tarefa_em_fundo(self._carregar_observados(id_usuario))
+
+    async def _carregar_observados(self, id_usuario: int):
+        try:
+            repo = app.state.repo
+            parceiros = await repo.todos(PARCEIROS_DE_CONVERSA, (id_usuario, id_usuario))
+            favoritos = await favoritos_do_usuario(repo, id_usuario)
+        except Exception as e:
+            print(f"Erro ao carregar observados de presença do usuário {id_usuario}: {e}")
+            return
+        if id_usuario not in manager.active_connections:
+            return  # desconectou enquanto carregava
+
+        for observado in self.observando.get(id_usuario, ()):
+            self.observadores.get(observado, set()).discard(id_usuario)
+        observados = {p for (p,) in parceiros} | set(favoritos)
+        observados.discard(id_usuario)
+        self.observando[id_usuario] = observados
+        for observado in observados:
+            self.observadores.setdefault(observado, set()).add(id_usuario)
+        manager.deliver_local(self._frame_inicial(id_usuario), id_usuario)
+
+    def _frame_inicial(self, id_usuario: int) -> dict:
+        # Só quem não está offline: o cliente assume offline para o resto
+        estados = self.estados(self.observando.get(id_usuario, ()))
+        return {"type": "presenca", "estados": {u: e for u, e in estados.items() if e != "offline"}}
+
+presenca = Presenca()
+manager.assinar_canal(CANAL_PRESENCA, presenca._on_canal)
+manager.ganchos_conexao.append(presenca._ao_conectar)
+manager.ganchos_desconexao.append(presenca._ao_desconectar)
+
+@app.get("/presenca")
+async def consultar_presenca(ids: str = Query(..., description="ids separados por vírgula")):
+    """Estado de vários usuários numa chamada só (listas de terapeutas e de conversas). Sem banco."""
+    try:
+        lista = list(dict.fromkeys(int(i) for i in ids.split(",") if i.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids deve ser uma lista de inteiros separados por vírgula")
+    if len(lista) > PRESENCA_IDS_MAX:
+        raise HTTPException(status_code=400, detail=f"Máximo de {PRESENCA_IDS_MAX} ids por chamada")
+    return RespostaJSON(presenca.estados(lista))
+
+# =====================================================
+# CHAMADOS DE PÂNICO
+# =====================================================
+
+# --- Despacho de Chamados ---
+# O chamado é gravado e enviado na hora, pelos sockets já abertos, a todos os terapeutas
+# de plantão: quem é terapeuta e tem socket aberto em algum worker (serviço de presença).
+# Cada worker mantém uma fila de prioridade dos chamados
+# abertos, sincronizada pelo canal "panico" do barramento, para reenviar a quem conectar depois.
+# O primeiro terapeuta a atender vence: o UPDATE condicional no banco é o árbitro entre workers.
+PANICO_PLANTAO_TTL = float(os.getenv("PANICO_PLANTAO_TTL", 30))
+CANAL_PANICO = "panico"
+
+panico_latencia = metricas.histograma(
+    "panico_entrega_seconds", "Tempo entre a abertura do chamado e a primeira entrega a um terapeuta", "etapa"
+)
+
+class DespachoPanico:
+    def __init__(self):
+        self.heap: List[tuple] = []  # (prioridade, criado_em, id_chamado)
+        self.abertos: Dict[int, dict] = {}
+        self.atendendo: Set[int] = set()
+        self.sem_entrega: Set[int] = set()
+        self.terapeutas_cache = TTLCache(maxsize=1, ttl=PANICO_PLANTAO_TTL)
+
+    async def carregar(self, pool):
+        """Reconstrói a fila a partir dos chamados ainda abertos no banco (ex.: após um restart)."""
+        async with pool.acquire() as conn:
+            async with conn.cursor(DictCursorMedido) as cur:
+                await cur.execute("""
+                    SELECT c.id_chamado, c.id_usuario, u.nome, c.prioridade, UNIX_TIMESTAMP(c.data_hora) AS criado_em
+                    FROM chamado_panico c
+                    JOIN usuario u ON u.id_usuario = c.id_usuario
+                    WHERE c.status = 'aberto'
+                """)
+                for row in await cur.fetchall():
+                    self._adicionar({
+                        "type": "panico",
+                        "id_chamado": row["id_chamado"],
+                        "id_usuario": row["id_usuario"],
+                        "nome": row["nome"],
+                        "prioridade": row["prioridade"],
+                        "criado_em": float(row["criado_em"]),
+                    })
+
+    async def terapeutas(self, pool) -> Set[int]:
+        ids = self.terapeutas_cache.get("terapeutas")
+        if ids is None:
+            async with pool.acquire() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute("SELECT id_usuario FROM terapeuta")
+                    ids = {row[0] for row in await cur.fetchall()}
+            self.terapeutas_cache.set("terapeutas", ids)
+        return ids
+
+    async def terapeutas_plantao(self, pool) -> Set[int]:
+        """Terapeutas conectados agora (em qualquer worker): são os que recebem o chamado pelo socket."""
+        return await self.terapeutas(pool) & presenca.conectados()
+
+    def _adicionar(self, chamado: dict):
+        if chamado["id_chamado"] in self.abertos:
+            return
+        self.abertos[chamado["id_chamado"]] = chamado
+        heapq.heappush(self.heap, (chamado["prioridade"], chamado["criado_em"], chamado["id_chamado"]))
+
+    def _remover(self, id_chamado: int):
+        # Remoção preguiçosa: a entrada sai do heap quando chegar ao topo
+        self.abertos.pop(id_chamado, None)
+        self.sem_entrega.discard(id_chamado)
+        while self.heap and self.heap[0][2] not in self.abertos:
+            heapq.heappop(self.heap)
+
+    def listar_abertos(self) -> List[dict]:
+        return [self.abertos[i] for (_, _, i) in sorted(self.heap) if i in self.abertos]
+
+    async def abrir(self, pool, id_usuario: int, prioridade: int) -> dict:
+        criado_em = time.time()
+
+        async def gravar() -> int:
+            async with pool.acquire() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute(
+                        "INSERT INTO chamado_panico (id_usuario, prioridade) VALUES (%s, %s)", (id_usuario, prioridade)
+                    )
+                    return cur.lastrowid
+
+        # Nome e plantão saem em paralelo com o INSERT: o envio não espera uma ida a mais ao banco
+        id_chamado, perfil, plantao = await asyncio.gather(
+            gravar(), carregar_perfil(pool, id_usuario=id_usuario), self.terapeutas_plantao(pool)
+        )
+        chamado = {
+            "type": "panico",
+            "id_chamado": id_chamado,
+            "id_usuario": id_usuario,
+            "nome": perfil[0]["nome"] if perfil else None,
+            "prioridade": prioridade,
+            "criado_em": criado_em,
+        }
+        self._adicionar(chamado)
+        self.sem_entrega.add(id_chamado)
+
+        await asyncio.gather(*(manager.send_personal_message(chamado, t) for t in plantao if t != id_usuario))
+        await manager.broadcast(CANAL_PANICO, {"evento": "aberto", "chamado": chamado})
+        return {"id_chamado": id_chamado, "terapeutas_notificados": len(plantao)}
+
+    async def atender(self, pool, id_chamado: int, id_terapeuta: int) -> bool:
+        # Corrida local: quem chegar depois no mesmo worker nem vai ao banco
+        if id_chamado in self.atendendo:
+            return False
+        self.atendendo.add(id_chamado)
+        try:
+            async with pool.acquire() as conn:
+                async with conn.cursor() as cur:
+                    # Grava quem venceu na mesma troca de status; só terapeuta pode atender
+                    await cur.execute("""
+                        UPDATE chamado_panico SET status = 'atendido', id_terapeuta = %s
+                        WHERE id_chamado = %s AND status = 'aberto'
+                          AND EXISTS (SELECT 1 FROM terapeuta t WHERE t.id_usuario = %s)
+                    """, (id_terapeuta, id_chamado, id_terapeuta))
+                    venceu = cur.rowcount == 1
+        finally:
+            self.atendendo.discard(id_chamado)
+
+        if venceu:
+            chamado = self.abertos.get(id_chamado)
+            self._remover(id_chamado)
+            aviso = {"type": "panico_atendido", "id_chamado": id_chamado, "id_terapeuta": id_terapeuta}
+            await manager.broadcast(CANAL_PANICO, {"evento": "atendido", "id_chamado": id_chamado})
+            plantao = await self.terapeutas_plantao(pool)
+            destinos = set(plantao)
+            if chamado:
+                destinos.add(chamado["id_usuario"])
+            await asyncio.gather(*(manager.send_personal_message(aviso, d) for d in destinos))
+        return venceu
+
+    async def encerrar(self, pool, id_chamado: int) -> bool:
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "UPDATE chamado_panico SET status = 'encerrado' WHERE id_chamado = %s AND status <> 'encerrado'",
+                    (id_chamado,)
+                )
+                alterou = cur.rowcount == 1
+        self._remover(id_chamado)
+        await manager.broadcast(CANAL_PANICO, {"evento": "encerrado", "id_chamado": id_chamado})
+        return alterou
+
+    async def _on_canal(self, message: dict):
+        # Mantém a fila deste worker igual à dos outros
+        if message.get("evento") == "aberto":
+            chamado = message["chamado"]
+            if chamado["id_chamado"] not in self.abertos:
+                self._adicionar(chamado)
+                self.sem_entrega.add(chamado["id_chamado"])
+        else:
+            self._remover(message["id_chamado"])
+
+    def _ao_enviar(self, message: dict):
+        # Mede a primeira entrega de cada chamado em cada worker
+        id_chamado = message.get("id_chamado")
+        if id_chamado in self.sem_entrega:
+            self.sem_entrega.discard(id_chamado)
+            panico_latencia.observe("primeira_entrega", time.time() - message["criado_em"])
+
+    def _ao_conectar(self, conexao: ClientConnection):
+        if self.abertos:
+            tarefa_em_fundo(self._reenviar_abertos(conexao))
+
+    async def _reenviar_abertos(self, conexao: ClientConnection):
+        try:
+            terapeutas = await self.terapeutas(app.state.pool)
+        except Exception as e:
+            print(f"Erro ao consultar terapeutas: {e}")
+            return
+        if conexao.user_id in terapeutas:
+            for chamado in self.listar_abertos():
+                conexao.enqueue(chamado)
+
+despacho_panico = DespachoPanico()
+manager.assinar_canal(CANAL_PANICO, despacho_panico._on_canal)
+manager.ganchos_envio["panico"] = despacho_panico._ao_enviar
+manager.ganchos_conexao.append(despacho_panico._ao_conectar)
+
+@app.post('/panico', status_code=status.HTTP_201_CREATED)
+async def abrir_chamado(request: Request, data: AbrirChamadoBody):
+    with erro_interno("abrir chamado"):
+        return await despacho_panico.abrir(request.app.state.pool, data.id_usuario, data.prioridade)
+
+@app.get('/panico/abertos')
+async def listar_chamados_abertos():
+    return RespostaJSON(despacho_panico.listar_abertos())
+
+@app.post('/panico/{id_chamado}/atender')
+async def atender_chamado(request: Request, id_chamado: int, data: AtenderChamadoBody):
+    # Só quem está de plantão (conectado) atende; que é terapeuta, o WHERE do UPDATE em atender() confirma
+    if data.id_terapeuta not in await despacho_panico.terapeutas_plantao(request.app.state.pool):
+        raise HTTPException(status_code=403, detail="Terapeuta não está de plantão")
+    if not await despacho_panico.atender(request.app.state.pool, id_chamado, data.id_terapeuta):
+        raise HTTPException(status_code=409, detail="Chamado já atendido ou inexistente")
+    return {"mensagem": "Chamado atribuído a você!", "id_chamado": id_chamado}
+
+@app.put('/panico/{id_chamado}/encerrar')
+async def encerrar_chamado(request: Request, id_chamado: int):
+    if not await despacho_panico.encerrar(request.app.state.pool, id_chamado):
+        raise HTTPException(status_code=404, detail="Chamado não encontrado ou já encerrado")
+    return {"mensagem": "Chamado encerrado."}
+
+# =====================================================
+# ASSISTENTE (IA)
+# =====================================================
+
+# --- Modelos do Assistente ---
+# O backend do modelo é plugável (IA_BACKEND): "stub" responde de forma determinística,
+# sem rede (desenvolvimento e testes); "openai" fala com qualquer API compatível com
+# /v1/chat/completions em streaming. Requer o pacote `httpx`.
+IA_BACKEND = os.getenv("IA_BACKEND", "stub")  # stub | openai
+IA_URL = os.getenv("IA_URL", "https://api.openai.com/v1/chat/completions")
+IA_MODELO = os.getenv("IA_MODELO", "gpt-4o-mini")
+IA_API_KEY = os.getenv("IA_API_KEY", "")
+IA_TIMEOUT = float(os.getenv("IA_TIMEOUT", 60))
+IA_STUB_ATRASO_MS = int(os.getenv("IA_STUB_ATRASO_MS", 0))
+IA_PROMPT_SISTEMA = os.getenv(
+    "IA_PROMPT_SISTEMA",
+    "Você é o assistente de apoio emocional do No Panic. Responda em português, com empatia e "
+    "frases curtas. Você não substitui um terapeuta; em caso de risco, oriente a usar o botão "
+    "de pânico ou ligar para o CVV (188).",
+)
+
+@dataclass(slots=True)
+class TurnoIA:
+    pergunta: str
+    resposta: str
+
+class ModeloIA:
+    """Gera a resposta em pedaços (tokens) a partir do contexto recente do usuário."""
+
+    async def gerar(self, contexto: List[TurnoIA], pergunta: str):
+        raise NotImplementedError
+        yield
+
+    async def fechar(self):
+        pass
+
+class ModeloStub(ModeloIA):
+    """Resposta fixa por palavra-chave: mesma pergunta e contexto, mesmos tokens."""
+
+    RESPOSTAS = (
+        (("pânico", "panico", "crise", "ar"),
+         "Vamos respirar juntos: inspire por 4 segundos, segure por 4 e solte por 6. "
+         "Se precisar de ajuda agora, use o botão de pânico ou ligue 188."),
+        (("ansioso", "ansiosa", "ansiedade", "medo"),
+         "Entendo, a ansiedade pode assustar. O que você está sentindo no corpo neste momento?"),
+        (("sessão", "sessao", "terapeuta"),
+         "Você pode ver os horários livres dos terapeutas e agendar uma sessão pela aba Terapeutas."),
+    )
+    PADRAO = "Estou aqui com você. Pode me contar um pouco mais sobre o que está acontecendo?"
+
+    async def gerar(self, contexto: List[TurnoIA], pergunta: str):
+        palavras = set(re.findall(r"\w+", pergunta.lower()))
+        texto = next((r for chaves, r in self.RESPOSTAS if palavras.intersection(chaves)), self.PADRAO)
+        if contexto:
+            texto = f"(conversa nº {len(contexto) + 1}) {texto}"
+        for token in re.findall(r"\S+\s*", texto):
+            if IA_STUB_ATRASO_MS:
+                await asyncio.sleep(IA_STUB_ATRASO_MS / 1000)
+            yield token
+
+class ModeloOpenAI(ModeloIA):
+    def __init__(self, url: str, modelo: str, api_key: str):
+        try:
+            import httpx
+        except ImportError as e:
+            raise RuntimeError("IA_BACKEND=openai requer o pacote 'httpx' instalado") from e
+        self.url = url
+        self.modelo = modelo
+        self.cliente = httpx.AsyncClient(
+            timeout=IA_TIMEOUT, headers={"Authorization": f"Bearer {api_key}"} if api_key else None
+        )
+
+    async def gerar(self, contexto: List[TurnoIA], pergunta: str):
+        mensagens = [{"role": "system", "content": IA_PROMPT_SISTEMA}]
+        for turno in contexto:
+            mensagens.append({"role": "user", "content": turno.pergunta})
+            mensagens.append({"role": "assistant", "content": turno.resposta})
+        mensagens.append({"role": "user", "content": pergunta})
+
+        corpo = {"model": self.modelo, "messages": mensagens, "stream": True}
+        async with self.cliente.stream("POST", self.url, json=corpo) as resposta:
+            resposta.raise_for_status()
+            async for linha in resposta.aiter_lines():
+                if not linha.startswith("data:"):
+                    continue
+                dado = linha[5:].strip()
+                if dado == "[DONE]":
+                    return
+                pedaco = loads_json(dado)["choices"][0]["delta"].get("content")
+                if pedaco:
+                    yield pedaco
+
+    async def fechar(self):
+        await self.cliente.aclose()
+
+def criar_modelo_ia() -> ModeloIA:
+    if IA_BACKEND == "openai":
+        return ModeloOpenAI(IA_URL, IA_MODELO, IA_API_KEY)
+    return ModeloStub()
+
+modelo_ia = criar_modelo_ia()
+
+# --- Contexto Recente ---
+# Janela limitada (deque) dos últimos turnos por usuário, carregada do banco uma vez
+# e depois mantida em memória a cada resposta; o LRU limita quantos usuários ficam no worker.
+IA_CONTEXTO_TURNOS = int(os.getenv("IA_CONTEXTO_TURNOS", 6))
+IA_CONTEXTO_USUARIOS = int(os.getenv("IA_CONTEXTO_USUARIOS", 5000))
+IA_CONTEXTO_TTL = float(os.getenv("IA_CONTEXTO_TTL", 1800))
+IA_PERGUNTA_MAX = int(os.getenv("IA_PERGUNTA_MAX", 2000))
+
+INTERACOES_RECENTES = """
+    /* interacao_ia_recentes */
+    SELECT pergunta, resposta FROM interacao_ia
+    WHERE id_usuario = %s ORDER BY id_interacao DESC LIMIT %s
+"""
+
+class ContextoIA:
+    def __init__(self, turnos: int, max_usuarios: int, ttl: float):
+        self.turnos = turnos
+        self.cache = TTLCache(maxsize=max_usuarios, ttl=ttl)
+        self.carregando = SingleFlight()
+
+    async def obter(self, repo: Repositorio, id_usuario: int) -> deque:
+        janela = self.cache.get(id_usuario)
+        if janela is None:
+            janela = await self.carregando.do(id_usuario, partial(self._carregar, repo, id_usuario))
+        return janela
+
+    async def _carregar(self, repo: Repositorio, id_usuario: int) -> deque:
+        linhas = await repo.todos(INTERACOES_RECENTES, (id_usuario, self.turnos), TurnoIA)
+        janela = deque(reversed(linhas), maxlen=self.turnos)
+        self.cache.set(id_usuario, janela)
+        return janela
+
+    def registrar(self, id_usuario: int, turno: TurnoIA):
+        janela = self.cache.get(id_usuario)
+        if janela is not None:
+            janela.append(turno)
+
+contexto_ia = ContextoIA(IA_CONTEXTO_TURNOS, IA_CONTEXTO_USUARIOS, IA_CONTEXTO_TTL)
+
+# --- Registro das Interações (write-behind) ---
+# O log em interacao_ia sai do caminho da resposta: vai para a fila e é gravado em lote.
+IA_FLUSH_MS = int(os.getenv("IA_FLUSH_MS", 1000))
+
+class EscritorInteracoes(EscritorEmLote):
+    def __init__(self):
+        super().__init__("interacoes_ia", IA_FLUSH_MS, MSG_FLUSH_MAX, MSG_QUEUE_MAX)
+        self.descartadas = 0
+
+    def registrar(self, id_usuario: int, data_hora: datetime, pergunta: str, resposta: str):
+        if not self._enfileirar_sem_esperar((id_usuario, data_hora, pergunta, resposta)):
+            self.descartadas += 1
+
+    async def _gravar(self, lote: list):
+        valores = ", ".join(["(%s, %s, %s, %s)"] * len(lote))
+        params = [v for item in lote for v in item]
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    f"INSERT INTO interacao_ia (id_usuario, data_hora, pergunta, resposta) VALUES {valores}", params
+                )
+
+interacao_writer = EscritorInteracoes()
+
+# --- Rota do Assistente ---
+# Server-Sent Events: cada pedaço do modelo vira um `data: {"token": ...}` assim que chega;
+# termina com `event: fim` (ou `event: erro` se o modelo falhar no meio).
+def evento_sse(dados: dict, evento: Optional[str] = None) -> bytes:
+    cabecalho = f"event: {evento}\n".encode() if evento else b""
+    return cabecalho + b"data: " + dumps_json(dados) + b"\n\n"
+
+async def _stream_ia(id_usuario: int, pergunta: str, contexto: deque):
+    inicio = datetime.now()
+    partes = []
+    try:
+        async for pedaco in modelo_ia.gerar(list(contexto), pergunta):
+            partes.append(pedaco)
+            yield evento_sse({"token": pedaco})
+    except Exception as e:
+        print(f"Erro no assistente (usuário {id_usuario}): {e}")
+        yield evento_sse({"detail": "O assistente não conseguiu responder agora"}, "erro")
+        return
+
+    # Só turnos completos entram no contexto e no log (cliente que desconectou cancela antes daqui)
+    resposta = "".join(partes)
+    contexto_ia.registrar(id_usuario, TurnoIA(pergunta, resposta))
+    interacao_writer.registrar(id_usuario, inicio, pergunta, resposta)
+    yield evento_sse({"fim": True}, "fim")
+
+@app.post('/ia/{id_usuario}')
+async def perguntar_ia(request: Request, id_usuario: int, data: PerguntaIABody):
+    pergunta = data.pergunta.strip()
+    if not pergunta:
+        raise HTTPException(status_code=400, detail="Pergunta vazia")
+    if len(pergunta) > IA_PERGUNTA_MAX:
+        raise HTTPException(status_code=400, detail=f"Pergunta maior que {IA_PERGUNTA_MAX} caracteres")
+
+    with erro_interno("carregar o assistente"):
+        # Usuário inexistente derrubaria o lote inteiro na FK de interacao_ia
+        if not await carregar_perfil(request.app.state.pool, id_usuario=id_usuario):
+            raise HTTPException(status_code=404, detail="Usuário não encontrado")
+        contexto = await contexto_ia.obter(request.app.state.repo, id_usuario)
+
+    return StreamingResponse(
+        _stream_ia(id_usuario, pergunta, contexto),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# =====================================================
+# MIGRAÇÕES E VERIFICAÇÃO DE ÍNDICES
+# =====================================================
+
+# --- Migrações Versionadas ---
+# Cada arquivo migrations/NNNN_descricao.sql roda uma única vez, em ordem, e fica registrado
+# em schema_migrations. O GET_LOCK impede que vários workers migrem ao mesmo tempo.
+MIGRACOES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+MIGRAR_NO_STARTUP = os.getenv("MIGRAR_NO_STARTUP", "0") == "1"
+_ARQUIVO_MIGRACAO = re.compile(r"^(\d+)_(.+)\.sql$")
+
+def listar_migracoes() -> List[tuple]:
+    migracoes = []
+    for arquivo in os.listdir(MIGRACOES_DIR):
+        m = _ARQUIVO_MIGRACAO.match(arquivo)
+        if m:
+            migracoes.append((int(m.group(1)), m.group(2), os.path.join(MIGRACOES_DIR, arquivo)))
+    return sorted(migracoes)
+
+def dividir_sql(texto: str) -> List[str]:
+    """Separa um arquivo em comandos (um por ';' no fim da linha), ignorando comentários '--'."""
+    comandos, atual = [], []
+    for linha in texto.splitlines():
+        if linha.strip().startswith("--"):
+            continue
+        atual.append(linha)
+        if linha.rstrip().endswith(";"):
+            comando = "\n".join(atual).strip().rstrip(";").strip()
+            if comando:
+                comandos.append(comando)
+            atual = []
+    resto = "\n".join(atual).strip()
+    if resto:
+        comandos.append(resto)
+    return comandos
+
+async def aplicar_migracoes(pool) -> List[int]:
+    """Aplica as migrações pendentes e devolve as versões aplicadas."""
+    aplicadas = []
     async with pool.acquire() as conn:
-        async with conn.cursor(aiomysql.DictCursor) as cur:
+        async with conn.cursor() as cur:
             await cur.execute("""
-                SELECT id_remetente, conteudo, CONVERT_TZ(enviadoEm, 'UTC', 'America/Sao_Paulo') AS enviadoEm 
-                FROM mensagem 
-                WHERE id_conversa = %s 
-                ORDER BY enviadoEm ASC
-            """, (id_conversa,))
-            mensagens = await cur.fetchall()
-            # Converter datetime para string para evitar erro de JSON
-            for msg in mensagens:
-                msg['enviadoEm'] = msg['enviadoEm'].isoformat()
-            
-            return mensagens
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    versao INT NOT NULL PRIMARY KEY,
+                    nome VARCHAR(255) NOT NULL,
+                    aplicadoEm DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            await cur.execute("SELECT GET_LOCK('no_panic_migracoes', 60)")
+            (travou,) = await cur.fetchone()
+            if not travou:
+                raise RuntimeError("Outro processo está aplicando migrações")
+            try:
+                await cur.execute("SELECT versao FROM schema_migrations")
+                feitas = {versao for (versao,) in await cur.fetchall()}
+                for versao, nome, caminho in listar_migracoes():
+                    if versao in feitas:
+                        continue
+                    with open(caminho, encoding="utf-8") as f:
+                        comandos = dividir_sql(f.read())
+                    # DDL no MySQL faz commit implícito: cada comando vale por si
+                    for comando in comandos:
+                        await cur.execute(comando)
+                    await cur.execute(
+                        "INSERT INTO schema_migrations (versao, nome) VALUES (%s, %s)", (versao, nome)
+                    )
+                    aplicadas.append(versao)
+                    print(f"✅ Migração {versao:04d} aplicada: {nome}")
+            finally:
+                await cur.execute("SELECT RELEASE_LOCK('no_panic_migracoes')")
+    return aplicadas
+
+# --- Verificação de Índices ---
+# Consultas dos caminhos quentes, com parâmetros de exemplo. O EXPLAIN de cada uma não pode
+# ter varredura completa (type = ALL), exceto nas tabelas listadas como permitidas.
+CONSULTAS_QUENTES = {
+    "perfil_por_email": (PERFIL_QUERY + " WHERE u.email = %s", ("a@b.c",), set()),
+    "perfil_por_id": (PERFIL_QUERY + " WHERE u.id_usuario = %s", (1,), set()),
+    "conversa_por_par": (CONVERSA_POR_PAR, (1, 2), set()),
+    "conversas_do_usuario": (CONVERSAS_DO_USUARIO, (1,) * 5, set()),
+    "parceiros_de_conversa": (PARCEIROS_DE_CONVERSA, (1, 1), set()),
+    "historico": (HISTORICO_CAMPOS + " ORDER BY id_mensagem DESC LIMIT %s", (1, 51), set()),
+    "favoritos_do_usuario": (FAVORITOS_DO_USUARIO, (1,), set()),
+    "usuarios_do_terapeuta": (USUARIOS_DO_TERAPEUTA, (1,), set()),
+    "sessao_por_uuid": (SESSAO_POR_UUID, ("00000000-0000-0000-0000-000000000000",), set()),
+    "sessoes_do_terapeuta": ("""
+        SELECT s.id_sessao, s.data_hora_agendamento FROM sessao s
+        JOIN usuario u ON s.id_usuario = u.id_usuario
+        WHERE s.id_terapeuta = %s AND s.data_hora_agendamento >= %s
+        ORDER BY s.data_hora_agendamento, s.id_sessao LIMIT %s
+    """, (1, datetime(2025, 1, 1), 100), set()),
+    "chamados_abertos": (
+        "SELECT id_chamado FROM chamado_panico WHERE status = 'aberto'", (), set()
+    ),
+    # Poucas linhas: o GROUP BY percorre termos inteira, e o registro em memória evita repetir
+    "termos_vigentes": (TERMOS_VIGENTES, (), {"termos", "<derived2>"}),
+    # A listagem sem filtro percorre o diretório inteiro de propósito (paginada)
+    "terapeutas": (TERAPEUTAS_LISTAGEM + " ORDER BY t.id_usuario LIMIT %s OFFSET %s", (10, 0), {"t"}),
+}
+
+async def verificar_indices(pool) -> List[str]:
+    """Roda EXPLAIN nas consultas quentes e devolve as que fazem varredura completa."""
+    problemas = []
+    async with pool.acquire() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cur:
+            for nome, (query, params, permitidas) in CONSULTAS_QUENTES.items():
+                await cur.execute("EXPLAIN " + query, params)
+                for linha in await cur.fetchall():
+                    if linha.get("type") == "ALL" and linha.get("table") not in permitidas:
+                        problemas.append(f"{nome}: varredura completa em '{linha.get('table')}'")
+    return problemas
 
 # Para rodar:
-# uvicorn main:app --reload
\ No newline at end of file
+# uvicorn main:app --reload
+#
+# Manutenção:
+# python main.py migrar
+# python main.py verificar-indices
+# python main.py recalcular-estatisticas
+
+async def _executar_comando(comando: str) -> int:
+    pool = await criar_pool()
+    try:
+        if comando == "recalcular-estatisticas":
+            total = await recalcular_estatisticas_terapeutas(pool)
+            print(f"✅ Estatísticas recalculadas ({total} terapeuta(s) alterado(s)).")
+        elif comando == "migrar":
+            aplicadas = await aplicar_migracoes(pool)
+            if not aplicadas:
+                print("✅ Banco já está na versão mais recente.")
+        elif comando == "verificar-indices":
+            problemas = await verificar_indices(pool)
+            for problema in problemas:
+                print(f"❌ {problema}")
+            if problemas:
+                return 1
+            print(f"✅ {len(CONSULTAS_QUENTES)} consulta(s) usando índices.")
+    finally:
+        pool.close()
+        await pool.wait_closed()
+    return 0
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Comandos de manutenção do backend No Panic")
+    parser.add_argument("comando", choices=["migrar", "verificar-indices", "recalcular-estatisticas"])
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(_executar_comando(args.comando)))
\ No newline at end of file
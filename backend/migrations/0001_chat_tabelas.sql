@@ -0,0 +1,23 @@
+-- Tabelas do chat, que não estavam no dump (estrutura.sql).
+-- IF NOT EXISTS: bancos antigos já têm as tabelas criadas à mão.
+CREATE TABLE IF NOT EXISTS `conversa` (
+  `id_conversa` int NOT NULL AUTO_INCREMENT,
+  `id_usuario` int NOT NULL,
+  `id_terapeuta` int NOT NULL,
+  `criadoEm` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `atualizadoEm` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id_conversa`),
+  CONSTRAINT `fk_conversa_usuario` FOREIGN KEY (`id_usuario`) REFERENCES `usuario` (`id_usuario`) ON DELETE CASCADE ON UPDATE CASCADE,
+  CONSTRAINT `fk_conversa_terapeuta` FOREIGN KEY (`id_terapeuta`) REFERENCES `usuario` (`id_usuario`) ON DELETE CASCADE ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
+CREATE TABLE IF NOT EXISTS `mensagem` (
+  `id_mensagem` int NOT NULL AUTO_INCREMENT,
+  `id_conversa` int NOT NULL,
+  `id_remetente` int NOT NULL,
+  `conteudo` text NOT NULL,
+  `enviadoEm` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id_mensagem`),
+  CONSTRAINT `fk_mensagem_conversa` FOREIGN KEY (`id_conversa`) REFERENCES `conversa` (`id_conversa`) ON DELETE CASCADE ON UPDATE CASCADE,
+  CONSTRAINT `fk_mensagem_remetente` FOREIGN KEY (`id_remetente`) REFERENCES `usuario` (`id_usuario`) ON DELETE CASCADE ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
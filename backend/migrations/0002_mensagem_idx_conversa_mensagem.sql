@@ -0,0 +1,3 @@
+-- Paginação por cursor do histórico do chat:
+-- WHERE id_conversa = ? AND id_mensagem < ? ORDER BY id_mensagem DESC LIMIT ?
+ALTER TABLE mensagem ADD INDEX idx_mensagem_conversa_mensagem (id_conversa, id_mensagem);
@@ -0,0 +1,14 @@
+-- Contador mantido por atualizar_sessao; substitui o COUNT correlacionado em /terapeutas.
+-- Pode ser reconstruído com: python main.py recalcular-estatisticas
+ALTER TABLE terapeuta ADD COLUMN total_sessoes_concluidas INT NOT NULL DEFAULT 0;
+
+ALTER TABLE sessao ADD INDEX idx_sessao_terapeuta_status (id_terapeuta, status);
+
+UPDATE terapeuta t
+LEFT JOIN (
+    SELECT id_terapeuta, COUNT(*) AS total
+    FROM sessao
+    WHERE status = 'concluida'
+    GROUP BY id_terapeuta
+) s ON s.id_terapeuta = t.id_usuario
+SET t.total_sessoes_concluidas = COALESCE(s.total, 0);
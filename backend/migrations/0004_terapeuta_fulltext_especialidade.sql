@@ -0,0 +1,2 @@
+-- Busca por especialidade em /terapeutas sem varrer a tabela (MATCH ... AGAINST em modo booleano)
+ALTER TABLE terapeuta ADD FULLTEXT INDEX ft_terapeuta_especialidade (especialidade);
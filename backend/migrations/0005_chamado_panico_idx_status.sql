@@ -0,0 +1,5 @@
+-- Recarga da fila de chamados abertos no startup: WHERE status = 'aberto'
+ALTER TABLE chamado_panico ADD INDEX idx_chamado_status_data (status, data_hora);
+
+-- Lista de plantão: SELECT id_usuario FROM terapeuta WHERE ativo = 1
+ALTER TABLE terapeuta ADD INDEX idx_terapeuta_ativo (ativo);
@@ -0,0 +1,17 @@
+-- Disponibilidade semanal estruturada (substitui o texto livre de terapeuta.disponibilidade
+-- para busca de horários; o campo antigo continua sendo exibido no perfil).
+CREATE TABLE disponibilidade_terapeuta (
+  `id` int NOT NULL AUTO_INCREMENT,
+  `id_terapeuta` int NOT NULL,
+  `dia_semana` tinyint NOT NULL COMMENT '0 = segunda ... 6 = domingo',
+  `hora_inicio` time NOT NULL,
+  `hora_fim` time NOT NULL,
+  `criadoEm` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `atualizadoEm` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  KEY `idx_disponibilidade_terapeuta` (`id_terapeuta`, `dia_semana`),
+  CONSTRAINT `fk_disponibilidade_terapeuta` FOREIGN KEY (`id_terapeuta`) REFERENCES `terapeuta` (`id_usuario`) ON DELETE CASCADE ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
+-- Conflitos e horários livres: WHERE id_terapeuta = ? AND data_hora_agendamento BETWEEN ...
+ALTER TABLE sessao ADD INDEX idx_sessao_terapeuta_agendamento (id_terapeuta, data_hora_agendamento);
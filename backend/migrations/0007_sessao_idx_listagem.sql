@@ -0,0 +1,9 @@
+-- /sessoes/{tipo}/{id}: WHERE s.id_(usuario|terapeuta) = ? [AND s.status = ?]
+-- ORDER BY s.data_hora_agendamento, s.id_sessao (id_sessao já vem junto por ser a PK)
+ALTER TABLE sessao ADD INDEX idx_sessao_usuario_agendamento (id_usuario, data_hora_agendamento);
+ALTER TABLE sessao ADD INDEX idx_sessao_usuario_status_agendamento (id_usuario, status, data_hora_agendamento);
+
+-- Substitui (id_terapeuta, status) da migração 0003, que vira prefixo deste
+ALTER TABLE sessao
+  DROP INDEX idx_sessao_terapeuta_status,
+  ADD INDEX idx_sessao_terapeuta_status_agendamento (id_terapeuta, status, data_hora_agendamento);
@@ -0,0 +1,7 @@
+-- listar_conversas: WHERE c.id_usuario = ? OR c.id_terapeuta = ? ORDER BY c.atualizadoEm DESC
+-- (index_merge/union entre os dois índices) e a busca da conversa de um par de usuários.
+ALTER TABLE conversa ADD INDEX idx_conversa_usuario_terapeuta (id_usuario, id_terapeuta);
+ALTER TABLE conversa ADD INDEX idx_conversa_terapeuta_usuario (id_terapeuta, id_usuario);
+
+-- Observação: as buscas reversas em usuario_salva_terapeuta (WHERE id_terapeuta = ?) já são
+-- atendidas pelo KEY `id_terapeuta` do dump, que no InnoDB carrega a PK (id_usuario) junto.
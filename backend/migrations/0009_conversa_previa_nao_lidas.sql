@@ -0,0 +1,27 @@
+-- Prévia da última mensagem e não lidas de cada lado, para /chat/conversas montar a lista
+-- sem buscar o histórico de cada conversa. Mantidas pela gravação em lote das mensagens
+-- (EscritorMensagens) e pelo evento "read" do socket (EscritorLeituras).
+ALTER TABLE conversa
+  ADD COLUMN ultima_mensagem VARCHAR(160) NULL,
+  ADD COLUMN id_ultima_mensagem INT NULL,
+  ADD COLUMN id_ultimo_remetente INT NULL,
+  ADD COLUMN nao_lidas_usuario INT NOT NULL DEFAULT 0,
+  ADD COLUMN nao_lidas_terapeuta INT NOT NULL DEFAULT 0,
+  ADD COLUMN lida_usuario_ate INT NOT NULL DEFAULT 0,
+  ADD COLUMN lida_terapeuta_ate INT NOT NULL DEFAULT 0;
+
+-- Conversas existentes: prévia da última mensagem e todo o histórico considerado lido
+UPDATE conversa c
+JOIN (
+  SELECT id_conversa, MAX(id_mensagem) AS id_mensagem
+  FROM mensagem
+  GROUP BY id_conversa
+) ultima ON ultima.id_conversa = c.id_conversa
+JOIN mensagem m ON m.id_mensagem = ultima.id_mensagem
+-- atualizadoEm é ON UPDATE CURRENT_TIMESTAMP: o backfill mantém a ordem atual das conversas
+SET c.atualizadoEm = c.atualizadoEm,
+    c.ultima_mensagem = LEFT(m.conteudo, 160),
+    c.id_ultima_mensagem = m.id_mensagem,
+    c.id_ultimo_remetente = m.id_remetente,
+    c.lida_usuario_ate = m.id_mensagem,
+    c.lida_terapeuta_ate = m.id_mensagem;
@@ -0,0 +1,11 @@
+-- Um consentimento por (usuário, termo): permite o registro em massa idempotente com
+-- INSERT IGNORE e atende à busca dos termos aceitos no perfil (WHERE usuario_id = ?).
+-- Remove duplicatas antigas, mantendo o primeiro aceite.
+DELETE c FROM consentimentos c
+JOIN consentimentos anterior
+  ON anterior.usuario_id = c.usuario_id AND anterior.termo_id = c.termo_id AND anterior.id < c.id;
+
+ALTER TABLE consentimentos ADD UNIQUE INDEX uq_consentimento_usuario_termo (usuario_id, termo_id);
+
+-- O índice novo começa por usuario_id e passa a servir a FK; o KEY antigo fica redundante.
+ALTER TABLE consentimentos DROP INDEX usuario_id;
@@ -0,0 +1,6 @@
+-- Quem atendeu o chamado (gravado junto com a troca de status, no UPDATE condicional)
+-- e a prioridade pedida na abertura, para carregar() remontar a fila na ordem certa após um restart.
+ALTER TABLE chamado_panico
+  ADD COLUMN id_terapeuta INT NULL AFTER id_usuario,
+  ADD COLUMN prioridade INT NOT NULL DEFAULT 1 COMMENT 'menor = mais urgente' AFTER id_terapeuta,
+  ADD CONSTRAINT fk_chamado_terapeuta FOREIGN KEY (id_terapeuta) REFERENCES terapeuta (id_usuario) ON DELETE SET NULL ON UPDATE CASCADE;
@@ -0,0 +1,44 @@
+-- Uma conversa por par de participantes, em qualquer ordem: colunas geradas com o par normalizado
+-- e índice único sobre elas. Primeiras mensagens simultâneas em workers diferentes convergem no
+-- INSERT ... ON DUPLICATE KEY UPDATE em vez de criar duas conversas para o mesmo par.
+
+-- Duplicatas de antes do índice: a conversa mais antiga do par fica com as mensagens das outras
+CREATE TEMPORARY TABLE conversa_duplicada AS
+SELECT c.id_conversa, manter.id_conversa AS id_manter
+FROM conversa c
+JOIN (
+  SELECT LEAST(id_usuario, id_terapeuta) AS menor, GREATEST(id_usuario, id_terapeuta) AS maior,
+         MIN(id_conversa) AS id_conversa
+  FROM conversa
+  GROUP BY menor, maior
+  HAVING COUNT(*) > 1
+) manter ON manter.menor = LEAST(c.id_usuario, c.id_terapeuta) AND manter.maior = GREATEST(c.id_usuario, c.id_terapeuta)
+WHERE c.id_conversa <> manter.id_conversa;
+
+UPDATE mensagem m
+JOIN conversa_duplicada d ON d.id_conversa = m.id_conversa
+SET m.id_conversa = d.id_manter;
+
+DELETE c FROM conversa c
+JOIN conversa_duplicada d ON d.id_conversa = c.id_conversa;
+
+-- Prévia das conversas que receberam mensagens (mesma regra do backfill da 0009)
+UPDATE conversa c
+JOIN (SELECT DISTINCT id_manter FROM conversa_duplicada) d ON d.id_manter = c.id_conversa
+JOIN (
+  SELECT id_conversa, MAX(id_mensagem) AS id_mensagem
+  FROM mensagem
+  GROUP BY id_conversa
+) ultima ON ultima.id_conversa = c.id_conversa
+JOIN mensagem m ON m.id_mensagem = ultima.id_mensagem
+SET c.atualizadoEm = c.atualizadoEm,
+    c.ultima_mensagem = LEFT(m.conteudo, 160),
+    c.id_ultima_mensagem = m.id_mensagem,
+    c.id_ultimo_remetente = m.id_remetente;
+
+DROP TEMPORARY TABLE conversa_duplicada;
+
+ALTER TABLE conversa
+  ADD COLUMN par_menor INT GENERATED ALWAYS AS (LEAST(id_usuario, id_terapeuta)) STORED,
+  ADD COLUMN par_maior INT GENERATED ALWAYS AS (GREATEST(id_usuario, id_terapeuta)) STORED,
+  ADD UNIQUE INDEX uq_conversa_par (par_menor, par_maior);
@@ -0,0 +1,88 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class WebSocketFalso:
+    """O mínimo de WebSocket que o ConnectionManager usa; guarda o que foi enviado."""
+
+    def __init__(self):
+        self.enviados = []
+        self.fechado_com = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, texto: str):
+        self.enviados.append(texto)
+
+    async def close(self, code: int = 1000):
+        self.fechado_com = code
+
+
+class CursorFalso:
+    def __init__(self, pool):
+        self.pool = pool
+        self.rowcount = 0
+        self.lastrowid = None
+        self._linhas = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def execute(self, query, params=None):
+        self.pool.log.append((" ".join(query.split()), params))
+        resposta = self.pool.responder(query, params) or {}
+        self._linhas = list(resposta.get("linhas", []))
+        self.rowcount = resposta.get("rowcount", len(self._linhas))
+        self.lastrowid = resposta.get("lastrowid")
+
+    async def fetchone(self):
+        return self._linhas.pop(0) if self._linhas else None
+
+    async def fetchall(self):
+        linhas, self._linhas = self._linhas, []
+        return linhas
+
+
+class ConexaoFalsa:
+    def __init__(self, pool):
+        self.pool = pool
+
+    def cursor(self, *args):
+        return CursorFalso(self.pool)
+
+    async def begin(self):
+        self.pool.log.append(("BEGIN", None))
+
+    async def commit(self):
+        self.pool.log.append(("COMMIT", None))
+
+    async def rollback(self):
+        self.pool.log.append(("ROLLBACK", None))
+
+
+class PoolFalso:
+    """Pool que responde às queries com `responder(query, params) -> {"linhas", "rowcount", "lastrowid"}`."""
+
+    def __init__(self, responder=lambda query, params: None):
+        self.responder = responder
+        self.log = []
+
+    def acquire(self):
+        pool = self
+
+        class _Acquire:
+            async def __aenter__(self):
+                await asyncio.sleep(0)  # como no pool real, pegar conexão cede o loop
+                return ConexaoFalsa(pool)
+
+            async def __aexit__(self, *exc):
+                pass
+
+        return _Acquire()
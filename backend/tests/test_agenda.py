@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+from main import DURACAO_SESSAO, AgendaTerapeuta, parse_data_hora
+
+SEGUNDA = datetime(2030, 1, 7)  # dia_semana 0
+MANHA = {0: [(9 * 60, 12 * 60)]}  # 09:00-12:00 às segundas
+
+
+def horas(horarios):
+    return [h.strftime("%H:%M") for h in horarios]
+
+
+def test_livres_segue_a_grade_quando_nao_ha_sessoes():
+    agenda = AgendaTerapeuta(MANHA, [])
+    assert horas(agenda.livres(SEGUNDA, SEGUNDA + timedelta(days=1), 10)) == ["09:00", "09:50", "10:40"]
+
+
+def test_livres_retoma_no_fim_da_sessao_que_conflitou():
+    agenda = AgendaTerapeuta(MANHA, [SEGUNDA.replace(hour=10)])
+    assert horas(agenda.livres(SEGUNDA, SEGUNDA + timedelta(days=1), 10)) == ["09:00", "10:50"]
+
+
+def test_livres_com_sessao_fora_da_grade_arredonda_para_o_minuto_seguinte():
+    agenda = AgendaTerapeuta(MANHA, [SEGUNDA.replace(hour=9, minute=20, second=30)])
+    assert horas(agenda.livres(SEGUNDA, SEGUNDA + timedelta(days=1), 10)) == ["10:11", "11:01"]
+
+
+def test_livres_respeita_intervalo_limite_e_dias_sem_janela():
+    agenda = AgendaTerapeuta(MANHA, [])
+    semana = agenda.livres(SEGUNDA + timedelta(hours=9, minutes=30), SEGUNDA + timedelta(days=7), 2)
+    assert horas(semana) == ["09:50", "10:40"]
+    # Terça a domingo sem janela: só a segunda seguinte aparece
+    proxima = agenda.livres(SEGUNDA + timedelta(days=1), SEGUNDA + timedelta(days=8), 1)
+    assert proxima == [SEGUNDA + timedelta(days=7, hours=9)]
+
+
+def test_conflita_so_quando_as_sessoes_se_sobrepoem():
+    inicio = SEGUNDA.replace(hour=10)
+    agenda = AgendaTerapeuta(MANHA, [inicio])
+
+    assert agenda.conflita(inicio)
+    assert agenda.conflita(inicio - DURACAO_SESSAO + timedelta(minutes=1))
+    assert agenda.conflita(inicio + DURACAO_SESSAO - timedelta(minutes=1))
+    # Encostar não é conflito: uma termina exatamente quando a outra começa
+    assert not agenda.conflita(inicio - DURACAO_SESSAO)
+    assert not agenda.conflita(inicio + DURACAO_SESSAO)
+    assert agenda.fim_do_conflito(inicio + timedelta(minutes=10)) == inicio + DURACAO_SESSAO
+
+
+def test_dentro_da_disponibilidade():
+    agenda = AgendaTerapeuta(MANHA, [])
+    assert agenda.dentro_da_disponibilidade(SEGUNDA.replace(hour=11, minute=10))
+    assert not agenda.dentro_da_disponibilidade(SEGUNDA.replace(hour=11, minute=11))
+    assert not agenda.dentro_da_disponibilidade(SEGUNDA.replace(hour=10) + timedelta(days=1))
+    # Sem disponibilidade estruturada, qualquer horário vale
+    assert AgendaTerapeuta({}, []).dentro_da_disponibilidade(SEGUNDA.replace(hour=3))
+
+
+def test_parse_data_hora_converte_fuso_para_hora_local():
+    com_fuso = parse_data_hora("2030-01-07T10:20:00-03:00")
+    esperado = datetime(2030, 1, 7, 10, 20, tzinfo=timezone(timedelta(hours=-3))).astimezone().replace(tzinfo=None)
+    assert com_fuso == esperado and com_fuso.tzinfo is None
+    assert parse_data_hora("2030-01-07 10:20:00") == datetime(2030, 1, 7, 10, 20)
+    # Comparável com o índice (naive) sem TypeError
+    AgendaTerapeuta(MANHA, [SEGUNDA]).conflita(com_fuso)
+
+    with pytest.raises(HTTPException) as erro:
+        parse_data_hora("amanhã")
+    assert erro.value.status_code == 400
@@ -0,0 +1,86 @@
+import asyncio
+
+from conftest import WebSocketFalso
+from main import BrokerBackplane, ConnectionManager, LocalBroker, canal_usuario, loads_json
+
+
+async def _esperar_envio(ws: WebSocketFalso, quantos: int = 1):
+    for _ in range(100):
+        if len(ws.enviados) >= quantos:
+            return
+        await asyncio.sleep(0)
+
+
+async def _dois_workers():
+    broker = LocalBroker()
+    workers = [ConnectionManager(BrokerBackplane(broker)), ConnectionManager(BrokerBackplane(broker))]
+    for worker in workers:
+        await worker.start()
+    return broker, workers
+
+
+async def _encerrar(*workers):
+    for worker in workers:
+        await worker.drenar(0)
+        await worker.close()
+
+
+def test_entrega_no_worker_que_tem_o_socket():
+    async def cenario():
+        broker, (a, b) = await _dois_workers()
+        ws = WebSocketFalso()
+        await b.connect(ws, 2)
+
+        await a.send_personal_message({"type": "message", "from_id": 1, "message": "oi"}, 2)
+        await _esperar_envio(ws)
+
+        assert [loads_json(t) for t in ws.enviados] == [{"type": "message", "from_id": 1, "message": "oi"}]
+        assert 2 not in a.active_connections
+        await _encerrar(a, b)
+
+    asyncio.run(cenario())
+
+
+def test_desconectar_cancela_a_assinatura_do_usuario():
+    async def cenario():
+        broker, (a, b) = await _dois_workers()
+        celular, aba = WebSocketFalso(), WebSocketFalso()
+        primeira = await b.connect(celular, 2)
+        segunda = await b.connect(aba, 2)
+
+        # Com outro dispositivo ainda aberto, o worker continua assinando o canal do usuário
+        await b.disconnect(primeira)
+        assert canal_usuario(2) in broker.assinantes
+
+        await b.disconnect(segunda)
+        assert canal_usuario(2) not in broker.assinantes
+
+        await a.send_personal_message({"type": "message", "message": "perdida"}, 2)
+        await asyncio.sleep(0)
+        assert celular.enviados == [] and aba.enviados == []
+        await _encerrar(a, b)
+
+    asyncio.run(cenario())
+
+
+def test_canal_de_broadcast_chega_a_todos_os_workers():
+    async def cenario():
+        broker = LocalBroker()
+        recebidas = {"a": [], "b": []}
+        workers = {}
+        for nome in recebidas:
+            worker = ConnectionManager(BrokerBackplane(broker))
+
+            async def handler(message, nome=nome):
+                recebidas[nome].append(message)
+
+            worker.assinar_canal("sessoes", handler)
+            await worker.start()
+            workers[nome] = worker
+
+        await workers["a"].broadcast("sessoes", {"uuid": "abc"})
+
+        assert recebidas == {"a": [{"uuid": "abc"}], "b": [{"uuid": "abc"}]}
+        await _encerrar(*workers.values())
+
+    asyncio.run(cenario())
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from main import SingleFlight, TTLCache
+
+
+def test_single_flight_junta_chamadas_concorrentes():
+    async def cenario():
+        voo = SingleFlight()
+        chamadas = 0
+        liberar = asyncio.Event()
+
+        async def carregar():
+            nonlocal chamadas
+            chamadas += 1
+            await liberar.wait()
+            return {"id": 1}
+
+        tarefas = [asyncio.create_task(voo.do("chave", carregar)) for _ in range(5)]
+        await asyncio.sleep(0)
+        liberar.set()
+        resultados = await asyncio.gather(*tarefas)
+
+        assert chamadas == 1
+        assert all(r is resultados[0] for r in resultados)
+
+        # Terminada a primeira, a chave sai de voo e a próxima chamada busca de novo
+        await voo.do("chave", carregar)
+        assert chamadas == 2
+
+    asyncio.run(cenario())
+
+
+def test_single_flight_repassa_o_erro_a_todos():
+    async def cenario():
+        voo = SingleFlight()
+        liberar = asyncio.Event()
+
+        async def falhar():
+            await liberar.wait()
+            raise ValueError("banco fora")
+
+        tarefas = [asyncio.create_task(voo.do("chave", falhar)) for _ in range(3)]
+        await asyncio.sleep(0)
+        liberar.set()
+        resultados = await asyncio.gather(*tarefas, return_exceptions=True)
+
+        assert all(isinstance(r, ValueError) for r in resultados)
+        assert voo._em_voo == {}
+
+    asyncio.run(cenario())
+
+
+def test_ttl_cache_expira_e_descarta_o_menos_usado():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")  # "a" passa a ser o mais recente
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+    cache.set("d", 4, ttl=-1)
+    assert cache.get("d", "expirado") == "expirado"
+    assert "d" not in cache._data
+
+
+@pytest.mark.parametrize("chave", [0, "", None])
+def test_ttl_cache_guarda_chaves_falsas(chave):
+    cache = TTLCache()
+    cache.set(chave, "valor")
+    assert cache.get(chave) == "valor"
+    assert cache.pop(chave) == "valor"
+    assert cache.get(chave) is None
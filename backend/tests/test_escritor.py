@@ -0,0 +1,84 @@
+import asyncio
+
+import aiomysql
+import pytest
+
+from conftest import PoolFalso
+from main import EscritorEmLote, EscritorMensagens, EscritorParado
+
+
+class EscritorDeTeste(EscritorEmLote):
+    """Recusa com IntegrityError qualquer lote que contenha um item de `ruins`."""
+
+    def __init__(self, ruins=(), erro=aiomysql.IntegrityError):
+        super().__init__("teste", intervalo_ms=10, max_lote=100, max_fila=100)
+        self.ruins = set(ruins)
+        self.erro = erro
+        self.gravados = []
+        self.falhas = []
+        self.tentativas = 0
+
+    async def _gravar(self, lote):
+        self.tentativas += 1
+        if self.ruins.intersection(lote):
+            raise self.erro(1452, "foreign key")
+        self.gravados.extend(lote)
+
+    def _falhou(self, lote, erro):
+        self.falhas.extend((item, type(erro)) for item in lote)
+
+
+def test_linha_ruim_nao_derruba_o_lote():
+    escritor = EscritorDeTeste(ruins={5})
+    asyncio.run(escritor._gravar_seguro(list(range(16))))
+
+    assert sorted(escritor.gravados) == [i for i in range(16) if i != 5]
+    assert escritor.falhas == [(5, aiomysql.IntegrityError)]
+    # Divisão binária: um item ruim custa log2(n) idas a mais, não uma por linha
+    assert escritor.tentativas <= 2 * 4 + 1
+
+
+def test_erro_de_conexao_repete_o_lote_inteiro_e_depois_falha():
+    escritor = EscritorDeTeste(ruins={1}, erro=aiomysql.OperationalError)
+    asyncio.run(escritor._gravar_seguro([1, 2, 3]))
+
+    assert escritor.tentativas == 2
+    assert escritor.gravados == []
+    assert [item for item, _ in escritor.falhas] == [1, 2, 3]
+
+
+def test_stop_grava_o_que_estava_na_fila_e_recusa_itens_novos():
+    async def cenario():
+        escritor = EscritorDeTeste()
+        escritor.start(pool=None)
+        await escritor._enfileirar("a")
+        await escritor._enfileirar("b")
+        await escritor.stop()
+
+        assert escritor.gravados == ["a", "b"]
+        with pytest.raises(EscritorParado):
+            await escritor._enfileirar("c")
+        assert escritor._enfileirar_sem_esperar("d") is False
+
+    asyncio.run(cenario())
+
+
+def test_ids_das_mensagens_respeitam_auto_increment_increment():
+    def responder(query, params):
+        if query.startswith("INSERT INTO mensagem"):
+            return {"lastrowid": 501}
+        if "auto_increment_increment" in query:
+            return {"linhas": [(2,)]}
+
+    async def cenario():
+        escritor = EscritorMensagens()
+        escritor.pool = PoolFalso(responder)
+        loop = asyncio.get_running_loop()
+        lote = [(7, 1, "oi", loop.create_future()), (8, 2, "olá", loop.create_future())]
+        await escritor._gravar(lote)
+
+        assert [fut.result() for *_, fut in lote] == [501, 503]
+        atualizacao = next(p for q, p in escritor.pool.log if "conversa_apos_lote" in q)
+        assert atualizacao == [501, 503]
+
+    asyncio.run(cenario())
@@ -0,0 +1,79 @@
+import asyncio
+
+from conftest import PoolFalso
+from main import DespachoPanico
+
+
+def _chamado(id_chamado: int, prioridade: int = 1, criado_em: float = 0.0) -> dict:
+    return {"type": "panico", "id_chamado": id_chamado, "id_usuario": 9, "nome": "Ana",
+            "prioridade": prioridade, "criado_em": criado_em}
+
+
+def _banco_com_um_vencedor():
+    """Só o primeiro UPDATE condicional acha o chamado ainda 'aberto'."""
+    estado = {"aberto": True}
+
+    def responder(query, params):
+        if "SET status = 'atendido'" in query:
+            venceu = estado["aberto"]
+            estado["aberto"] = False
+            return {"rowcount": int(venceu)}
+        if query.startswith("SELECT id_usuario FROM terapeuta"):
+            return {"linhas": [(5,), (6,)]}
+
+    return PoolFalso(responder)
+
+
+def test_primeiro_a_atender_vence_no_mesmo_worker():
+    async def cenario():
+        despacho = DespachoPanico()
+        despacho._adicionar(_chamado(77))
+        pool = _banco_com_um_vencedor()
+
+        resultados = await asyncio.gather(despacho.atender(pool, 77, 5), despacho.atender(pool, 77, 6))
+
+        assert sorted(resultados) == [False, True]
+        # O perdedor local nem chega ao banco
+        updates = [p for q, p in pool.log if "SET status = 'atendido'" in q]
+        assert len(updates) == 1
+        assert updates[0][1] == 77 and updates[0][0] == updates[0][2]
+        assert despacho.listar_abertos() == []
+
+    asyncio.run(cenario())
+
+
+def test_quem_perde_no_banco_nao_remove_o_chamado():
+    async def cenario():
+        pool = _banco_com_um_vencedor()
+        worker_a, worker_b = DespachoPanico(), DespachoPanico()
+        for despacho in (worker_a, worker_b):
+            despacho._adicionar(_chamado(77))
+
+        assert await worker_a.atender(pool, 77, 5) is True
+        assert await worker_b.atender(pool, 77, 6) is False
+        # worker_b só tira o chamado da fila quando o evento "atendido" chega pelo barramento
+        assert [c["id_chamado"] for c in worker_b.listar_abertos()] == [77]
+        await worker_b._on_canal({"evento": "atendido", "id_chamado": 77})
+        assert worker_b.listar_abertos() == []
+
+    asyncio.run(cenario())
+
+
+def test_fila_ordena_por_prioridade_e_chegada_e_carregar_usa_a_prioridade_gravada():
+    def responder(query, params):
+        if "FROM chamado_panico" in query:
+            return {"linhas": [
+                {"id_chamado": 1, "id_usuario": 9, "nome": "Ana", "prioridade": 3, "criado_em": 10},
+                {"id_chamado": 2, "id_usuario": 8, "nome": "Bia", "prioridade": 1, "criado_em": 20},
+                {"id_chamado": 3, "id_usuario": 7, "nome": "Caio", "prioridade": 1, "criado_em": 15},
+            ]}
+
+    async def cenario():
+        despacho = DespachoPanico()
+        await despacho.carregar(PoolFalso(responder))
+        assert [c["id_chamado"] for c in despacho.listar_abertos()] == [3, 2, 1]
+
+        despacho._remover(3)
+        assert [c["id_chamado"] for c in despacho.listar_abertos()] == [2, 1]
+
+    asyncio.run(cenario())
@@ -12,6 +12,7 @@ import { useRouter } from 'next/router';
 // --- Tipos ---
 type Mensagem = {
   id?: number;
+  ref?: string;
   from_id: number;
   id_remetente?: number;
   conteudo: string;
@@ -23,10 +24,33 @@ type Mensagem = {
 interface MensagemLocal
   extends Pick<Mensagem, 'from_id' | 'conteudo' | 'timestamp'> {}
 
+// Frames do socket: mensagens (type 'message') e controle ('ack', 'sync', 'falha'...)
+type FrameSocket = {
+  type?: string;
+  from_id?: number;
+  message?: string;
+  timestamp?: string;
+  ref?: string;
+  id_mensagem?: number;
+  id_conversa?: number;
+  // sync: fim do reenvio
+  ultimo_id?: number;
+  enviadas?: number;
+  completo?: boolean;
+  // Presença: delta (id_usuario + estado) ou lista inicial (estados)
+  id_usuario?: number;
+  estado?: EstadoPresenca;
+  estados?: Record<string, EstadoPresenca>;
+};
+
+type EstadoPresenca = 'online' | 'ausente' | 'offline';
+
 type Conversa = {
   id_conversa: number;
   outro_usuario_id: number;
   outro_usuario_nome: string;
+  ultima_mensagem?: string | null;
+  nao_lidas?: number;
 };
 
 // --- Componente do Chat ---
@@ -40,7 +64,18 @@ const ChatInterface = () => {
   const [chatSelecionado, setChatSelecionado] = useState<Conversa | null>(null);
   const [mensagens, setMensagens] = useState<Mensagem[]>([]);
   const [inputMsg, setInputMsg] = useState('');
+  // Incrementado para reabrir o socket quando o servidor fecha (reinício, inatividade)
+  const [reconexao, setReconexao] = useState(0);
+  // Incrementado para recarregar lista e histórico quando o socket não garante o que faltou
+  const [recarga, setRecarga] = useState(0);
+  const [presenca, setPresenca] = useState<Record<number, EstadoPresenca>>(
+    {}
+  );
   const messagesEndRef = useRef<HTMLDivElement>(null);
+  // O onmessage do socket é criado uma vez; lê o chat aberto por ref
+  const chatSelecionadoRef = useRef<Conversa | null>(null);
+  // refs das mensagens ao vivo que este cliente enviou ou recebeu, à espera do ack
+  const refsPendentes = useRef<Set<string>>(new Set());
   const [param_id, setParam_id] = useState<string | null | undefined>(
     undefined
   );
@@ -55,49 +90,203 @@ const ChatInterface = () => {
     setParam_id(searchParams.get('u'));
   }, [searchParams]);
 
+  useEffect(() => {
+    chatSelecionadoRef.current = chatSelecionado;
+  }, [chatSelecionado]);
+
+  // Maior id_mensagem recebido pelo socket sem lacunas; na reconexão o servidor reenvia só o que veio depois
+  const chaveLastSeen = `chat_last_seen_${MEU_ID}`;
+  const avancarLastSeen = (id?: number) => {
+    if (!id) return;
+    const atual = Number(localStorage.getItem(chaveLastSeen) || 0);
+    if (id > atual) localStorage.setItem(chaveLastSeen, String(id));
+  };
+
   useEffect(() => {
     if (!conversas) return;
     const conversa = conversas.find((a) => a.id_conversa === Number(param_id));
     setChatSelecionado(conversa!);
   }, [param_id, conversas]);
-  // 1. Carregar lista de conversas ao iniciar
+  // 1. Carregar lista de conversas ao iniciar (e quando o socket pede recarga)
   useEffect(() => {
     if (!user) return;
     fetch(`${API_BASE_URL}/chat/conversas/${MEU_ID}`)
       .then((res) => res.json())
-      .then((data) => setConversas(data))
+      .then((data: Conversa[]) => {
+        setConversas(data);
+        if (!data.length) return;
+        // Uma chamada para a lista toda; depois o socket manda só as mudanças
+        const ids = data.map((c) => c.outro_usuario_id).join(',');
+        return fetch(`${API_BASE_URL}/presenca?ids=${ids}`)
+          .then((res) => res.json())
+          .then((estados) => setPresenca((prev) => ({ ...prev, ...estados })));
+      })
       .catch((err) => console.error('Erro ao carregar conversas:', err));
-  }, [MEU_ID, user]);
+  }, [MEU_ID, user, recarga]);
+
+  // Aba em segundo plano conta como "ausente" para quem conversa comigo
+  useEffect(() => {
+    if (!socket) return;
+    const avisar = () => {
+      if (socket.readyState !== WebSocket.OPEN) return;
+      socket.send(
+        JSON.stringify({
+          type: 'presenca',
+          estado: document.hidden ? 'ausente' : 'online',
+        })
+      );
+    };
+    document.addEventListener('visibilitychange', avisar);
+    return () => document.removeEventListener('visibilitychange', avisar);
+  }, [socket]);
 
   // 2. Conectar ao WebSocket
   useEffect(() => {
-    const ws = new WebSocket(`${API_BASE_SOCKET_URL}/ws/${MEU_ID}`);
+    const lastSeen = localStorage.getItem(chaveLastSeen);
+    const ws = new WebSocket(
+      `${API_BASE_SOCKET_URL}/ws/${MEU_ID}${
+        lastSeen ? `?last_seen=${lastSeen}` : ''
+      }`
+    );
 
     ws.onopen = () => {
       console.log('Conectado ao Chat WS');
     };
 
+    // Com last_seen o servidor reenvia o que faltou e fecha com um frame 'sync'. Até lá o cursor
+    // não avança: um reenvio interrompido não pode pular mensagens que nunca chegaram.
+    let emReenvio = !!lastSeen;
+    let recebidasNoReenvio = 0;
+    let maiorNoReenvio = 0;
+    // Lacuna (frame descartado pela fila do servidor, reenvio incompleto): o cursor fica parado
+    // até a próxima conexão, que reenvia a partir dele, e a tela recorre ao histórico
+    let lacuna = false;
+    const registrar = (id?: number) => {
+      if (!id || lacuna) return;
+      if (emReenvio) maiorNoReenvio = Math.max(maiorNoReenvio, id);
+      else avancarLastSeen(id);
+    };
+    const marcarLacuna = () => {
+      if (lacuna) return;
+      lacuna = true;
+      setRecarga((n) => n + 1);
+    };
+
     ws.onmessage = (event) => {
-      const data = JSON.parse(event.data);
-
-      setMensagens((prev) => [
-        ...prev,
-        {
-          from_id: data.from_id,
-          conteudo: data.message,
-          timestamp: data.timestamp,
-        },
-      ]);
+      const data: FrameSocket = JSON.parse(event.data);
+
+      if (data.type === 'presenca') {
+        if (data.estados) {
+          const estados = data.estados;
+          setPresenca((prev) => ({ ...prev, ...estados }));
+        } else if (data.id_usuario) {
+          setPresenca((prev) => ({ ...prev, [data.id_usuario!]: data.estado! }));
+        }
+        return;
+      }
+      if (data.type === 'ping') {
+        // Heartbeat do servidor: sem resposta o socket é fechado por inatividade
+        ws.send(JSON.stringify({ type: 'pong' }));
+        return;
+      }
+      if (data.type === 'sync') {
+        const semPerdas = recebidasNoReenvio === data.enviadas;
+        emReenvio = false;
+        if (!semPerdas) {
+          marcarLacuna();
+        } else if (!data.completo) {
+          // Reenvio parou no limite: o cursor vai até onde chegou e o restante vem do histórico
+          avancarLastSeen(data.ultimo_id);
+          marcarLacuna();
+        } else {
+          registrar(maiorNoReenvio);
+        }
+        return;
+      }
+      if (data.type === 'ack') {
+        // Mensagem gravada: guarda o id para a próxima reconexão, se a mensagem chegou a este cliente
+        if (data.ref && refsPendentes.current.delete(data.ref)) {
+          registrar(data.id_mensagem);
+        } else {
+          marcarLacuna();
+        }
+        setMensagens((prev) =>
+          prev.map((m) =>
+            m.ref && m.ref === data.ref ? { ...m, id: data.id_mensagem } : m
+          )
+        );
+        return;
+      }
+      if (data.type && data.type !== 'message') return;
+
+      // Reenviada: já tem id e não tem ref. Ao vivo: tem ref e o id chega depois, no ack
+      const reenviada = !data.ref;
+      if (reenviada) {
+        recebidasNoReenvio += 1;
+        registrar(data.id_mensagem);
+      } else {
+        refsPendentes.current.add(data.ref!);
+      }
+      const aberto = chatSelecionadoRef.current;
+      const daConversaAberta =
+        !!aberto &&
+        (data.from_id === aberto.outro_usuario_id ||
+          (data.from_id === MEU_ID &&
+            data.id_conversa === aberto.id_conversa));
+
+      if (!daConversaAberta) {
+        setConversas((prev) =>
+          prev.map((c) =>
+            c.outro_usuario_id === data.from_id
+              ? {
+                  ...c,
+                  ultima_mensagem: data.message,
+                  // A contagem carregada do servidor já inclui as reenviadas
+                  nao_lidas: (c.nao_lidas || 0) + (reenviada ? 0 : 1),
+                }
+              : c
+          )
+        );
+        return;
+      }
+
+      if (data.from_id !== MEU_ID) {
+        ws.send(JSON.stringify({ type: 'read', target_id: data.from_id }));
+      }
+      setMensagens((prev) =>
+        data.id_mensagem && prev.some((m) => m.id === data.id_mensagem)
+          ? prev
+          : [
+              ...prev,
+              {
+                id: data.id_mensagem,
+                ref: data.ref,
+                from_id: data.from_id!,
+                conteudo: data.message!,
+                timestamp: data.timestamp,
+              },
+            ]
+      );
     };
 
-    ws.onclose = () => console.log('Desconectado do Chat WS');
+    let encerrado = false;
+    let timer: ReturnType<typeof setTimeout> | undefined;
+    ws.onclose = (event) => {
+      console.log('Desconectado do Chat WS', event.code);
+      if (encerrado) return;
+      // 1012: worker reiniciando; 1013: servidor cheio. O reenvio com last_seen recupera o que faltou
+      const espera = event.code === 1013 ? 5000 : 1000;
+      timer = setTimeout(() => setReconexao((n) => n + 1), espera);
+    };
 
     setSocket(ws);
 
     return () => {
+      encerrado = true;
+      clearTimeout(timer);
       ws.close();
     };
-  }, [MEU_ID]);
+  }, [MEU_ID, reconexao]);
 
   // 3. Carregar histórico ao selecionar um chat
   useEffect(() => {
@@ -109,6 +298,7 @@ const ChatInterface = () => {
         .then((res) => res.json())
         .then((data) => {
           const msgsFormatadas = data.map((m: any) => ({
+            id: m.id_mensagem,
             from_id: m.id_remetente,
             conteudo: m.conteudo,
             timestamp: m.enviadoEm,
@@ -116,8 +306,25 @@ const ChatInterface = () => {
           setMensagens(msgsFormatadas);
         })
         .catch((err) => console.error('Erro ao carregar histórico:', err));
+
+      // Marca a conversa como lida
+      if (socket?.readyState === WebSocket.OPEN) {
+        socket.send(
+          JSON.stringify({
+            type: 'read',
+            target_id: chatSelecionado.outro_usuario_id,
+          })
+        );
+      }
+      setConversas((prev) =>
+        prev.map((c) =>
+          c.id_conversa === chatSelecionado.id_conversa
+            ? { ...c, nao_lidas: 0 }
+            : c
+        )
+      );
     }
-  }, [chatSelecionado, MEU_ID]);
+  }, [chatSelecionado, MEU_ID, recarga]);
 
   // 4. Scroll automático para baixo
   useEffect(() => {
@@ -128,16 +335,21 @@ const ChatInterface = () => {
     e.preventDefault();
     if (!inputMsg.trim() || !socket || !chatSelecionado) return;
 
+    // `ref` liga a mensagem otimista ao ack com o id gravado
+    const ref = `${Date.now()}-${Math.random().toString(36).slice(2)}`;
     const payload = {
       target_id: chatSelecionado.outro_usuario_id,
       message: inputMsg,
+      ref,
     };
+    refsPendentes.current.add(ref);
     socket.send(JSON.stringify(payload));
 
     // Adiciona otimistamente na UI
     setMensagens((prev) => [
       ...prev,
       {
+        ref,
         from_id: MEU_ID!,
         conteudo: inputMsg,
         timestamp: new Date().toISOString(),
@@ -172,9 +384,28 @@ const ChatInterface = () => {
                 <div className={styles.avatar}>
                   <span>{c.outro_usuario_nome.charAt(0).toUpperCase()}</span>
                 </div>
-                <div className={styles.conversationName}>
-                  {c.outro_usuario_nome}
+                <div className={styles.conversationText}>
+                  <div className={styles.conversationName}>
+                    {c.outro_usuario_nome}{' '}
+                    {presenca[c.outro_usuario_id] === 'online' && (
+                      <span className={styles.statusDot} title='Online' />
+                    )}
+                    {presenca[c.outro_usuario_id] === 'ausente' && (
+                      <span
+                        className={`${styles.statusDot} ${styles.statusAway}`}
+                        title='Ausente'
+                      />
+                    )}
+                  </div>
+                  {c.ultima_mensagem && (
+                    <div className={styles.conversationHint}>
+                      {c.ultima_mensagem}
+                    </div>
+                  )}
                 </div>
+                {!!c.nao_lidas && (
+                  <span className={styles.unreadBadge}>{c.nao_lidas}</span>
+                )}
               </div>
             </li>
           ))}
@@ -194,7 +425,20 @@ const ChatInterface = () => {
                 </div>
                 {chatSelecionado.outro_usuario_nome}
               </span>
-              <span className={styles.onlineStatus}></span>
+              <span className={styles.onlineStatus}>
+                {presenca[chatSelecionado.outro_usuario_id] === 'online' && (
+                  <>
+                    <span className={styles.statusDot} />
+                    Online
+                  </>
+                )}
+                {presenca[chatSelecionado.outro_usuario_id] === 'ausente' && (
+                  <>
+                    <span className={`${styles.statusDot} ${styles.statusAway}`} />
+                    Ausente
+                  </>
+                )}
+              </span>
             </div>
 
             {/* Mensagens */}
@@ -19,6 +19,7 @@ export interface Terapeuta {
   CRP: string;
   disponibilidade: string;
   total_sessoes_concluidas: number;
+  favorito?: boolean;
 }
 
 export interface PageMetadata {
@@ -32,32 +33,32 @@ const PageContent = () => {
   const { user } = useAuth();
   const [terapeutas, setTerapeutas] = useState<Terapeuta[]>([]);
   const [especialidade, setEspecialidade] = useState('');
-  const [favoritos, setFavoritos] = useState<Terapeuta[]>([]);
   const [loading, setLoading] = useState(false);
   const [page, setPage] = useState(1);
   const [metadata, setMetadata] = useState<PageMetadata>();
   const [firstLoad, setFirstLoad] = useState(true);
+  const [presenca, setPresenca] = useState<Record<number, string>>({});
 
   useEffect(() => {
     const terapeutasCache = localStorage.getItem('terapeutas');
-    const favoritosCache = localStorage.getItem('favoritos');
     if (terapeutasCache) setTerapeutas(JSON.parse(terapeutasCache));
-    if (favoritosCache) setFavoritos(JSON.parse(favoritosCache));
     fetchTerapeutas();
-    fetchFavoritos();
     setFirstLoad(false);
   }, [page]);
 
   const fetchTerapeutas = async (pageNumber = 1) => {
     try {
+      // Com id_usuario o servidor já marca `favorito` em cada terapeuta
+      const doUsuario = user ? `&id_usuario=${user.id}` : '';
       const url = especialidade
-        ? `${process.env.NEXT_PUBLIC_SERVER_URL}/terapeutas?especialidade=${especialidade}&page=${pageNumber}&limit=9`
-        : `${process.env.NEXT_PUBLIC_SERVER_URL}/terapeutas?page=${pageNumber}&limit=9`;
+        ? `${process.env.NEXT_PUBLIC_SERVER_URL}/terapeutas?especialidade=${especialidade}&page=${pageNumber}&limit=9${doUsuario}`
+        : `${process.env.NEXT_PUBLIC_SERVER_URL}/terapeutas?page=${pageNumber}&limit=9${doUsuario}`;
 
       const res = await axios.get(url);
 
       setTerapeutas(res.data.terapeutas);
       setMetadata(res.data.metadata);
+      fetchPresenca(res.data.terapeutas);
 
       localStorage.setItem('terapeutas', JSON.stringify(res.data.terapeutas));
     } catch (err) {
@@ -65,14 +66,15 @@ const PageContent = () => {
     }
   };
 
-  const fetchFavoritos = async () => {
-    if (!user) return;
+  // Status de todos os terapeutas da página numa chamada só
+  const fetchPresenca = async (lista: Terapeuta[]) => {
+    if (!lista.length) return;
     try {
+      const ids = lista.map((t) => t.id_usuario).join(',');
       const { data } = await axios.get(
-        `${process.env.NEXT_PUBLIC_SERVER_URL}/usuarios/${user.id}/terapeutas`
+        `${process.env.NEXT_PUBLIC_SERVER_URL}/presenca?ids=${ids}`
       );
-      setFavoritos(data);
-      localStorage.setItem('favoritos', JSON.stringify(data));
+      setPresenca(data);
     } catch (err) {
       console.error(err);
     }
@@ -80,7 +82,6 @@ const PageContent = () => {
 
   useEffect(() => {
     fetchTerapeutas(page);
-    fetchFavoritos();
   }, [page]);
 
   useEffect(() => {
@@ -92,10 +93,13 @@ const PageContent = () => {
     return () => clearTimeout(timer);
   }, [especialidade]);
 
+  // Marca o favorito na própria lista; não precisa buscar os favoritos de novo
   const handleFavoritar = (novo: Terapeuta) => {
-    const atualizados = [...favoritos, novo];
-    setFavoritos(atualizados);
-    localStorage.setItem('favoritos', JSON.stringify(atualizados));
+    const atualizados = terapeutas.map((t) =>
+      t.id_usuario === novo.id_usuario ? { ...t, favorito: true } : t
+    );
+    setTerapeutas(atualizados);
+    localStorage.setItem('terapeutas', JSON.stringify(atualizados));
   };
 
   const handlePageChange = (_: any, value: number) => {
@@ -137,7 +141,7 @@ const PageContent = () => {
                     <Card
                       key={terapeuta.id_usuario}
                       terapeuta={terapeuta}
-                      favoritos={favoritos}
+                      presenca={presenca[terapeuta.id_usuario]}
                       onFavoritar={() => handleFavoritar(terapeuta)}
                     />
                   ))}
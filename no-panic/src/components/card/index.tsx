@@ -12,11 +12,11 @@ import { toast } from 'react-toastify';
 
 type Prop = {
   terapeuta: Terapeuta;
-  favoritos: Terapeuta[];
+  presenca?: string;
   onFavoritar: () => void;
 };
 
-export const Card = ({ terapeuta, favoritos, onFavoritar }: Prop) => {
+export const Card = ({ terapeuta, presenca, onFavoritar }: Prop) => {
   const [loading, setLoading] = useState(false);
   const { user } = useAuth();
 
@@ -44,10 +44,6 @@ export const Card = ({ terapeuta, favoritos, onFavoritar }: Prop) => {
     }
   };
 
-  const jaFavoritado = favoritos.some(
-    (f) => f.id_usuario === terapeuta.id_usuario
-  );
-
   return (
     <div className={styles.card}>
       <div className={styles.info}>
@@ -57,6 +53,14 @@ export const Card = ({ terapeuta, favoritos, onFavoritar }: Prop) => {
             {terapeuta.nome.split(' ')[0]}{' '}
             {terapeuta.nome.split(' ').length > 1 &&
               terapeuta.nome.split(' ')[terapeuta.nome.split(' ').length - 1]}
+            {(presenca === 'online' || presenca === 'ausente') && (
+              <span
+                className={`${styles.presenca} ${
+                  presenca === 'ausente' ? styles.ausente : ''
+                }`}
+                title={presenca === 'online' ? 'Online' : 'Ausente'}
+              />
+            )}
           </h4>
           <p title='CRP do profissional'>{terapeuta.CRP}</p>
         </div>
@@ -77,7 +81,7 @@ export const Card = ({ terapeuta, favoritos, onFavoritar }: Prop) => {
           )}
         </p> */}
       </div>
-      {jaFavoritado ? (
+      {terapeuta.favorito ? (
         <Button
           onClick={() => toast.info('Já favoritado')}
           style={{
@@ -93,6 +93,7 @@ const HeaderComponent = () => {
           id_usuario: user?.id,
           id_terapeuta: user?.terapeuta_fav,
           data_hora_agendamento: horaFormatada,
+          encaixe: true,
         }
       );
       setSessao(response.data.uuid);